@@ -0,0 +1,221 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Micro-benchmarks
+================
+
+Timings of the hot paths of solango against the implementations they
+replaced. Run them from ``manage.py shell``::
+
+    from solango import benchmarks
+    benchmarks.xml_parsers()
+    benchmarks.facets()
+    benchmarks.deferred_cache()
+"""
+
+import time
+import timeit
+
+from xml.dom import minidom
+
+from solango import conf
+from solango.solr import xmlutils
+from solango.solr.facet import Facet
+
+UPDATE_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<response>
+<lst name="responseHeader"><int name="status">0</int><int name="QTime">3</int></lst>
+</response>
+"""
+
+def large_response(rows=1000):
+    """
+    A select response with rows documents and a facet list.
+    """
+    docs = []
+    for i in range(rows):
+        docs.append('<doc><str name="id">blog__entry__%d</str>'
+                    '<str name="model">blog__entry</str>'
+                    '<str name="title"><![CDATA[Entry & title %d]]></str>'
+                    '<date name="date">2008-06-01T12:00:00Z</date>'
+                    '<float name="score">%d.5</float><bool name="public">true</bool>'
+                    '<arr name="tags"><str>django</str><str>solr</str></arr>'
+                    '<long name="views">%d</long></doc>' % (i, i, i, i * 1000))
+    facets = "".join(['<int name="tag%d">%d</int>' % (i, i) for i in range(rows)])
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<response>'
+            '<lst name="responseHeader"><int name="status">0</int>'
+            '<int name="QTime">12</int><lst name="params"><str name="q">*:*</str>'
+            '<str name="rows">%d</str></lst></lst>'
+            '<result name="response" numFound="%d" start="0">%s</result>'
+            '<lst name="facet_counts"><lst name="facet_fields">'
+            '<lst name="tags">%s</lst></lst></lst>'
+            '<arr name="docs">%s</arr></response>' %
+            (rows, rows, "".join(docs), facets, "".join(docs)))
+
+def parse_minidom(xml):
+    """
+    The minidom parsing solango used to do, with the original xmlutils
+    helpers, for comparison.
+    """
+    doc = minidom.parseString(xml)
+    try:
+        return xmlutils.get_dictionary(doc.documentElement)
+    finally:
+        doc.unlink()
+
+def header_minidom(xml):
+    """
+    The header parsing of UpdateResults before it streamed.
+    """
+    doc = minidom.parseString(xml)
+    try:
+        header = xmlutils.get_child_node(doc.firstChild, "lst",
+                                         "responseHeader")
+        return xmlutils.get_dictionary(header)
+    finally:
+        doc.unlink()
+
+def header_streaming(xml):
+    from solango.solr.results import UpdateResults
+    return UpdateResults(xml).header
+
+def _time(function, number):
+    return min(timeit.Timer(function).repeat(3, number)) / number
+
+def xml_parsers(number=1000, rows=1000):
+    """
+    Prints the time per call of minidom and of xmlutils for update responses,
+    for the header of a large response, and for a whole large response.
+    """
+    large = large_response(rows)
+
+    assert parse_minidom(large) == xmlutils.parse_string(large)
+    assert header_minidom(UPDATE_RESPONSE) == header_streaming(UPDATE_RESPONSE)
+
+    cases = (("update response", number,
+              lambda: header_minidom(UPDATE_RESPONSE),
+              lambda: header_streaming(UPDATE_RESPONSE)),
+             ("header of %d rows" % rows, max(1, number / 100),
+              lambda: header_minidom(large),
+              lambda: header_streaming(large)),
+             ("all of %d rows" % rows, max(1, number / 100),
+              lambda: parse_minidom(large),
+              lambda: xmlutils.parse_string(large)))
+
+    for name, count, old, new in cases:
+        old, new = _time(old, count), _time(new, count)
+        print "%-20s minidom %9.3f ms  streaming %9.3f ms  %5.1fx" % \
+                (name, old * 1000, new * 1000, old / new)
+
+class LinearFacet(Facet):
+    """
+    The facet merge solango used to do, for comparison: a linear scan for
+    every parent and a walk up the ancestors for every child.
+    """
+
+    def get_parent(self, value):
+        n = value.value.rfind(conf.SEARCH_SEPARATOR)
+        if n == -1:
+            return None
+        p = value.value[:n]
+        for v in self.values:
+            if v.value == p:
+                return v
+        f = self.create_value(p, 0)
+        self.values.append(f)
+        return f
+
+    def add_to_parent(self, parent, child):
+        child.parent = parent
+        parent.children.append(child)
+        p = parent
+        while(p):
+            p.count += child.count
+            p = p.parent
+
+    def recurse_children(self, value):
+        if value.parent is None:
+            self.values.append(value)
+        if value.parent:
+            value.level = value.parent.level + 1
+        if value.children:
+            value.value += "*"
+        for c in value.children:
+            self.recurse_children(c)
+
+def hierarchical_values(count, fanout=10):
+    """
+    Solr facet counts, a flat [value, count, ...] list, for a category tree
+    of about count values with fanout children per category. Only some of
+    the inner categories are in the list, the others are created by the
+    merge.
+    """
+    sep = conf.SEARCH_SEPARATOR
+    values = []
+    paths = [""]
+    while len(values) < count * 2:
+        children = []
+        for path in paths:
+            for i in range(fanout):
+                child = path and "%s%s%d" % (path, sep, i) or "cat%d" % i
+                children.append(child)
+                if len(values) < count * 2 and (i % 3 or len(child) > 12):
+                    values.extend([child, i + 1])
+        paths = children
+    return values
+
+def _tree(values):
+    return [(v.value, v.count, v.level, _tree(v.children)) for v in values]
+
+def facets(sizes=(10000, 50000, 100000), linear_limit=10000):
+    """
+    Prints the time to merge hierarchical facets of every size in sizes, and
+    of the linear merge for the sizes up to linear_limit.
+    """
+    for size in sizes:
+        values = hierarchical_values(size)
+
+        started = time.time()
+        facet = Facet("category", list(values))
+        elapsed = time.time() - started
+
+        if size > linear_limit:
+            print "%7d values  indexed %9.1f ms" % (size, elapsed * 1000)
+            continue
+
+        started = time.time()
+        linear = LinearFacet("category", list(values))
+        linear_elapsed = time.time() - started
+
+        assert _tree(facet.values) == _tree(linear.values)
+        print "%7d values  indexed %9.1f ms  linear %9.1f ms  %6.1fx" % \
+                (size, elapsed * 1000, linear_elapsed * 1000,
+                 linear_elapsed / elapsed)
+
+def deferred_cache(sizes=(10, 1000, 100000), number=1000):
+    """
+    Prints the time per add of the cache deferred backend with sizes
+    operations already waiting, and the time to read a batch of number.
+    """
+    from django.core.cache import get_cache
+    from solango.deferred.cache import Deferred
+
+    for size in sizes:
+        deferred = Deferred(get_cache("locmem://?max_entries=%d" %
+                                      (size + number * 2 + 100)))
+        xml = u'<doc><field name="id">blog__entry__%d</field></doc>'
+        for i in range(size):
+            deferred.add("add", xml % i, "blog__entry__%d" % i)
+
+        started = time.time()
+        for i in range(number):
+            deferred.add("add", xml % i, "blog__entry__%d" % i)
+        added = (time.time() - started) / number
+
+        started = time.time()
+        deferred.pending(number)
+        read = time.time() - started
+        print "%7d waiting  add %7.3f ms  pending(%d) %8.1f ms" % \
+                (size, added * 1000, number, read * 1000)
@@ -0,0 +1,148 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Cache Log
+=========
+
+A log of values in the Django cache, one key per position, behind the
+"cache" backends of the deferred operations and of the indexing queue::
+
+    log = CacheLog("solango_queue", timeout=3600)
+    log.write(log.next(), value)
+    for id, value in log.read(500):
+        ...
+    log.remove(ids)
+
+A counter that is increased atomically with incr hands out the positions,
+so processes never overwrite each other's values and a write costs the same
+no matter how many are waiting. The oldest position that wasn't removed yet
+is kept under another key, reads start from there.
+
+A writer takes its position before it writes the value, so an empty
+position may still be written. Removed values are overwritten with a marker
+instead of being deleted, and the head only moves past an empty position
+once it has been empty for ``grace`` seconds, it was evicted then.
+"""
+
+import time
+
+from django.core.cache import cache as default_cache
+
+# Written over removed values.
+REMOVED = "removed"
+
+class CacheLog(object):
+    """
+    ..attribute: prefix
+
+        Prefix of the cache keys of the log.
+
+    ..attribute: grace
+
+        Seconds a position may stay empty before the head moves past it.
+
+    ..attribute: scan_size
+
+        Positions read with one get_many.
+    """
+
+    grace = 60
+    scan_size = 1000
+
+    def __init__(self, prefix, timeout, cache=None):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.cache = cache or default_cache
+
+    def key(self, name):
+        return "%s_%s" % (self.prefix, name)
+
+    def next(self):
+        """
+        Takes the next position.
+        """
+        self.cache.add(self.key("tail"), 0, self.timeout)
+        try:
+            return self.cache.incr(self.key("tail"))
+        except ValueError:
+            # Evicted between the add and the incr.
+            self.cache.add(self.key("tail"), 0, self.timeout)
+            return self.cache.incr(self.key("tail"))
+
+    def write(self, id, value):
+        self.cache.set(self.key(id), value, self.timeout)
+
+    def range(self):
+        head = self.cache.get(self.key("head")) or 0
+        tail = self.cache.get(self.key("tail")) or 0
+        return head, tail
+
+    def read(self, limit=None):
+        """
+        Returns the (position, value) of the limit oldest values, of all of
+        them without limit.
+        """
+        head, tail = self.range()
+        scan_size = self.scan_size
+        if limit:
+            scan_size = min(scan_size, limit)
+
+        # Removed values behind a position that is still empty are skipped
+        # until limit values are found.
+        found = []
+        for start in range(head + 1, tail + 1, scan_size):
+            ids = range(start, min(tail, start + scan_size - 1) + 1)
+            values = self.cache.get_many([self.key(id) for id in ids])
+            for id in ids:
+                value = values.get(self.key(id))
+                if value is not None and value != REMOVED:
+                    found.append((id, value))
+                    if limit and len(found) >= limit:
+                        return found
+        return found
+
+    def _gone(self, id):
+        """
+        True once position id has been empty for grace seconds.
+        """
+        key = self.key("empty_%d" % id)
+        self.cache.add(key, time.time(), self.timeout)
+        seen = self.cache.get(key)
+        return seen is not None and time.time() - seen >= self.grace
+
+    def remove(self, ids):
+        ids = set(ids)
+        if not ids:
+            return
+        self.cache.set_many(dict([(self.key(id), REMOVED) for id in ids]),
+                            self.timeout)
+
+        # The head moves past the removed values, up to the first one that
+        # is still waiting or may still be written.
+        head, tail = self.range()
+        start = head
+        while head < tail:
+            positions = range(head + 1, min(tail, head + self.scan_size) + 1)
+            values = self.cache.get_many([self.key(id) for id in positions])
+            for id in positions:
+                value = values.get(self.key(id))
+                if value is None:
+                    if not self._gone(id):
+                        break
+                elif value != REMOVED:
+                    break
+                head = id
+            if head < positions[-1]:
+                break
+        if head > start:
+            self.cache.set(self.key("head"), head, self.timeout)
+            passed = range(start + 1, head + 1)
+            self.cache.delete_many([self.key(id) for id in passed] +
+                                   [self.key("empty_%d" % id)
+                                    for id in passed])
+
+    def count(self):
+        head, tail = self.range()
+        return max(0, tail - head)
@@ -0,0 +1,185 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Reindex Checkpoints
+===================
+
+A reindex saves a checkpoint after every batch so a failed run can pick up
+where it stopped (``manage.py solr --reindex --resume``) instead of starting
+from zero::
+
+    from solango.checkpoint import get_checkpoint
+
+    checkpoint = get_checkpoint()
+    checkpoint.save("blog__entry:0", {"last_pk": 1200, "count": 1200, ...})
+    checkpoint.load("blog__entry:0")
+
+A checkpoint is a dictionary with the keys of ``FIELDS``. Checkpoints are kept
+in one file per key in SOLR_CHECKPOINT_DIR ("file") or in the
+``ReindexCheckpoint`` table ("database"), see SOLR_CHECKPOINT_BACKEND.
+"""
+
+import os
+import re
+import tempfile
+
+from django.utils import simplejson
+
+from solango import conf
+
+FIELDS = ("last_pk", "after", "upto", "count", "deleted", "failed", "done")
+
+class BaseCheckpoint(object):
+
+    def load(self, key):
+        """
+        Returns the checkpoint saved under key, or None.
+        """
+        raise NotImplementedError
+
+    def save(self, key, state):
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """
+        Returns a dictionary of the checkpoints whose key starts with prefix.
+        """
+        raise NotImplementedError
+
+    def remove(self, key):
+        raise NotImplementedError
+
+    def clear(self, prefix):
+        """
+        Removes the checkpoints whose key starts with prefix.
+        """
+        raise NotImplementedError
+
+class FileCheckpoint(BaseCheckpoint):
+    """
+    One JSON file per key, replaced atomically, so worker processes never
+    write to the same file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or conf.SOLR_CHECKPOINT_DIR or \
+                        os.path.join(tempfile.gettempdir(), "solango")
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def _filename(self, key):
+        return os.path.join(self.path, "%s.checkpoint" %
+                            re.sub(r"[^\w.:-]", "_", key))
+
+    def _keys(self, prefix):
+        prefix = os.path.basename(self._filename(prefix))[:-len(".checkpoint")]
+        return [name[:-len(".checkpoint")] for name in os.listdir(self.path)
+                if name.startswith(prefix) and name.endswith(".checkpoint")]
+
+    def load(self, key):
+        try:
+            f = open(self._filename(key))
+        except IOError:
+            return None
+        try:
+            return simplejson.load(f)
+        finally:
+            f.close()
+
+    def save(self, key, state):
+        filename = self._filename(key)
+        tmp = "%s.%s" % (filename, os.getpid())
+        f = open(tmp, "w")
+        try:
+            simplejson.dump(dict([(name, state.get(name)) for name in FIELDS]),
+                            f)
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+
+    def list(self, prefix):
+        checkpoints = {}
+        for key in self._keys(prefix):
+            state = self.load(key)
+            if state is not None:
+                checkpoints[key] = state
+        return checkpoints
+
+    def remove(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self, prefix):
+        for key in self._keys(prefix):
+            self.remove(key)
+
+class DatabaseCheckpoint(BaseCheckpoint):
+    """
+    Checkpoints in the ReindexCheckpoint table.
+    """
+
+    def _state(self, obj):
+        return dict([(name, getattr(obj, name)) for name in FIELDS])
+
+    def load(self, key):
+        from solango.models import ReindexCheckpoint
+        try:
+            return self._state(ReindexCheckpoint.objects.get(key=key))
+        except ReindexCheckpoint.DoesNotExist:
+            return None
+
+    def save(self, key, state):
+        from solango.models import ReindexCheckpoint
+        obj, created = ReindexCheckpoint.objects.get_or_create(key=key)
+        for name in FIELDS:
+            value = state.get(name)
+            if name in ("count", "deleted", "failed"):
+                value = value or 0
+            elif name == "done":
+                value = bool(value)
+            elif value is not None:
+                value = unicode(value)
+            setattr(obj, name, value)
+        obj.save()
+
+    def list(self, prefix):
+        from solango.models import ReindexCheckpoint
+        return dict([(obj.key, self._state(obj)) for obj in
+                     ReindexCheckpoint.objects.filter(key__startswith=prefix)])
+
+    def remove(self, key):
+        from solango.models import ReindexCheckpoint
+        ReindexCheckpoint.objects.filter(key=key).delete()
+
+    def clear(self, prefix):
+        from solango.models import ReindexCheckpoint
+        ReindexCheckpoint.objects.filter(key__startswith=prefix).delete()
+
+def make_key(document_key, part=""):
+    """
+    Checkpoint keys are the document key and the part of the run. A serial
+    reindex is part 0, so it can resume the first part of a parallel run.
+    """
+    return u"%s:%s" % (document_key, part)
+
+HANDLERS = {"file": FileCheckpoint,
+            "database": DatabaseCheckpoint}
+
+def get_checkpoint(name=None):
+    """
+    Returns the checkpoint backend called name, SOLR_CHECKPOINT_BACKEND by
+    default, or None if checkpoints are turned off.
+    """
+    if name is None:
+        name = conf.SOLR_CHECKPOINT_BACKEND
+    if not name:
+        return None
+
+    if name not in HANDLERS:
+        raise AttributeError("SOLR_CHECKPOINT_BACKEND must be one of the "
+                             "following: %s" % ", ".join(HANDLERS.keys()))
+    return HANDLERS[name]()
@@ -9,6 +9,101 @@ SEARCH_UPDATE_URL = getattr(settings, "SEARCH_UPDATE_URL", "http://localhost:898
 SEARCH_SELECT_URLS = getattr(settings, "SEARCH_SELECT_URLS", "http://localhost:8983/solr/select")
 SEARCH_PING_URLS =  getattr(settings, "SEARCH_PING_URLS", ["http://localhost:8983/solr/admin/ping",])
 
+### Read replicas. SEARCH_SELECT_URLS may be a list of select urls, selects
+### are spread over them, see solango.solr.router.
+# "least_outstanding" or "latency"
+SEARCH_SELECT_STRATEGY = getattr(settings, "SEARCH_SELECT_STRATEGY", "least_outstanding")
+# Failed requests in a row after which a replica is skipped, and for how many
+# seconds.
+SEARCH_REPLICA_MAX_FAILURES = getattr(settings, "SEARCH_REPLICA_MAX_FAILURES", 2)
+SEARCH_REPLICA_RETRY = getattr(settings, "SEARCH_REPLICA_RETRY", 30)
+
+### Health checks. A background thread pings the SEARCH_PING_URLS every
+### SEARCH_HEALTH_INTERVAL seconds, see solango.solr.health.
+SEARCH_HEALTH_INTERVAL = getattr(settings, "SEARCH_HEALTH_INTERVAL", 30)
+# Seconds a ping waits for an answer.
+SEARCH_HEALTH_TIMEOUT = getattr(settings, "SEARCH_HEALTH_TIMEOUT", 2)
+# Failed pings in a row after which a url is down.
+SEARCH_HEALTH_MAX_FAILURES = getattr(settings, "SEARCH_HEALTH_MAX_FAILURES", 2)
+
+### Timeouts in seconds, None waits for ever. Select, add and delete take a
+### deadline that overrides them.
+SEARCH_SELECT_TIMEOUT = getattr(settings, "SEARCH_SELECT_TIMEOUT", 10)
+SEARCH_UPDATE_TIMEOUT = getattr(settings, "SEARCH_UPDATE_TIMEOUT", 60)
+
+### Circuit breaker, see solango.solr.breaker. Opens after
+### SEARCH_BREAKER_THRESHOLD failed or timed out requests within
+### SEARCH_BREAKER_WINDOW seconds and probes Solr again after
+### SEARCH_BREAKER_RESET seconds. A threshold of 0 turns it off.
+SEARCH_BREAKER_THRESHOLD = getattr(settings, "SEARCH_BREAKER_THRESHOLD", 5)
+SEARCH_BREAKER_WINDOW = getattr(settings, "SEARCH_BREAKER_WINDOW", 60)
+SEARCH_BREAKER_RESET = getattr(settings, "SEARCH_BREAKER_RESET", 30)
+
+### Commits after add, delete and delete_by_query, see solango.solr.commits.
+### "immediate" commits after every write, "within" sends the writes with
+### commitWithin, "coalesce" commits at most once per interval.
+SEARCH_COMMIT_POLICY = getattr(settings, "SEARCH_COMMIT_POLICY", "immediate")
+# Seconds until a write is committed under "within" and "coalesce".
+SEARCH_COMMIT_INTERVAL = getattr(settings, "SEARCH_COMMIT_INTERVAL", 1)
+# Scheduled commits are soft commits (Solr 4), with a hard commit every
+# SEARCH_HARD_COMMIT_INTERVAL seconds.
+SEARCH_COMMIT_SOFT = getattr(settings, "SEARCH_COMMIT_SOFT", False)
+SEARCH_HARD_COMMIT_INTERVAL = getattr(settings, "SEARCH_HARD_COMMIT_INTERVAL", 600)
+
+### Sharded indexes, see solango.solr.indexes.sharded. A list of dictionaries
+### of Index arguments, one per shard.
+SEARCH_SHARDS = getattr(settings, "SEARCH_SHARDS", [])
+# "shards" lets the first shard run a distributed search, "gather" sends the
+# select to every shard and merges the results.
+SEARCH_SHARD_QUERY = getattr(settings, "SEARCH_SHARD_QUERY", "shards")
+# Points per shard on the consistent hash ring.
+SEARCH_SHARD_VNODES = getattr(settings, "SEARCH_SHARD_VNODES", 160)
+
+### Multicore indexes, see solango.solr.indexes.multicore. Maps document keys
+### to a core name or a dictionary of Index arguments.
+SEARCH_CORES = getattr(settings, "SEARCH_CORES", {})
+# The url of a core, %s is the core name.
+SEARCH_CORE_URL = getattr(settings, "SEARCH_CORE_URL", "http://localhost:8983/solr/%s")
+
+### Keep-alive connection pool, one per Solr host.
+SEARCH_POOL_SIZE = getattr(settings, "SEARCH_POOL_SIZE", 10)
+# Seconds an unused connection is kept open.
+SEARCH_POOL_IDLE_TIMEOUT = getattr(settings, "SEARCH_POOL_IDLE_TIMEOUT", 60)
+# Threads sending the requests of select_async, gather_select, ...
+SEARCH_ASYNC_WORKERS = getattr(settings, "SEARCH_ASYNC_WORKERS", 4)
+
+### Update wire format, "xml" or "json" (Solr 3.1 and later).
+SEARCH_UPDATE_FORMAT = getattr(settings, "SEARCH_UPDATE_FORMAT", "xml")
+
+### Select result cache, "locmem", "django" or None to turn it off.
+SEARCH_CACHE_BACKEND = getattr(settings, "SEARCH_CACHE_BACKEND", None)
+# Seconds a result is cached, unless a select passes cache_ttl.
+SEARCH_CACHE_TTL = getattr(settings, "SEARCH_CACHE_TTL", 60)
+# Maximum number of results of the "locmem" cache.
+SEARCH_CACHE_SIZE = getattr(settings, "SEARCH_CACHE_SIZE", 1000)
+
+### Buffered signal indexing. Saves and deletes are sent in batches at the end
+### of the request instead of one request each, see solango.solr.buffer.
+SEARCH_BUFFER_WRITES = getattr(settings, "SEARCH_BUFFER_WRITES", False)
+# Pending documents that trigger a flush.
+SEARCH_BUFFER_SIZE = getattr(settings, "SEARCH_BUFFER_SIZE", 100)
+# Seconds a pending document waits at most, None to wait for the request end.
+SEARCH_BUFFER_INTERVAL = getattr(settings, "SEARCH_BUFFER_INTERVAL", None)
+# "flush" to commit after every flush, None to leave it to Solr's autoCommit.
+SEARCH_BUFFER_COMMIT = getattr(settings, "SEARCH_BUFFER_COMMIT", "flush")
+
+### Queued indexing, "database", "sqlite", "cache" or None to index in the
+### request. Queued documents are sent by manage.py solr --worker.
+SEARCH_QUEUE_BACKEND = getattr(settings, "SEARCH_QUEUE_BACKEND", None)
+# File of the "sqlite" backend, required by it. Keep it out of the temp
+# directory, which reboots and tmp cleaners empty.
+SEARCH_QUEUE_PATH = getattr(settings, "SEARCH_QUEUE_PATH", None)
+# Seconds events are kept by the "cache" backend.
+SEARCH_QUEUE_CACHE_TIMEOUT = getattr(settings, "SEARCH_QUEUE_CACHE_TIMEOUT", 7 * 24 * 3600)
+# Events the worker sends per batch, and seconds it sleeps on an empty queue.
+SEARCH_QUEUE_BATCH_SIZE = getattr(settings, "SEARCH_QUEUE_BATCH_SIZE", 1000)
+SEARCH_QUEUE_POLL_INTERVAL = getattr(settings, "SEARCH_QUEUE_POLL_INTERVAL", 1)
+
 #### SOLR
 SOLR_ROOT = getattr(settings,"SOLR_ROOT", None)
 SOLR_SCHEMA_PATH = getattr(settings,"SOLR_SCHEMA_PATH", None)
@@ -17,6 +112,17 @@ SOLR_DATA_DIR = getattr(settings,"SOLR_DATA_DIR", None)
 ### BATCH INDEX SIZE
 SOLR_BATCH_INDEX_SIZE = getattr(settings,"SOLR_BATCH_INDEX_SIZE", 10)
 
+### Reindex commits. By default a reindex commits once when it is done, set
+### these to also commit every n documents and/or every n seconds.
+SOLR_BATCH_COMMIT_SIZE = getattr(settings, "SOLR_BATCH_COMMIT_SIZE", None)
+SOLR_BATCH_COMMIT_INTERVAL = getattr(settings, "SOLR_BATCH_COMMIT_INTERVAL", None)
+
+### Reindex checkpoints, "file", "database" or None to turn them off.
+SOLR_CHECKPOINT_BACKEND = getattr(settings, "SOLR_CHECKPOINT_BACKEND", "file")
+# Directory of the "file" backend, defaults to a solango directory in the
+# system's temp directory.
+SOLR_CHECKPOINT_DIR = getattr(settings, "SOLR_CHECKPOINT_DIR", None)
+
 #### Default Query Operator
 SOLR_DEFAULT_OPERATOR = getattr(settings, "SOLR_DEFAULT_OPERATOR", "OR")
 
@@ -57,4 +163,16 @@ SEARCH_SEPARATOR = getattr(settings, "SEARCH_SEPARATOR", "__")
 FACET_SEPARATOR = getattr(settings, "FACET_SEPARATOR", ";;")
 
 ########## DEFERRED_BACKEND ##########
-DEFERRED_BACKEND = "database"
\ No newline at end of file
+# "database", "file", "cache" or "dummy"
+DEFERRED_BACKEND = getattr(settings, "DEFERRED_BACKEND", "database")
+# Seconds the "cache" backend keeps a deferred operation.
+DEFERRED_CACHE_TIMEOUT = getattr(settings, "DEFERRED_CACHE_TIMEOUT", 30 * 24 * 3600)
+# Directory of the "file" backend, required by it. Keep it out of the temp
+# directory, which reboots and tmp cleaners empty.
+DEFERRED_FILE_DIR = getattr(settings, "DEFERRED_FILE_DIR", None)
+# Bytes of a segment of the "file" backend before it moves on to the next.
+DEFERRED_FILE_SEGMENT_SIZE = getattr(settings, "DEFERRED_FILE_SEGMENT_SIZE", 64 * 1024 * 1024)
+# Seconds between fsyncs of the "file" backend, 0 to fsync every operation.
+DEFERRED_FILE_SYNC_INTERVAL = getattr(settings, "DEFERRED_FILE_SYNC_INTERVAL", 1)
+# Compress the operations of the "file" backend with zlib.
+DEFERRED_FILE_COMPRESS = getattr(settings, "DEFERRED_FILE_COMPRESS", False)
\ No newline at end of file
@@ -3,12 +3,14 @@
 from solango import conf
 
 HANDLERS = ("dummy", 
-            "database")
+            "database",
+            "file",
+            "cache")
 
 def get_handler(name):
     
     if name not in HANDLERS:
-        raise AttributeError("DEFERRED_BACKEND must be one of the following" %
+        raise AttributeError("DEFERRED_BACKEND must be one of the following: %s" %
                              ",".join(HANDLERS))
     
     module = __import__('solango.deferred.%s' % name, {}, {}, [''])
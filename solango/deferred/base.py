@@ -8,6 +8,9 @@ from solango.deferred import defer
 
 defer.add(method, xml, doc_pk, error)
 
+Deferred operations are sent again with solango.deferred.replay, which reads
+them with pending() and removes the ones it sent with remove().
+
 """
 
 class BaseDeferred(object):
@@ -19,4 +22,27 @@ class BaseDeferred(object):
         raise NotImplementedError
 
     def list(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def pending(self, limit=None):
+        """
+        Returns up to limit deferred operations, oldest first. Each one is an
+        idict with the id, method, xml, doc_pk and error of the operation.
+        """
+        raise NotImplementedError
+
+    def newest(self, doc_pks):
+        """
+        Returns the id of the newest operation of every doc_pk in doc_pks.
+        """
+        newest = {}
+        for obj in self.pending():
+            if obj.doc_pk in doc_pks:
+                newest[obj.doc_pk] = obj.id
+        return newest
+
+    def remove(self, objects):
+        """
+        Removes the operations of objects, as returned by pending().
+        """
+        raise NotImplementedError
@@ -3,48 +3,81 @@ Deferred Cache
 =============
 Handle deferred objects.
 
+Every deferred operation is stored under a key of its own in a CacheLog,
+see solango.cachelog, so concurrent processes never overwrite each other and
+an add costs the same no matter how many operations are waiting. The newest
+position of every doc_pk is kept as well, for the replay.
+
+Entries expire after DEFERRED_CACHE_TIMEOUT seconds and the cache may evict
+them before, use a cache that doesn't evict if every operation matters.
+
 """
 
-from django.core.cache import cache
-
-class Deferred(object):
-
-    add_cache_key = "solango_deferred_cache_add"
-    delete_cache_key = "solango_deferred_cache_delete"
-
-    def defer_add(self, xml):
-        
-        xml_list = cache.get(self.add_cache_key)
-        if xml_list:
-            xml_list.append(xml)
-        else:
-            xml_list = [xml]
-
-        cache.set(self.add_cache_key, xml_list)
-    
-    def defer_delete(self, xml):
-        
-        xml_list = cache.get(self.delete_cache_key)
-        if xml_list:
-            xml_list.append(xml)
-        else:
-            xml_list = [xml]
-
-        cache.set(self.delete_cache_key, xml_list)
-    
-    def deferred_add(self):
-        xml_list = cache.get(self.add_cache_key)
-        if xml_list:
-            return xml_list
-        
-        return []
-    
-    def deferred_delete(self):
-        xml_list = cache.get(self.delete_cache_key)
-        if xml_list:
-            return xml_list
-        
-        return []
-    
-    def commit(self):
-        pass
\ No newline at end of file
+from django.core.cache import cache as default_cache
+from django.utils.hashcompat import md5_constructor
+
+from solango import conf
+from solango.cachelog import CacheLog
+from solango.deferred.base import BaseDeferred
+from solango.solr.utils import idict
+
+class Deferred(BaseDeferred):
+
+    prefix = "solango_deferred"
+
+    # Operations shown by list().
+    list_limit = 1000
+
+    def __init__(self, cache=None, timeout=None):
+        self.cache = cache or default_cache
+        self.timeout = timeout or conf.DEFERRED_CACHE_TIMEOUT
+        self.log = CacheLog(self.prefix, self.timeout, self.cache)
+
+    def _doc_key(self, doc_pk):
+        if isinstance(doc_pk, unicode):
+            doc_pk = doc_pk.encode("utf-8")
+        return self.log.key("doc_%s" % md5_constructor(doc_pk).hexdigest())
+
+    def create_object(self, instance):
+        obj = idict()
+        for field in ["id", "method", "xml", "doc_pk", "error"]:
+            obj[field] = instance[field]
+        return obj
+
+    def add(self, method, xml, doc_pk=None, error=None):
+        id = self.log.next()
+        instance = {"id": id, "method": method, "xml": xml,
+                    "doc_pk": doc_pk, "error": error}
+        self.log.write(id, instance)
+        if doc_pk:
+            self._set_newest(doc_pk, id)
+        return self.create_object(instance)
+
+    def _set_newest(self, doc_pk, id):
+        """
+        Points doc_pk at id unless a newer operation took it. Two adds that
+        race can still leave the older id, the replay only drops operations
+        older than the one recorded, so that costs a send, not the newer
+        operation.
+        """
+        key = self._doc_key(doc_pk)
+        if self.cache.add(key, id, self.timeout):
+            return
+        newest = self.cache.get(key)
+        if newest is None or newest < id:
+            self.cache.set(key, id, self.timeout)
+
+    def list(self):
+        return self.pending(self.list_limit)
+
+    def pending(self, limit=None):
+        return [self.create_object(instance)
+                for id, instance in self.log.read(limit)]
+
+    def newest(self, doc_pks):
+        keys = dict([(self._doc_key(doc_pk), doc_pk) for doc_pk in doc_pks])
+        return dict([(keys[key], id) for key, id in
+                     self.cache.get_many(keys.keys()).items()])
+
+    def remove(self, objects):
+        self.log.remove([obj.id for obj in objects])
@@ -5,12 +5,16 @@ Handle deferred objects.
 
 """
 from django.db import DatabaseError
+from django.db.models import Max
 
 from solango.solr.utils import idict
 from solango.deferred.base import BaseDeferred
 from solango.models import DeferredObject, DEFERRED_METHODS
 
-class Deferred(object):
+class Deferred(BaseDeferred):
+    
+    # Ids per DELETE, below the number of variables SQLite allows.
+    chunk_size = 500
     
     def create_object(self, instance):
         obj = idict()
@@ -40,4 +44,33 @@ class Deferred(object):
 
 
     def list(self):
-        return DeferredObject.objects.all()
\ No newline at end of file
+        return DeferredObject.objects.all()
+    
+    def pending(self, limit=None):
+        methods = dict(DEFERRED_METHODS)
+        objects = DeferredObject.objects.order_by("id")
+        if limit:
+            objects = objects[:limit]
+        
+        pending = []
+        for df in objects:
+            obj = self.create_object(df)
+            obj.id = df.id
+            obj.method = methods[df.method]
+            pending.append(obj)
+        return pending
+    
+    def newest(self, doc_pks):
+        doc_pks = list(doc_pks)
+        newest = {}
+        for i in range(0, len(doc_pks), self.chunk_size):
+            newest.update(DeferredObject.objects
+                            .filter(doc_pk__in=doc_pks[i:i + self.chunk_size])
+                            .values_list("doc_pk").annotate(Max("id")))
+        return newest
+    
+    def remove(self, objects):
+        ids = [obj.id for obj in objects]
+        for i in range(0, len(ids), self.chunk_size):
+            DeferredObject.objects.filter(
+                        id__in=ids[i:i + self.chunk_size]).delete()
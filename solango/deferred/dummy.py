@@ -15,3 +15,9 @@ class Deferred(BaseDeferred):
 
     def list(self):
         return []
+    
+    def pending(self, limit=None):
+        return []
+    
+    def remove(self, objects):
+        pass
@@ -0,0 +1,443 @@
+"""
+Deferred File
+=============
+Handle deferred objects.
+
+Deferred operations are appended to a log of segment files in
+DEFERRED_FILE_DIR instead of the database, which is likely to be busy
+already when Solr is down. Every operation is one record::
+
+    payload length, crc32, flags, doc_pk length   (struct ">IIBH")
+    doc_pk                                        (utf-8)
+    payload                                       (marshal of method, xml,
+                                                   error, zlib compressed
+                                                   with DEFERRED_FILE_COMPRESS)
+
+Records are written with one append under an exclusive lock, so several
+processes can share the log. The file is flushed to disk (fsync) at most
+every DEFERRED_FILE_SYNC_INTERVAL seconds, and when a segment is full and
+the log moves on to the next one, at DEFERRED_FILE_SEGMENT_SIZE bytes.
+
+The lock file holds where the last append ended. A writer that finds the
+segment longer than that checks the records past it, and cuts off the one
+a killed process left half written before it appends. The reader skips a
+damaged record to the next one whose crc matches, it doesn't drop the rest
+of the segment.
+
+The reader goes through the segments in order from a cursor that remove()
+moves forward, up to the first operation that is still waiting. Operations
+removed past the cursor are listed in a file of their own and skipped by the
+reader until the cursor passed them, so operations that failed keep their
+place before newer ones of the same doc_pk. Segments behind the cursor are
+deleted. The id of an operation is its (segment, offset).
+
+"""
+
+import atexit
+import fcntl
+import marshal
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from solango import conf
+from solango.deferred.base import BaseDeferred
+from solango.log import logger
+from solango.solr.utils import idict
+
+HEADER = struct.Struct(">IIBH")
+
+FLAG_ZLIB = 1
+
+SEGMENT = re.compile(r"^(\d+)\.seg$")
+
+class Deferred(BaseDeferred):
+
+    # Operations shown by list().
+    list_limit = 1000
+
+    def __init__(self, path=None, segment_size=None, sync_interval=None,
+                 compress=None):
+        self.path = path or conf.DEFERRED_FILE_DIR
+        if not self.path:
+            # The temp directory is emptied by reboots and cleaners, the log
+            # has to outlive both.
+            raise AttributeError("DEFERRED_FILE_DIR must be set for the "
+                                 "\"file\" DEFERRED_BACKEND")
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.segment_size = segment_size or conf.DEFERRED_FILE_SEGMENT_SIZE
+        if sync_interval is None:
+            sync_interval = conf.DEFERRED_FILE_SYNC_INTERVAL
+        self.sync_interval = sync_interval
+        if compress is None:
+            compress = conf.DEFERRED_FILE_COMPRESS
+        self.compress = compress
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._lock_fd = None
+        self._segment = None
+        self._dirty = False
+        self._synced = 0
+
+        # doc_pk -> id of its newest operation, and how far every segment
+        # was read to build it.
+        self._newest = {}
+        self._indexed = {}
+
+        atexit.register(self.sync)
+
+    def _filename(self, segment):
+        return os.path.join(self.path, "%010d.seg" % segment)
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            match = SEGMENT.match(name)
+            if match:
+                segments.append(int(match.group(1)))
+        segments.sort()
+        return segments
+
+    #### Writing
+
+    def _encode(self, method, xml, doc_pk, error):
+        payload = marshal.dumps((method, xml, error))
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_ZLIB
+        pk = doc_pk or ""
+        if isinstance(pk, unicode):
+            pk = pk.encode("utf-8")
+        body = pk + payload
+        return HEADER.pack(len(payload), zlib.crc32(body) & 0xffffffff, flags,
+                           len(pk)) + body
+
+    def _open(self):
+        """
+        Opens the segment to append to, the next one once it is full or
+        another process moved on to it. Called with the locks held.
+        """
+        if self._segment is None:
+            segments = self._segments()
+            self._segment = segments and segments[-1] or 1
+        while os.path.exists(self._filename(self._segment + 1)):
+            self._close()
+            self._segment += 1
+
+        if self._fd is not None and \
+                os.fstat(self._fd).st_size >= self.segment_size:
+            self._close()
+            self._segment += 1
+
+        if self._fd is None:
+            self._fd = os.open(self._filename(self._segment),
+                               os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+    def _close(self):
+        if self._fd is not None:
+            self._sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def _sync(self):
+        if self._dirty and self._fd is not None:
+            os.fsync(self._fd)
+        self._dirty = False
+        self._synced = time.time()
+
+    def sync(self):
+        """
+        Flushes the appended records to disk.
+        """
+        self._lock.acquire()
+        try:
+            if self._pid == os.getpid():
+                self._sync()
+        finally:
+            self._lock.release()
+
+    def _lock_log(self):
+        """
+        Takes the lock of the thread and the exclusive flock of the log,
+        which appends, remove() and other processes share.
+        """
+        self._lock.acquire()
+        try:
+            if self._pid != os.getpid():
+                # Descriptors and locks are not shared with a forked parent.
+                self._fd = self._segment = None
+                self._lock_fd = os.open(os.path.join(self.path, "lock"),
+                                        os.O_RDWR | os.O_CREAT)
+                self._pid = os.getpid()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        except:
+            self._lock.release()
+            raise
+
+    def _unlock_log(self):
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def _append(self, record):
+        self._lock_log()
+        try:
+            self._open()
+            offset = os.lseek(self._fd, 0, os.SEEK_END)
+            tail = self._tail()
+            if tail != (self._segment, offset):
+                offset = self._repair(tail, offset)
+            written = 0
+            while written < len(record):
+                written += os.write(self._fd, record[written:])
+            self._save_tail(self._segment, offset + written)
+            self._dirty = True
+            if time.time() - self._synced >= self.sync_interval:
+                self._sync()
+            return self._segment, offset
+        finally:
+            self._unlock_log()
+
+    def _tail(self):
+        """
+        The segment and offset the last append ended at, from the lock file.
+        """
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        tail = os.read(self._lock_fd, 64).split()
+        if len(tail) != 2:
+            return None
+        return int(tail[0]), int(tail[1])
+
+    def _save_tail(self, segment, end):
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        os.write(self._lock_fd, "%020d %020d\n" % (segment, end))
+
+    def _repair(self, tail, size):
+        """
+        Cuts a record that a killed writer left half written off the end of
+        the current segment, so the next records don't end up behind it.
+        Called with the locks held, returns the new size.
+        """
+        end = 0
+        if tail is not None and tail[0] == self._segment and tail[1] <= size:
+            end = tail[1]
+        for id, pk, flags, payload, next in self._records((self._segment,
+                                                           end)):
+            if id[0] != self._segment:
+                break
+            end = next
+        if end < size:
+            logger.error("Deferred log %s ends with a damaged record at %d, "
+                         "cutting it off" %
+                         (self._filename(self._segment), end))
+            os.ftruncate(self._fd, end)
+            os.lseek(self._fd, 0, os.SEEK_END)
+        return end
+
+    def create_object(self, instance):
+        obj = idict()
+        for field in ["id", "method", "xml", "doc_pk", "error"]:
+            obj[field] = instance[field]
+        return obj
+
+    def add(self, method, xml, doc_pk=None, error=None):
+        id = self._append(self._encode(method, xml, doc_pk, error))
+        return self.create_object({"id": id, "method": method, "xml": xml,
+                                   "doc_pk": doc_pk, "error": error})
+
+    #### Reading
+
+    def _cursor(self):
+        try:
+            f = open(os.path.join(self.path, "cursor"))
+        except IOError:
+            segments = self._segments()
+            return segments and segments[0] or 1, 0
+        try:
+            segment, offset = f.read().split()
+            return int(segment), int(offset)
+        finally:
+            f.close()
+
+    def _write(self, name, data):
+        filename = os.path.join(self.path, name)
+        tmp = "%s.%s" % (filename, os.getpid())
+        f = open(tmp, "w")
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+
+    def _save_cursor(self, segment, offset):
+        self._write("cursor", "%d %d" % (segment, offset))
+
+    def _removed(self):
+        """
+        The ids of the operations removed past the cursor.
+        """
+        try:
+            f = open(os.path.join(self.path, "removed"))
+        except IOError:
+            return set()
+        try:
+            removed = set()
+            for line in f:
+                if line.strip():
+                    segment, offset = line.split()
+                    removed.add((int(segment), int(offset)))
+            return removed
+        finally:
+            f.close()
+
+    def _save_removed(self, removed):
+        self._write("removed", "".join(["%d %d\n" % id
+                                        for id in sorted(removed)]))
+
+    def _record(self, f, offset):
+        """
+        Reads the record at offset. Returns its doc_pk, flags, payload and
+        end offset, or None if it is incomplete or damaged.
+        """
+        f.seek(offset)
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, crc, flags, pk_length = HEADER.unpack(header)
+        if not length or flags & ~FLAG_ZLIB:
+            return None
+        body = f.read(pk_length + length)
+        if len(body) < pk_length + length or \
+                zlib.crc32(body) & 0xffffffff != crc:
+            return None
+        return (body[:pk_length], flags, body[pk_length:],
+                offset + HEADER.size + len(body))
+
+    def _resync(self, f, offset, size):
+        """
+        Returns the offset of the first valid record after the damaged one
+        at offset, or None if there is none.
+        """
+        position = offset + 1
+        while position + HEADER.size <= size:
+            f.seek(position)
+            window = f.read(65536 + HEADER.size)
+            for i in range(len(window) - HEADER.size + 1):
+                length, crc, flags, pk_length = HEADER.unpack_from(window, i)
+                if not length or flags & ~FLAG_ZLIB or \
+                        position + i + HEADER.size + pk_length + length > size:
+                    continue
+                if self._record(f, position + i) is not None:
+                    return position + i
+            position += len(window) - HEADER.size + 1
+        return None
+
+    def _records(self, start):
+        """
+        Yields the id, doc_pk, flags, payload and end offset of every record
+        from the position start on.
+        """
+        segments = [s for s in self._segments() if s >= start[0]]
+        for segment in segments:
+            offset = segment == start[0] and start[1] or 0
+            try:
+                f = open(self._filename(segment), "rb")
+            except IOError:
+                continue
+            try:
+                size = os.fstat(f.fileno()).st_size
+                while offset < size:
+                    record = self._record(f, offset)
+                    if record is None:
+                        # Still being written, or torn by a writer that was
+                        # killed. Records after a tear are found by crc.
+                        next = self._resync(f, offset, size)
+                        if next is None:
+                            break
+                        logger.error("Deferred log %s is damaged at %d, "
+                                     "skipping to %d" %
+                                     (self._filename(segment), offset, next))
+                        offset = next
+                        continue
+                    pk, flags, payload, end = record
+                    yield (segment, offset), pk, flags, payload, end
+                    offset = end
+            finally:
+                f.close()
+
+    def _decode(self, id, pk, flags, payload):
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        method, xml, error = marshal.loads(payload)
+        return self.create_object({"id": id, "method": method, "xml": xml,
+                                   "doc_pk": pk.decode("utf-8") or None,
+                                   "error": error})
+
+    def list(self):
+        return self.pending(self.list_limit)
+
+    def pending(self, limit=None):
+        removed = self._removed()
+        pending = []
+        for id, pk, flags, payload, end in self._records(self._cursor()):
+            if limit and len(pending) >= limit:
+                break
+            if id not in removed:
+                pending.append(self._decode(id, pk, flags, payload))
+        return pending
+
+    def newest(self, doc_pks):
+        cursor = self._cursor()
+        for segment in self._segments():
+            if segment < cursor[0]:
+                continue
+            start = (segment, max(self._indexed.get(segment, 0),
+                                  segment == cursor[0] and cursor[1] or 0))
+            for id, pk, flags, payload, end in self._records(start):
+                if id[0] != segment:
+                    break
+                if pk:
+                    self._newest[pk.decode("utf-8")] = id
+                self._indexed[segment] = end
+        return dict([(doc_pk, self._newest[doc_pk]) for doc_pk in doc_pks
+                     if doc_pk in self._newest])
+
+    def remove(self, objects):
+        # Two replays at once would overwrite each other's cursor.
+        self._lock_log()
+        try:
+            self._remove(objects)
+        finally:
+            self._unlock_log()
+
+    def _remove(self, objects):
+        removed = self._removed() | set([obj.id for obj in objects])
+        if not removed:
+            return
+
+        # The cursor moves up to the first operation that is still waiting.
+        cursor = self._cursor()
+        for id, pk, flags, payload, end in self._records(cursor):
+            if id not in removed:
+                break
+            removed.discard(id)
+            cursor = (id[0], end)
+        self._save_removed([id for id in removed if id >= cursor])
+        self._save_cursor(*cursor)
+
+        for segment in self._segments():
+            if segment < cursor[0]:
+                os.remove(self._filename(segment))
+                self._indexed.pop(segment, None)
+        self._newest = dict([(doc_pk, id) for doc_pk, id in
+                             self._newest.items() if id >= cursor])
@@ -0,0 +1,277 @@
+"""
+Deferred Replay
+===============
+Sends the deferred operations to Solr again::
+
+    from solango.deferred.replay import Replayer
+
+    Replayer(batch_size=1000).run()
+
+or ``manage.py solr --replay-deferred``.
+
+Operations are read from the deferred backend in batches, oldest first. Only
+the newest operation of every doc_pk is sent, an older add of a document that
+was deleted since is dropped, even when the two are in different batches.
+Operations go to the index, shard or core of their doc_pk. The stored
+payloads of consecutive operations with the same method, index and update
+format, which is told by the first character of the payload, are joined into
+one request, so the operations reach Solr in the order they were deferred.
+Every index that got writes is committed once, a deferred commit commits
+every index.
+
+A request that fails is tried again with a pause that doubles every time.
+The operations of a batch are removed from the backend once they were sent,
+those of a request that keeps failing stay for the next run. When Solr
+rejects a request with a client error it is split in halves that are sent on
+their own, and single operations that are still rejected are dropped, so one
+bad payload doesn't hold up the backend.
+
+"""
+
+import time
+
+from solango import conf
+from solango.log import logger
+
+def split_payload(xml):
+    """
+    Returns the update format of a stored payload, "xml" or "json", and its
+    fragments without the ``<add>``/``<delete>`` or ``{}`` around them.
+    """
+    if isinstance(xml, str):
+        xml = xml.decode("utf-8", "replace")
+    xml = xml.strip()
+    if not xml:
+        return None, u""
+
+    if xml[0] == u"{":
+        return "json", xml[1:-1].strip()
+    if xml[0] == u'"':
+        return "json", xml
+
+    for tag in ("add", "delete"):
+        if xml.startswith(u"<%s" % tag):
+            end = xml.rfind(u"</%s>" % tag)
+            if end == -1:
+                break
+            return "xml", xml[xml.index(u">") + 1:end].strip()
+    return "xml", xml
+
+class Replayer(object):
+    """
+    ..attribute: sent
+
+        Number of operations sent so far.
+
+    ..attribute: dropped
+
+        Number of operations that were replaced by a newer one.
+
+    ..attribute: failed
+
+        Number of operations whose request failed, they are kept.
+
+    ..attribute: rejected
+
+        Number of operations Solr rejected, they are dropped.
+    """
+
+    def __init__(self, backend=None, batch_size=None, retries=5, backoff=1,
+                 max_backoff=60, report=None):
+        if backend is None:
+            from solango.deferred import defer as backend
+        self.backend = backend
+        self.batch_size = batch_size or conf.SOLR_BATCH_INDEX_SIZE
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.report = report or logger.info
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rejected = 0
+        self._connections = {}
+        self._default_index = None
+
+    def run(self):
+        """
+        Replays batches until the backend is empty or a batch could not
+        remove anything. Returns self.
+        """
+        while True:
+            objects = self.backend.pending(self.batch_size)
+            if not objects:
+                break
+            if not self.replay(objects):
+                break
+            self.report("Replayed %d deferred operations, %d dropped, "
+                        "%d failed, %d rejected" % (self.sent, self.dropped,
+                                                    self.failed,
+                                                    self.rejected))
+        return self
+
+    def replay(self, objects):
+        """
+        Sends objects, as returned by pending(), and removes the ones that
+        were sent or replaced. Returns the number removed.
+        """
+        newest = self.backend.newest(set([obj.doc_pk for obj in objects
+                                          if obj.doc_pk]))
+
+        runs = []
+        commits = {}
+        everywhere = []
+        done = []
+        for obj in sorted(objects, key=lambda obj: obj.id):
+            if obj.doc_pk and newest.get(obj.doc_pk, obj.id) > obj.id:
+                self.dropped += 1
+                done.append(obj)
+                continue
+
+            if obj.method in ("commit", "optimize"):
+                if obj.doc_pk:
+                    index = self.get_index(obj.doc_pk)
+                    commits.setdefault(index.update_url,
+                                       (index, []))[1].append(obj)
+                else:
+                    everywhere.append(obj)
+                continue
+
+            format_name, fragments = split_payload(obj.xml)
+            if not fragments:
+                done.append(obj)
+                continue
+            index = self.get_index(obj.doc_pk)
+            key = (index, format_name, obj.method)
+            if runs and runs[-1][0] == key:
+                runs[-1][1].append(obj)
+            else:
+                runs.append((key, [obj]))
+            commits.setdefault(index.update_url, (index, []))
+
+        for (index, format_name, method), objs in runs:
+            done.extend(self._send_run(self.get_connection(index,
+                                                           format_name),
+                                       method, objs))
+
+        if everywhere:
+            for index in self.get_indexes():
+                commits.setdefault(index.update_url, (index, []))
+
+        committed = True
+        for index, objs in commits.values():
+            result = self._send(index.connection.commit)
+            if result.success:
+                self.sent += len(objs)
+                done.extend(objs)
+            else:
+                self.failed += len(objs)
+                committed = False
+        if everywhere:
+            if committed:
+                self.sent += len(everywhere)
+                done.extend(everywhere)
+            else:
+                self.failed += len(everywhere)
+
+        if done:
+            self.backend.remove(done)
+        return len(done)
+
+    def _send_run(self, connection, method, objs):
+        """
+        Sends the payloads of objs in one request and returns the objects
+        that are done with. A request Solr rejects is sent again in halves,
+        a single operation it rejects is dropped.
+        """
+        body = connection.format.separator.join([split_payload(obj.xml)[1]
+                                                 for obj in objs])
+        send = getattr(connection, method)
+        result = self._send(lambda: send(body, commit=False)[0])
+        if result.success:
+            self.sent += len(objs)
+            return objs
+
+        if result.error_code is not None and result.error_code < 500:
+            if len(objs) > 1:
+                half = len(objs) / 2
+                return self._send_run(connection, method, objs[:half]) + \
+                       self._send_run(connection, method, objs[half:])
+            logger.error("Solr rejected deferred %s %s of %s, dropping it: "
+                         "%s\n%s" % (method, objs[0].id, objs[0].doc_pk,
+                                     result.error, objs[0].xml))
+            self.rejected += 1
+            return objs
+
+        logger.error("Replaying %d deferred %s operations failed: %s" %
+                     (len(objs), method, result.error))
+        self.failed += len(objs)
+        return []
+
+    def _send(self, request):
+        """
+        Calls request until it succeeds, fails with a client error or was
+        tried retries more times.
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            result = request()
+            if result.success:
+                return result
+            if result.error_code is not None and result.error_code < 500:
+                return result
+            if attempt < self.retries:
+                logger.warning("Solr update failed, retrying in %s "
+                               "seconds: %s" % (delay, result.error))
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        return result
+
+    def get_index(self, doc_pk):
+        """
+        The index of the document of doc_pk, the default index for
+        operations without one.
+        """
+        import solango
+        if doc_pk:
+            key = doc_pk.rsplit(conf.SEARCH_SEPARATOR, 1)[0]
+            document = solango.documents.get(key)
+            if document is not None and document.index is not None:
+                return document.index.index_for(doc_pk)
+        if self._default_index is None:
+            from solango.solr.indexes.base import Index
+            self._default_index = Index()
+        return self._default_index
+
+    def get_indexes(self):
+        """
+        Every index documents are registered with, the shards or cores of
+        sharded ones, the default index if there are none.
+        """
+        import solango
+        indexes = {}
+        for document in solango.documents.values():
+            if document.index is None:
+                continue
+            for index in getattr(document.index, "shards", [document.index]):
+                indexes.setdefault(index.update_url, index)
+        if not indexes:
+            return [self.get_index(None)]
+        return indexes.values()
+
+    def get_connection(self, index, format_name):
+        """
+        The connection of index, or one like it speaking the format the
+        payload was stored in.
+        """
+        if index.connection.format.name == format_name:
+            return index.connection
+        key = (index, format_name)
+        if key not in self._connections:
+            from solango.solr.connection import SearchWrapper
+            self._connections[key] = SearchWrapper(index.update_url,
+                                                   index.select_urls,
+                                                   index.ping_urls,
+                                                   format_name)
+        return self._connections[key]
@@ -15,9 +15,21 @@ class Command(NoArgsCommand):
         make_option('--reindex', dest='index_solr', action='store_true', default=False,
             help='Will reindex Solr from the registry.'),
         make_option('--batch-size', dest='index_batch_size', default=False,
-            help='Used with --reindex. Sets solr index batch size.'),
+            help='Used with --reindex, --worker and --replay-deferred. Sets solr index batch size.'),
+        make_option('--workers', dest='index_workers', default=1,
+            help='Used with --reindex. Number of worker processes to reindex with.'),
+        make_option('--resume', dest='index_resume', action='store_true', default=False,
+            help='Used with --reindex. Continues the last reindex from its checkpoints.'),
+        make_option('--worker', dest='run_worker', action='store_true', default=False,
+            help='Sends the queued documents to Solr until stopped, see SEARCH_QUEUE_BACKEND.'),
+        make_option('--once', dest='worker_once', action='store_true', default=False,
+            help='Used with --worker. Stops once the queue is empty.'),
+        make_option('--replay-deferred', dest='replay_deferred', action='store_true', default=False,
+            help='Sends the deferred operations to Solr again, see DEFERRED_BACKEND.'),
         make_option('--schema', dest='solr_schema', action='store_true', default=False,
             help='Will create the schema.xml in SOLR_SCHEMA_PATH or in the --path.'),
+        make_option('--cores', dest='schema_cores', action='store_true', default=False,
+            help='Used with --schema. Writes the schema.xml of every core of a MulticoreIndex to <path>/<core>/conf/.'),
         make_option('--path', dest='schema_path', default=False,
             help='Tells Solango where to create config file.'),
         make_option('--fields', dest='solr_fields', action='store_true', default=False,
@@ -37,6 +49,7 @@ class Command(NoArgsCommand):
     def handle_noargs(self, **options):
         index_solr = options.get('index_solr')
         index_batch_size = options.get('index_batch_size')
+        index_workers = options.get('index_workers')
         schema = options.get('solr_schema')
         schema_path = options.get('schema_path')
         flush_solr =options.get('flush_solr')
@@ -70,13 +83,16 @@ class Command(NoArgsCommand):
             if not os.path.exists(path):
                 raise CommandError("Path does not exist: %s" % path)
             
-            if not os.path.isfile(path):
+            if options.get('schema_cores'):
+                self.write_core_schemas(path)
+            elif not os.path.isfile(path):
                 path = os.path.join(path, 'schema.xml')
             
-            from solango.utils import create_schema_xml
-            f = open(path, 'w')
-            f.write(create_schema_xml())
-            f.close()
+            if not options.get('schema_cores'):
+                from solango.utils import create_schema_xml
+                f = open(path, 'w')
+                f.write(create_schema_xml())
+                f.close()
             print """
 Successfully created schema.xml in/at: %s
 
@@ -117,12 +133,54 @@ Successfully created schema.xml in/at: %s
             try:
                 # Throws value errors.
                 index_batch_size = int(index_batch_size)
-                print "Starting to reindex Solr"
-                reindex(batch_size=index_batch_size, document_key=options.get('document_key'))
-                print "Finished the reindex of Solr"
+            except ValueError, e:
+                raise CommandError("ERROR: Invalid --batch-size agrument ( %s ). exception: %s" % (str(index_batch_size), str(e)))
+            try:
+                index_workers = int(index_workers)
+            except ValueError, e:
+                raise CommandError("ERROR: Invalid --workers argument ( %s ). exception: %s" % (str(index_workers), str(e)))
+            
+            print "Starting to reindex Solr"
+            reindexer = reindex(batch_size=index_batch_size, document_key=options.get('document_key'),
+                                report=self.report, workers=index_workers,
+                                resume=options.get('index_resume'))
+            if reindexer and reindexer.errors:
+                raise CommandError("%d ranges failed to reindex" % len(reindexer.errors))
+            print "Finished the reindex of Solr"
+            
+        if options.get('run_worker'):
+            from solango.queued.worker import QueueWorker
+            try:
+                batch_size = int(index_batch_size or conf.SEARCH_QUEUE_BATCH_SIZE)
+            except ValueError, e:
+                raise CommandError("ERROR: Invalid --batch-size agrument ( %s ). exception: %s" % (str(index_batch_size), str(e)))
+            try:
+                worker = QueueWorker(batch_size=batch_size, report=self.report)
+            except ValueError, e:
+                raise CommandError(str(e))
+            
+            print "Starting the indexing worker. CTL-C to exit."
+            try:
+                worker.run(once=options.get('worker_once'))
+            except KeyboardInterrupt:
+                pass
+            print "Indexing worker stopped: %d added, %d deleted, %d deferred, %d dropped" % (
+                        worker.count, worker.deleted, worker.failed, worker.dropped)
+            
+        if options.get('replay_deferred'):
+            from solango.deferred.replay import Replayer
+            try:
+                batch_size = int(index_batch_size or conf.SOLR_BATCH_INDEX_SIZE)
             except ValueError, e:
                 raise CommandError("ERROR: Invalid --batch-size agrument ( %s ). exception: %s" % (str(index_batch_size), str(e)))
             
+            print "Replaying deferred operations"
+            replayer = Replayer(batch_size=batch_size, report=self.report).run()
+            print "Replayed %d deferred operations, %d dropped as stale, %d failed, %d rejected" % (
+                        replayer.sent, replayer.dropped, replayer.failed, replayer.rejected)
+            if replayer.failed:
+                raise CommandError("%d deferred operations could not be replayed" % replayer.failed)
+            
         if start_solr:
             # Make sure the `SOLR_ROOT` and `start.jar` exist.
             if not SOLR_ROOT:
@@ -140,3 +198,31 @@ Successfully created schema.xml in/at: %s
                 # Throws nasty errors if we don't catch the keyboard interrupt.
                 pass
             print "Solr process has been interrupted"
+
+    def write_core_schemas(self, path):
+        import solango
+        from solango.solr.indexes.multicore import MulticoreIndex
+        
+        if not os.path.isdir(path):
+            raise CommandError("--cores needs a directory: %s" % path)
+        
+        indexes = []
+        for document in solango.documents.values():
+            if isinstance(document.index, MulticoreIndex) and \
+                    document.index not in indexes:
+                indexes.append(document.index)
+        if not indexes:
+            raise CommandError("No document is registered with a MulticoreIndex")
+        
+        for index in indexes:
+            for name, schema in index.schemas().items():
+                conf_path = os.path.join(path, name, 'conf')
+                if not os.path.exists(conf_path):
+                    os.makedirs(conf_path)
+                f = open(os.path.join(conf_path, 'schema.xml'), 'w')
+                f.write(schema)
+                f.close()
+                print "Created the schema.xml of core %s" % name
+
+    def report(self, message):
+        print message
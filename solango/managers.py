@@ -10,7 +10,9 @@ Post.search.filter()
 
 """
 from django.db import models
-from solango import connection, get_instance_key
+from solango.registry import documents
+from solango.solr import get_instance_key
+from solango.solr.query import Query
 
 class SearchManager(models.Manager):
     
@@ -22,7 +24,17 @@ class SearchManager(models.Manager):
             representation.
         
         """
-        kwargs['model'] = get_instance_key(self.model)
-        results = connection.select(*args, **kwargs)
-        ids = [doc.pk_field.value for doc in results.documents]
-        return self.in_bulk(ids)
\ No newline at end of file
+        key = get_instance_key(self.model)
+        kwargs['model'] = key
+        initial = args and args[0] or None
+        if not isinstance(initial, Query):
+            initial = Query(initial, **kwargs)
+        
+        index = documents[key].index
+        if hasattr(index, "core"):
+            # Multicore indexes keep the documents of key in a core.
+            index = index.core(key)
+        # Sharded indexes search every shard.
+        results = index.select(initial, *args[1:])
+        # Only the primary keys are needed, no SearchDocument is built.
+        return self.in_bulk(results.documents.ids())
\ No newline at end of file
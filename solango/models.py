@@ -53,4 +53,78 @@ class DeferredObject(models.Model):
     
     
     def __unicode__(self):
-        return u"%s: %s" % (self.method, self.xml[:50])
\ No newline at end of file
+        return u"%s: %s" % (self.method, self.xml[:50])
+
+class ReindexCheckpoint(models.Model):
+    """
+    ReindexCheckpoint
+    -----------------
+    Model for the database backend of reindex checkpoints, see
+    solango.checkpoint
+    
+    ..attribute: key
+    
+        Document key of the reindexed model and the part of the run
+    
+    ..attribute: last_pk
+    
+        Primary key of the last instance that was indexed
+    
+    ..attribute: after, upto
+    
+        Primary key range of the part, None if unbounded
+    
+    ..attribute: count, deleted, failed
+    
+        Number of documents added, deleted and deferred so far
+    
+    ..attribute: done
+    
+        True once every instance of the part was indexed
+    
+    """
+    key = models.CharField(max_length=200, unique=True)
+    last_pk = models.CharField(max_length=200, blank=True, null=True)
+    after = models.CharField(max_length=200, blank=True, null=True)
+    upto = models.CharField(max_length=200, blank=True, null=True)
+    count = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    done = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+    
+    def __unicode__(self):
+        return u"%s: %s" % (self.key, self.last_pk)
+
+QUEUED_METHODS = (
+    ("add", "add"),
+    ("delete", "delete"),
+)
+
+class QueuedDocument(models.Model):
+    """
+    QueuedDocument
+    --------------
+    Model for the database backend of queued indexing, see solango.queued
+    
+    ..attribute: method
+    
+        "add" or "delete"
+    
+    ..attribute: document_key, object_pk
+    
+        Document key of the model and primary key of the instance
+    
+    ..attribute: doc_pk
+    
+        Id of the Solr document
+    
+    """
+    method = models.CharField(max_length=10, choices=QUEUED_METHODS)
+    document_key = models.CharField(max_length=200)
+    object_pk = models.CharField(max_length=200)
+    doc_pk = models.CharField(max_length=200)
+    queued = models.DateTimeField(default=datetime.now)
+    
+    def __unicode__(self):
+        return u"%s: %s" % (self.method, self.doc_pk)
@@ -0,0 +1,54 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queued Indexing
+===============
+
+With SEARCH_QUEUE_BACKEND set, the post_save and post_delete signals don't
+talk to Solr. They write a small "index this pk" or "delete this pk" event
+to a durable queue, and a separate worker process sends the queued documents
+to Solr in large batches::
+
+    SEARCH_QUEUE_BACKEND = "sqlite"
+
+    python manage.py solr --worker
+
+The backends are:
+
+* "database" - the QueuedDocument table of the Django database.
+* "sqlite"   - a SQLite file of its own, SEARCH_QUEUE_PATH, so the events
+  don't compete with the site's database.
+* "cache"    - the Django cache. The fastest, but the cache may evict events.
+
+See solango.queued.worker for how the worker batches the events.
+"""
+
+from solango import conf
+
+HANDLERS = ("database",
+            "sqlite",
+            "cache")
+
+def get_handler(name):
+    
+    if name not in HANDLERS:
+        raise AttributeError("SEARCH_QUEUE_BACKEND must be one of the "
+                             "following: %s" % ", ".join(HANDLERS))
+    
+    module = __import__('solango.queued.%s' % name, {}, {}, [''])
+    
+    return getattr(module, 'Queue')()
+
+_queue = None
+
+def get_queue():
+    """
+    Returns the queue of SEARCH_QUEUE_BACKEND, or None if indexing isn't
+    queued.
+    """
+    global _queue
+    if _queue is None and conf.SEARCH_QUEUE_BACKEND:
+        _queue = get_handler(conf.SEARCH_QUEUE_BACKEND)
+    return _queue
@@ -0,0 +1,70 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queue Base
+==========
+
+from solango.queued import get_queue
+
+queue = get_queue()
+queue.put("add", "blog__entry", 12, "blog__entry__12")
+events = queue.take(500)
+...
+queue.remove(events)
+"""
+
+METHODS = ("add", "delete")
+
+class Event(object):
+    """
+    ..attribute: id
+
+        Position of the event in its queue, set by the backend.
+
+    ..attribute: method
+
+        "add" or "delete".
+
+    ..attribute: document_key, object_pk
+
+        The document key of the model and the primary key of the instance.
+
+    ..attribute: doc_pk
+
+        The id of the Solr document.
+    """
+    __slots__ = ("id", "method", "document_key", "object_pk", "doc_pk")
+
+    def __init__(self, id, method, document_key, object_pk, doc_pk):
+        self.id = id
+        self.method = method
+        self.document_key = document_key
+        self.object_pk = object_pk
+        self.doc_pk = doc_pk
+
+    def __repr__(self):
+        return "<Event %s %s %s>" % (self.id, self.method, self.doc_pk)
+
+class BaseQueue(object):
+
+    def put(self, method, document_key, object_pk, doc_pk):
+        raise NotImplementedError
+
+    def take(self, limit):
+        """
+        Returns the limit oldest events, oldest first. They stay in the queue
+        until they are removed.
+        """
+        raise NotImplementedError
+
+    def remove(self, events):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def _check(self, method):
+        if method not in METHODS:
+            raise ValueError("unknown method: %s" % method)
@@ -0,0 +1,40 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queue Cache
+===========
+Events in the Django cache, one key per event in a CacheLog, see
+solango.cachelog, so processes never overwrite each other's events.
+
+The cache may evict events before they are sent, use it where losing an
+update now and then is acceptable, or with a cache that doesn't evict.
+
+"""
+
+from solango import conf
+from solango.cachelog import CacheLog
+from solango.queued.base import BaseQueue, Event
+
+class Queue(BaseQueue):
+
+    prefix = "solango_queue"
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or conf.SEARCH_QUEUE_CACHE_TIMEOUT
+        self.log = CacheLog(self.prefix, self.timeout)
+
+    def put(self, method, document_key, object_pk, doc_pk):
+        self._check(method)
+        self.log.write(self.log.next(),
+                       (method, document_key, unicode(object_pk), doc_pk))
+
+    def take(self, limit):
+        return [Event(id, *value) for id, value in self.log.read(limit)]
+
+    def remove(self, events):
+        self.log.remove([event.id for event in events])
+
+    def count(self):
+        return self.log.count()
@@ -0,0 +1,42 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queue Database
+==============
+Events in the QueuedDocument table.
+
+"""
+
+from solango.queued.base import BaseQueue, Event
+
+class Queue(BaseQueue):
+
+    # Ids per DELETE, below the number of variables SQLite allows.
+    chunk_size = 500
+
+    def put(self, method, document_key, object_pk, doc_pk):
+        from solango.models import QueuedDocument
+        self._check(method)
+        QueuedDocument.objects.create(method=method,
+                                      document_key=document_key,
+                                      object_pk=unicode(object_pk),
+                                      doc_pk=doc_pk)
+
+    def take(self, limit):
+        from solango.models import QueuedDocument
+        return [Event(*row) for row in QueuedDocument.objects.order_by("id")
+                    .values_list("id", "method", "document_key", "object_pk",
+                                 "doc_pk")[:limit]]
+
+    def remove(self, events):
+        from solango.models import QueuedDocument
+        ids = [event.id for event in events]
+        for i in range(0, len(ids), self.chunk_size):
+            QueuedDocument.objects.filter(
+                        id__in=ids[i:i + self.chunk_size]).delete()
+
+    def count(self):
+        from solango.models import QueuedDocument
+        return QueuedDocument.objects.count()
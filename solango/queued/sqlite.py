@@ -0,0 +1,94 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queue SQLite
+============
+Events in a SQLite file of their own, SEARCH_QUEUE_PATH. Every put is its
+own transaction, the file is written ahead (WAL) where SQLite supports it
+so a put doesn't wait for the worker.
+
+"""
+
+import os
+import sqlite3
+import threading
+
+from solango import conf
+from solango.queued.base import BaseQueue, Event
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS solango_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    document_key TEXT NOT NULL,
+    object_pk TEXT NOT NULL,
+    doc_pk TEXT NOT NULL
+)"""
+
+class Queue(BaseQueue):
+
+    chunk_size = 500
+
+    def __init__(self, path=None):
+        self.path = path or conf.SEARCH_QUEUE_PATH
+        if not self.path:
+            # The temp directory is emptied by reboots and cleaners, the
+            # queue has to outlive both.
+            raise AttributeError("SEARCH_QUEUE_PATH must be set for the "
+                                 "\"sqlite\" SEARCH_QUEUE_BACKEND")
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._local = threading.local()
+
+    def _connection(self):
+        """
+        One connection per thread and process, SQLite connections can't be
+        shared by either.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.DatabaseError:
+                pass
+            connection.execute(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def put(self, method, document_key, object_pk, doc_pk):
+        self._check(method)
+        self._connection().execute(
+            "INSERT INTO solango_queue (method, document_key, object_pk, doc_pk)"
+            " VALUES (?, ?, ?, ?)",
+            (method, document_key, unicode(object_pk), doc_pk))
+
+    def take(self, limit):
+        cursor = self._connection().execute(
+            "SELECT id, method, document_key, object_pk, doc_pk"
+            " FROM solango_queue ORDER BY id LIMIT ?", (limit,))
+        return [Event(*row) for row in cursor.fetchall()]
+
+    def remove(self, events):
+        ids = [event.id for event in events]
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            for i in range(0, len(ids), self.chunk_size):
+                chunk = ids[i:i + self.chunk_size]
+                connection.execute(
+                    "DELETE FROM solango_queue WHERE id IN (%s)" %
+                    ", ".join(["?"] * len(chunk)), chunk)
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def count(self):
+        return self._connection().execute(
+                    "SELECT COUNT(*) FROM solango_queue").fetchone()[0]
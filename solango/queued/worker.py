@@ -0,0 +1,233 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Queue Worker
+============
+
+Drains the indexing queue::
+
+    from solango.queued.worker import QueueWorker
+
+    QueueWorker(batch_size=1000).run()
+
+Each batch takes the oldest events and keeps the newest one per document, so
+an instance saved ten times is rendered and sent once and a save followed by
+a delete only sends the delete. The instances of a batch are loaded with one
+query per model. Every index gets one add request, one delete request and one
+commit per batch.
+
+Events are only removed once Solr took them. If Solr can't be reached or
+fails with a server error, the batch is kept and tried again after a pause
+that doubles up to max_backoff seconds. Documents Solr rejects are stored
+with the deferred backend instead. An event that can't be rendered, with an
+object_pk of the wrong type or a transform that raises, is logged and
+dropped with its batch, it doesn't hold up the queue.
+"""
+
+import time
+
+from django.db import DatabaseError
+
+from solango import conf
+from solango.log import logger
+from solango.queued import get_queue
+from solango.solr import get_model_from_key
+
+class QueueWorker(object):
+    """
+    ..attribute: count, deleted, failed
+
+        Number of documents added, deleted and deferred so far.
+
+    ..attribute: dropped
+
+        Number of events dropped because they couldn't be rendered.
+    """
+
+    def __init__(self, queue=None, batch_size=None, poll_interval=None,
+                 max_backoff=60, report=None):
+        self.queue = queue or get_queue()
+        if self.queue is None:
+            raise ValueError("SEARCH_QUEUE_BACKEND is not set")
+        self.batch_size = batch_size or conf.SEARCH_QUEUE_BATCH_SIZE
+        if poll_interval is None:
+            poll_interval = conf.SEARCH_QUEUE_POLL_INTERVAL
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.report = report or logger.info
+
+        self.count = 0
+        self.deleted = 0
+        self.failed = 0
+        self.dropped = 0
+        self._backoff = 0
+
+    def run(self, once=False):
+        """
+        Processes batches until the process is stopped, or until the queue
+        is empty with once.
+        """
+        while True:
+            try:
+                sent = self.process_batch()
+            except KeyboardInterrupt:
+                raise
+            except Exception, e:
+                logger.exception("Queue batch failed: %s" % e)
+                sent = None
+
+            if sent is None:
+                self._backoff = min(self.max_backoff,
+                                    (self._backoff or 0.5) * 2)
+                self.report("Retrying in %.1f seconds" % self._backoff)
+                time.sleep(self._backoff)
+                continue
+
+            self._backoff = 0
+            if sent == 0:
+                if once:
+                    return self
+                time.sleep(self.poll_interval)
+
+    def process_batch(self):
+        """
+        Sends one batch. Returns the number of events it removed, or None if
+        the batch has to be tried again.
+        """
+        events = self.queue.take(self.batch_size)
+        if not events:
+            return 0
+
+        latest = {}
+        for event in events:
+            latest[event.doc_pk] = event
+
+        for index, (adds, deletes) in self.render(latest.values()).items():
+            if not self.send(index, adds, deletes):
+                return None
+
+        self.queue.remove(events)
+        self.report("Sent %d events: %d documents added, %d deleted" %
+                    (len(events), self.count, self.deleted))
+        return len(events)
+
+    def render(self, events):
+        """
+        Returns the add fragments and the delete fragments of events by
+        index. Instances that are gone or not indexable are deleted.
+        """
+        import solango
+
+        by_model = {}
+        for event in events:
+            by_model.setdefault(event.document_key, []).append(event)
+
+        operations = {}
+        for document_key, model_events in by_model.items():
+            document = solango.documents.get(document_key)
+            if document is None:
+                logger.error("Dropping queued events of unregistered %s" %
+                             document_key)
+                continue
+
+            serializer = document.get_serializer()
+
+            model = get_model_from_key(document_key)
+            pk = model._meta.pk
+            object_pks = {}
+            for event in model_events:
+                if event.method == "add":
+                    try:
+                        object_pks[event.doc_pk] = \
+                                pk.to_python(event.object_pk)
+                    except Exception, e:
+                        self._drop(event, e)
+            instances = model._default_manager.in_bulk(object_pks.values())
+
+            for event in model_events:
+                if event.method == "add" and event.doc_pk not in object_pks:
+                    continue
+                instance = instances.get(object_pks.get(event.doc_pk))
+                try:
+                    index, method, xml = self._render(event, document,
+                                                      serializer, instance)
+                except DatabaseError:
+                    # Tried again with the batch, like a Solr outage.
+                    raise
+                except Exception, e:
+                    self._drop(event, e)
+                    continue
+                adds, deletes = operations.setdefault(index, ([], []))
+                if method == "add":
+                    adds.append((event.doc_pk, xml))
+                else:
+                    deletes.append((event.doc_pk, xml))
+        return operations
+
+    def _render(self, event, document, serializer, instance):
+        """
+        Returns the index, the method and the fragment of event. Instances
+        that are gone or not indexable are deleted.
+        """
+        index = document.index.index_for(event.doc_pk)
+        format = index.connection.format
+        if instance is not None:
+            doc = serializer.bare(instance)
+            if doc.is_indexable(instance):
+                return index, "add", format.add_fragment(doc, serializer)
+        return index, "delete", format.delete_id(event.doc_pk)
+
+    def _drop(self, event, error):
+        logger.exception("Dropping queued %s of %s, it can't be rendered: %s"
+                         % (event.method, event.doc_pk, error))
+        self.dropped += 1
+
+    def send(self, index, adds, deletes):
+        """
+        Sends the adds and deletes of a batch to index and commits. Returns
+        False if the batch has to be tried again.
+        """
+        connection = index.connection
+        separator = connection.format.separator
+
+        if adds:
+            result = connection.add(separator.join([xml for pk, xml in adds]),
+                                    commit=False)[0]
+            if not result.success:
+                if self._retry(result):
+                    return False
+                for pk, xml in adds:
+                    index.defer("add", xml, pk, result.error)
+                self.failed += len(adds)
+            else:
+                self.count += len(adds)
+
+        if deletes:
+            result = connection.delete(separator.join([xml for pk, xml
+                                                       in deletes]),
+                                       commit=False)[0]
+            if not result.success:
+                if self._retry(result):
+                    return False
+                for pk, xml in deletes:
+                    index.defer("delete", xml, pk, result.error)
+                self.failed += len(deletes)
+            else:
+                self.deleted += len(deletes)
+
+        result = connection.commit()
+        if not result.success:
+            if self._retry(result):
+                return False
+            index.defer("commit", result.xml, error=result.error)
+        return True
+
+    def _retry(self, result):
+        """
+        Connection errors and server errors are worth another try, a
+        rejected request is not.
+        """
+        logger.error("Solr update failed: %s" % result.error)
+        return result.error_code is None or result.error_code >= 500
@@ -0,0 +1,176 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Circuit Breaker
+===============
+
+Stops calling a Solr instance that keeps failing, so requests don't pile up
+on it while it is down or stuck in a merge::
+
+    breaker = get_breaker("http://localhost:8983/solr/update")
+    if breaker.allow():
+        ...
+        breaker.success()   # or breaker.failure()
+
+The breaker is closed until SEARCH_BREAKER_THRESHOLD requests failed or
+timed out within SEARCH_BREAKER_WINDOW seconds. It is open then, and allow()
+returns False, for SEARCH_BREAKER_RESET seconds. After that it is half open
+and lets a single request through to probe Solr: the breaker closes if it
+succeeds and opens again if it fails.
+
+Selects are answered with SelectErrorResults and writes go to the deferred
+backend while the breaker of their index is open, see SearchWrapper.
+"""
+
+import threading
+import time
+
+from solango import conf
+from solango.log import logger
+
+(CLOSED, OPEN, HALF_OPEN) = ("closed", "open", "half_open")
+
+# The error of the results of requests that were not sent.
+CIRCUIT_OPEN = "Circuit open, Solr was not called"
+
+class CircuitBreaker(object):
+    """
+    ..attribute: state
+
+        CLOSED, OPEN or HALF_OPEN.
+
+    ..attribute: trips
+
+        Number of times the breaker opened.
+
+    ..attribute: rejected
+
+        Number of requests that were not allowed.
+    """
+
+    def __init__(self, threshold=None, window=None, reset=None):
+        if threshold is None:
+            threshold = conf.SEARCH_BREAKER_THRESHOLD
+        self.threshold = threshold
+        self.window = window or conf.SEARCH_BREAKER_WINDOW
+        self.reset = reset or conf.SEARCH_BREAKER_RESET
+
+        self.state = CLOSED
+        self.trips = 0
+        self.rejected = 0
+        self._failures = []
+        self._opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        True while requests are turned away, without taking the probe of a
+        half open breaker.
+        """
+        return self.state == OPEN and time.time() - self._opened < self.reset
+
+    def allow(self):
+        """
+        Returns True if a request may be sent. Every allowed request must be
+        followed by success() or failure().
+        """
+        if not self.threshold or self.state == CLOSED:
+            return True
+
+        self._lock.acquire()
+        try:
+            if self.state == OPEN and time.time() - self._opened >= self.reset:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+        finally:
+            self._lock.release()
+
+    def success(self):
+        if self.state == CLOSED and not self._failures:
+            return
+
+        self._lock.acquire()
+        try:
+            if self.state == OPEN:
+                # Sent before the breaker opened.
+                return
+            if self.state == HALF_OPEN:
+                logger.info("Circuit closed, Solr is answering again")
+                self.state = CLOSED
+                self._probing = False
+                self._failures = []
+                return
+            # Failures count for their whole window, successes in between
+            # don't reset them.
+            now = time.time()
+            self._failures = [t for t in self._failures
+                              if now - t < self.window]
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        if not self.threshold:
+            return
+
+        self._lock.acquire()
+        try:
+            now = time.time()
+            if self.state == HALF_OPEN:
+                logger.warning("Circuit open again, the probe failed")
+                self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            self._failures = [t for t in self._failures
+                              if now - t < self.window]
+            self._failures.append(now)
+            if len(self._failures) >= self.threshold:
+                logger.error("Circuit open for %s seconds after %d failures "
+                             "in %s seconds" % (self.reset,
+                                                len(self._failures),
+                                                self.window))
+                self.trips += 1
+                self._open(now)
+        finally:
+            self._lock.release()
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened = now
+        self._probing = False
+        self._failures = []
+
+    def stats(self):
+        state = self.state
+        if state == OPEN and not self.is_open():
+            state = HALF_OPEN
+        return {"state": state,
+                "failures": len(self._failures),
+                "trips": self.trips,
+                "rejected": self.rejected}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(url):
+    """
+    Returns the CircuitBreaker shared by every connection to url.
+    """
+    _breakers_lock.acquire()
+    try:
+        breaker = _breakers.get(url)
+        if breaker is None:
+            breaker = _breakers[url] = CircuitBreaker()
+        return breaker
+    finally:
+        _breakers_lock.release()
@@ -0,0 +1,377 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Write Buffer
+============
+
+Collects the adds and deletes of the post_save and post_delete signals and
+sends them to Solr in batches instead of one request per save::
+
+    SEARCH_BUFFER_WRITES = True
+
+Writes are kept per thread and per document, so saving the same instance
+five times in a request sends it once, with its last state. The buffer of a
+thread is flushed:
+
+* when the request ends (``request_finished``). With TransactionMiddleware
+  that is after the transaction is committed.
+* when SEARCH_BUFFER_SIZE documents are waiting, or the oldest one has
+  waited SEARCH_BUFFER_INTERVAL seconds. A timer of the buffer flushes the
+  writes of threads that went idle since.
+* when ``index.flush()`` is called, after a transaction outside of a
+  request for example.
+* when the process exits, for every thread, and the exit waits until the
+  flushed requests are sent.
+
+A flush renders the documents in the calling thread and hands the requests
+to a sender thread, so the request doesn't wait on Solr. The requests of
+one index are sent in the order they were flushed. Whether a flush commits
+is SEARCH_BUFFER_COMMIT: "flush" commits after every flush, None leaves it
+to Solr's autoCommit. Under the "coalesce" SEARCH_COMMIT_POLICY the commit
+of a flush is scheduled with the other commits of the index. Failed
+requests go to the deferred backend.
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+from django.core import signals
+
+from solango import conf
+from solango.log import logger
+from solango.solr import futures
+from solango.solr import get_instance_key
+
+COMMIT_POLICIES = ("flush", None)
+
+class _Writes(object):
+    """
+    The pending writes of one thread, by document key, and when the first
+    of them was made.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.started = None
+
+class WriteBuffer(object):
+    """
+    ..attribute: size
+
+        Number of pending documents that triggers a flush.
+
+    ..attribute: interval
+
+        Seconds the oldest pending document waits at most, None to only
+        flush at the end of the request.
+
+    ..attribute: commit
+
+        Commit policy, one of COMMIT_POLICIES.
+    """
+
+    def __init__(self, index, size=None, interval=None, commit="default"):
+        self.index = index
+        self.size = size or conf.SEARCH_BUFFER_SIZE
+        if interval is None:
+            interval = conf.SEARCH_BUFFER_INTERVAL
+        self.interval = interval
+        if commit == "default":
+            commit = conf.SEARCH_BUFFER_COMMIT
+        if commit not in COMMIT_POLICIES:
+            raise ValueError("Unknown commit policy %r" % (commit,))
+        self.commit = commit
+
+        self._local = threading.local()
+        self._sender = None
+        self._sender_pid = None
+        self._lock = threading.Lock()
+        # The _Writes of every thread with pending writes, guarded by
+        # _writes_lock, and the timer that flushes them after interval.
+        self._waiting = []
+        self._writes_lock = threading.Lock()
+        self._timer = None
+        self._timer_pid = None
+
+        _buffers.append(self)
+
+    def _writes(self):
+        """
+        The _Writes of this thread.
+        """
+        try:
+            return self._local.writes
+        except AttributeError:
+            self._local.writes = _Writes()
+            return self._local.writes
+
+    def __len__(self):
+        return len(self._writes().pending)
+
+    def _put(self, key, write):
+        writes = self._writes()
+        self._writes_lock.acquire()
+        try:
+            if not writes.pending:
+                writes.started = time.time()
+                self._waiting.append(writes)
+                if self.interval and (self._timer is None or
+                                      self._timer_pid != os.getpid()):
+                    self._start_timer(self.interval)
+            writes.pending[key] = write
+            due = len(writes.pending) >= self.size or (self.interval and
+                    time.time() - writes.started >= self.interval)
+        finally:
+            self._writes_lock.release()
+
+        if due:
+            self.flush()
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.setDaemon(True)
+        self._timer.start()
+        self._timer_pid = os.getpid()
+
+    def _expire(self):
+        """
+        Flushes the writes of every thread that waited interval seconds, so
+        a thread that wrote once and went idle doesn't keep them.
+        """
+        now = time.time()
+        self._writes_lock.acquire()
+        try:
+            self._timer = None
+            expired = [writes for writes in self._waiting
+                       if now - writes.started >= self.interval]
+            started = [writes.started for writes in self._waiting
+                       if writes not in expired]
+            if started:
+                self._start_timer(max(min(started) + self.interval - now,
+                                      0.01))
+        finally:
+            self._writes_lock.release()
+
+        for writes in expired:
+            try:
+                self._flush(writes)
+            except Exception, e:
+                logger.exception("Flushing the write buffer of %s failed: %s"
+                                 % (self.index.name, e))
+
+    def _take(self, writes):
+        """
+        Removes the pending writes of writes and returns them.
+        """
+        self._writes_lock.acquire()
+        try:
+            items = writes.pending.items()
+            writes.pending.clear()
+            if writes in self._waiting:
+                self._waiting.remove(writes)
+            return items
+        finally:
+            self._writes_lock.release()
+
+    def add(self, instance):
+        """
+        Queues instance to be indexed. It is rendered when the buffer is
+        flushed, with the state it has then.
+        """
+        from solango import documents
+        document = documents[get_instance_key(instance)]
+        serializer = document.get_serializer()
+        self._put(serializer.pk(serializer.bare(instance)),
+                  ("add", document, instance))
+
+    def delete(self, instance):
+        """
+        Queues instance to be removed from the index. The delete is rendered
+        right away, Django clears the primary key of deleted instances.
+        """
+        from solango import documents
+        document = documents[get_instance_key(instance)]
+        serializer = document.get_serializer()
+        doc = serializer.bare(instance)
+        self._put(serializer.pk(doc),
+                  ("delete", document,
+                   self.index.connection.format.delete_fragment(doc,
+                                                                serializer)))
+
+    def discard(self):
+        """
+        Drops the pending writes of this thread.
+        """
+        self._take(self._writes())
+
+    def flush(self, wait=False):
+        """
+        Renders the pending writes of this thread and sends them. Returns
+        the Future of the requests, or None if nothing was pending. With
+        wait the requests are done when flush returns.
+        """
+        return self._flush(self._writes(), wait)
+
+    def flush_threads(self, wait=False):
+        """
+        Flushes the pending writes of every thread, returns the Futures of
+        the requests.
+        """
+        self._writes_lock.acquire()
+        try:
+            waiting = list(self._waiting)
+        finally:
+            self._writes_lock.release()
+        return [future for future in [self._flush(writes, wait)
+                                      for writes in waiting]
+                if future is not None]
+
+    def _flush(self, writes, wait=False):
+        items = self._take(writes)
+        if not items:
+            return None
+
+        format = self.index.connection.format
+        adds, deletes = [], []
+        for key, (method, document, obj) in items:
+            if method == "delete":
+                deletes.append((key, obj))
+                continue
+            serializer = document.get_serializer()
+            doc = serializer.bare(obj)
+            if doc.is_indexable(obj):
+                adds.append((key, format.add_fragment(doc, serializer)))
+            else:
+                deletes.append((key, format.delete_fragment(doc, serializer)))
+
+        future = self._get_sender().submit(self._send, adds, deletes)
+        if wait:
+            future.result()
+        return future
+
+    def _get_sender(self):
+        """
+        A single thread per index sends the flushed writes, so they reach
+        Solr in the order they were made.
+        """
+        self._lock.acquire()
+        try:
+            if self._sender is None or self._sender_pid != os.getpid():
+                self._sender = futures.Executor(1)
+                self._sender_pid = os.getpid()
+            return self._sender
+        finally:
+            self._lock.release()
+
+    def join(self, timeout=None):
+        """
+        Blocks until the writes flushed so far are sent, at most timeout
+        seconds. Returns False if they aren't.
+        """
+        self._lock.acquire()
+        try:
+            sender = self._sender
+            if sender is None or self._sender_pid != os.getpid():
+                return True
+        finally:
+            self._lock.release()
+        # The sender sends in order, the writes are done before this.
+        try:
+            sender.submit(int).result(timeout)
+        except futures.FutureTimeout:
+            return False
+        return True
+
+    def _send(self, adds, deletes):
+        # Nobody waits on the Future of most flushes, an exception in it
+        # would lose the writes without a trace.
+        handled = []
+        try:
+            return self._send_writes(adds, deletes, handled)
+        except Exception, e:
+            error = sys.exc_info()
+            logger.exception("Buffered writes to %s failed: %s" %
+                             (self.index.name, e))
+            for method, writes in (("add", adds), ("delete", deletes)):
+                if method not in handled:
+                    for key, xml in writes:
+                        self._defer(method, xml, key, str(e))
+            raise error[0], error[1], error[2]
+
+    def _defer(self, method, xml, key, error):
+        try:
+            self.index.defer(method, xml, key, error)
+        except Exception, e:
+            logger.exception("Deferring the buffered %s of %s failed: %s" %
+                             (method, key, e))
+
+    def _send_writes(self, adds, deletes, handled):
+        """
+        Sends the writes of a flush, appending "add" and "delete" to handled
+        once the adds and the deletes are sent or deferred.
+        """
+        connection = self.index.connection
+        separator = connection.format.separator
+
+        if adds:
+            result = connection.add(separator.join([xml for key, xml in adds]),
+                                    commit=False)[0]
+            if not result.success:
+                logger.error("Buffered add of %d documents failed: %s" %
+                             (len(adds), result.error))
+                for key, xml in adds:
+                    self.index.defer("add", xml, key, result.error)
+        handled.append("add")
+
+        if deletes:
+            result = connection.delete(separator.join([xml for key, xml
+                                                       in deletes]),
+                                       commit=False)[0]
+            if not result.success:
+                logger.error("Buffered delete of %d documents failed: %s" %
+                             (len(deletes), result.error))
+                for key, xml in deletes:
+                    self.index.defer("delete", xml, key, result.error)
+        handled.append("delete")
+
+        if self.commit == "flush":
+            result = connection.request_commit()
+            if not result.success:
+                self.index.defer("commit", result.xml, error=result.error)
+
+        logger.debug("Flushed %d adds and %d deletes to %s" %
+                     (len(adds), len(deletes), self.index.name))
+        return len(adds), len(deletes)
+
+_buffers = []
+
+def flush_all(wait=False):
+    """
+    Flushes the pending writes of the current thread in every buffer.
+    """
+    return [future for future in [buffer.flush(wait) for buffer in _buffers]
+            if future is not None]
+
+def _request_finished(sender, **kwargs):
+    flush_all()
+
+def _exit():
+    """
+    Flushes the pending writes of every thread and waits for the senders,
+    their daemon threads don't outlive the process.
+    """
+    for buffer in _buffers:
+        try:
+            buffer.flush_threads()
+            buffer.join()
+        except Exception, e:
+            logger.error("Flushing the write buffer of %s failed: %s" %
+                         (buffer.index.name, e))
+
+signals.request_finished.connect(_request_finished)
+atexit.register(_exit)
@@ -0,0 +1,318 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Query Result Cache
+==================
+
+Caches the response bodies of select requests, keyed by the request url::
+
+    SEARCH_CACHE_BACKEND = "locmem"    # or "django", None turns it off
+    SEARCH_CACHE_TTL = 60
+
+    index.select("django")                     # cached for SEARCH_CACHE_TTL
+    index.select("django", cache_ttl=5)        # cached for 5 seconds
+    index.select("django", cache=False)        # always sent to Solr
+    index.cache_stats()
+    {'hits': 12, 'misses': 3, ...}
+
+Every update request sent to an index (add, delete, delete_by_query, commit,
+optimize) starts a new cache generation for it. The generation is part of the
+cache key, so nothing cached before a write is read after it. The
+generation is read before a select is sent, so a result fetched while a
+commit happens is stored under the old generation and never read. Under the
+"within" SEARCH_COMMIT_POLICY Solr commits a write by itself later, the
+generation changes again once the commit is due.
+
+"locmem" keeps an LRU of SEARCH_CACHE_SIZE results in the process. A write
+only invalidates the caches of the process it happened in, other processes
+serve their results until the TTL runs out. "django" uses the Django cache
+backend and keeps the generation in it too, so a write invalidates the
+results of every process sharing that backend.
+"""
+
+import os
+import threading
+import time
+
+from django.utils.hashcompat import md5_constructor
+
+from solango import conf
+
+class BaseQueryCache(object):
+    """
+    ..attribute: name
+
+        The update url of the index the cache belongs to.
+
+    ..attribute: ttl
+
+        Seconds results are kept unless a select asks for another ttl.
+
+    ..attribute: hits, misses
+
+        Counters for the selects answered from the cache and the selects sent
+        to Solr.
+    """
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        if ttl is None:
+            ttl = conf.SEARCH_CACHE_TTL
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._later_lock = threading.Lock()
+        self._later_due = 0
+        self._later_timer = None
+        self._later_pid = None
+
+    def generation(self):
+        """
+        Returns the current generation.
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """
+        Starts a new generation.
+        """
+        raise NotImplementedError
+
+    def invalidate_later(self, delay):
+        """
+        Starts a new generation delay seconds from now, for a write Solr
+        commits by itself (commitWithin). Results cached until the commit
+        are from before it. Later calls push the new generation back.
+        """
+        self._later_lock.acquire()
+        try:
+            self._later_due = max(self._later_due, time.time() + delay)
+            if self._later_timer is None or \
+                    self._later_pid != os.getpid():
+                self._start_later(delay)
+        finally:
+            self._later_lock.release()
+
+    def _start_later(self, delay):
+        self._later_timer = threading.Timer(delay, self._run_later)
+        self._later_timer.setDaemon(True)
+        self._later_timer.start()
+        self._later_pid = os.getpid()
+
+    def _run_later(self):
+        self._later_lock.acquire()
+        try:
+            remaining = self._later_due - time.time()
+            if remaining > 0:
+                self._start_later(remaining)
+                return
+            self._later_timer = None
+        finally:
+            self._later_lock.release()
+        self.invalidate()
+
+    def get(self, url, generation):
+        """
+        Returns the body cached for url in generation, or None.
+        """
+        body = self._get(self._key(url, generation))
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def set(self, url, generation, body, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl:
+            self._set(self._key(url, generation), body, ttl)
+
+    def _key(self, url, generation):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, body, ttl):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        return {"backend": self.backend,
+                "generation": self.generation(),
+                "hits": self.hits,
+                "misses": self.misses}
+
+class LocMemQueryCache(BaseQueryCache):
+    """
+    A thread safe LRU cache in the memory of the process.
+
+    ..attribute: size
+
+        Maximum number of cached results.
+    """
+
+    backend = "locmem"
+
+    def __init__(self, name, ttl=None, size=None):
+        super(LocMemQueryCache, self).__init__(name, ttl)
+        self.size = size or conf.SEARCH_CACHE_SIZE
+
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        # key -> [previous, next, key, body, expires], in a circular doubly
+        # linked list in order of use, the least recently used after _root.
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def generation(self):
+        return self._generation
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            # Entries of older generations can't be read anymore.
+            self._clear()
+        finally:
+            self._lock.release()
+
+    def _key(self, url, generation):
+        return (generation, url)
+
+    def _unlink(self, entry):
+        previous, next = entry[0], entry[1]
+        previous[1] = next
+        next[0] = previous
+
+    def _append(self, entry):
+        last = self._root[0]
+        entry[0], entry[1] = last, self._root
+        last[1] = self._root[0] = entry
+
+    def _get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._unlink(entry)
+            if entry[4] < time.time():
+                del self._entries[key]
+                return None
+            self._append(entry)
+            return entry[3]
+        finally:
+            self._lock.release()
+
+    def _set(self, key, body, ttl):
+        self._lock.acquire()
+        try:
+            if key[0] != self._generation:
+                return
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+            while len(self._entries) >= self.size:
+                oldest = self._root[1]
+                self._unlink(oldest)
+                del self._entries[oldest[2]]
+
+            entry = [None, None, key, body, time.time() + ttl]
+            self._append(entry)
+            self._entries[key] = entry
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        stats = super(LocMemQueryCache, self).stats()
+        stats.update({"size": self.size, "entries": len(self._entries)})
+        return stats
+
+class DjangoQueryCache(BaseQueryCache):
+    """
+    Results and the generation are kept in the Django cache backend
+    (CACHE_BACKEND), shared by every process that uses it.
+    """
+
+    backend = "django"
+
+    def __init__(self, name, ttl=None):
+        super(DjangoQueryCache, self).__init__(name, ttl)
+        self._prefix = "solango:query:%s" % md5_constructor(name).hexdigest()
+
+    def _cache(self):
+        from django.core.cache import cache
+        return cache
+
+    def generation(self):
+        cache = self._cache()
+        key = "%s:generation" % self._prefix
+        generation = cache.get(key)
+        if generation is None:
+            # Starting from the clock instead of 0 keeps an evicted generation
+            # from bringing old results back.
+            cache.add(key, int(time.time() * 1000))
+            generation = cache.get(key)
+        return generation
+
+    def invalidate(self):
+        cache = self._cache()
+        key = "%s:generation" % self._prefix
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000))
+
+    def _key(self, url, generation):
+        if isinstance(url, unicode):
+            url = url.encode("utf-8")
+        return "%s:%s:%s" % (self._prefix, generation,
+                             md5_constructor(url).hexdigest())
+
+    def _get(self, key):
+        return self._cache().get(key)
+
+    def _set(self, key, body, ttl):
+        self._cache().set(key, body, ttl)
+
+HANDLERS = {"locmem": LocMemQueryCache,
+            "django": DjangoQueryCache}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(update_url, name=None):
+    """
+    Returns the query cache of the index at update_url, shared by every
+    SearchWrapper writing to it, or None if caching is turned off. name is
+    the backend, SEARCH_CACHE_BACKEND by default.
+    """
+    if name is None:
+        name = conf.SEARCH_CACHE_BACKEND
+    if not name:
+        return None
+
+    if name not in HANDLERS:
+        raise AttributeError("SEARCH_CACHE_BACKEND must be one of the "
+                             "following: %s" % ", ".join(HANDLERS.keys()))
+
+    _caches_lock.acquire()
+    try:
+        key = (name, update_url)
+        if key not in _caches:
+            _caches[key] = HANDLERS[name](update_url)
+        return _caches[key]
+    finally:
+        _caches_lock.release()
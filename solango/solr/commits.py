@@ -0,0 +1,364 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Commit Scheduling
+=================
+
+By default every add, delete and delete_by_query is followed by a commit of
+its own. Solr opens a new searcher and warms its caches on every commit, so
+a busy site commits far more often than anyone can see the difference.
+SEARCH_COMMIT_POLICY chooses what a commit after a write means:
+
+* "immediate" - a commit request right after the write, as before.
+* "within"    - the write is sent with commitWithin, Solr commits it within
+  SEARCH_COMMIT_INTERVAL seconds by itself (Solr 3.6 and later).
+* "coalesce"  - the scheduler of the index commits once, SEARCH_COMMIT_INTERVAL
+  seconds after the first write that asked for it. The writes of every thread
+  in between share that commit.
+
+Under "coalesce" the processes sharing the Django cache backend also share
+their commits: a process only commits if no other one did within the last
+interval, and a commit that started after its last write covers them. With a
+cache that is local to the process, every process commits on its own.
+
+Writes return a ScheduledCommit in place of the commit results. Its wait()
+blocks until the write is visible to selects, committing right away under
+"within"::
+
+    results = index.add(instance)
+    results[1].wait(timeout=5)
+
+With SEARCH_COMMIT_SOFT the scheduled commits are soft commits (Solr 4 and
+later), which make the writes visible without flushing the index to disk,
+and every SEARCH_HARD_COMMIT_INTERVAL seconds one of them is a regular, hard
+commit instead. Explicit commit() calls are always hard commits.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from django.utils.hashcompat import md5_constructor
+
+from solango import conf
+from solango.log import logger
+from solango.solr.results import Results
+
+POLICIES = ("immediate", "within", "coalesce")
+
+class ScheduledCommit(Results):
+    """
+    The results of a commit that was scheduled, not sent. It succeeded as far
+    as the caller knows, wait() tells if and when it was done.
+
+    ..attribute: due
+
+        The time by which the write should be visible.
+    """
+    method = "commit"
+    header = {"status": 0, "QTime": None}
+
+    def __init__(self, scheduler, ticket, due):
+        self.url = scheduler.connection.update_url
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self.due = due
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the write is visible to selects, at most timeout seconds.
+        Returns False if the commit failed or timed out.
+        """
+        return self.scheduler.wait(self.ticket, timeout)
+
+class CommitScheduler(object):
+    """
+    Coalesces the commits of one update url. Writes take a ticket, numbered
+    in order, and a commit covers every ticket taken before it started.
+
+    ..attribute: commits, soft_commits
+
+        Number of commits sent, and how many of them were soft.
+
+    ..attribute: coalesced
+
+        Number of tickets that shared a commit with an earlier one.
+
+    ..attribute: skipped
+
+        Number of scheduled commits left out because another process
+        committed in time.
+    """
+
+    def __init__(self, connection, policy=None, interval=None, soft=None,
+                 hard_interval=None):
+        self.connection = connection
+        self.policy = policy or conf.SEARCH_COMMIT_POLICY
+        if self.policy not in POLICIES:
+            raise AttributeError("SEARCH_COMMIT_POLICY must be one of the "
+                                 "following: %s" % ", ".join(POLICIES))
+        self.interval = interval or conf.SEARCH_COMMIT_INTERVAL
+        if soft is None:
+            soft = conf.SEARCH_COMMIT_SOFT
+        self.soft = soft
+        self.hard_interval = hard_interval or conf.SEARCH_HARD_COMMIT_INTERVAL
+        self._prefix = "solango:commit:%s" % \
+                        md5_constructor(connection.update_url).hexdigest()
+
+        self.commits = 0
+        self.soft_commits = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.failures = 0
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # Tickets taken, covered by a finished commit and lost with a failed
+        # one. Timers don't survive a fork, a child starts over.
+        self._requested = 0
+        self._committed = 0
+        self._failed = 0
+        self._since = None
+        self._latest = None
+        self._timer = None
+        self._sending = False
+        self._last_hard = time.time()
+        self._pid = os.getpid()
+
+    def _cache(self):
+        from django.core.cache import cache
+        return cache
+
+    def schedule(self):
+        """
+        Asks for a commit of the writes done so far and returns its
+        ScheduledCommit.
+        """
+        self._condition.acquire()
+        try:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._requested > self._committed:
+                self.coalesced += 1
+            else:
+                self._since = time.time()
+            self._requested += 1
+            self._latest = time.time()
+            ticket = self._requested
+            if self.policy == "coalesce" and self._timer is None:
+                self._start_timer(self.interval)
+            return ScheduledCommit(self, ticket, self._since + self.interval)
+        finally:
+            self._condition.release()
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self._run)
+        self._timer.setDaemon(True)
+        self._timer.start()
+
+    def _run(self):
+        try:
+            self.flush(shared=True)
+        except Exception, e:
+            logger.exception("Scheduled commit failed: %s" % e)
+
+    def flush(self, ticket=None, shared=False):
+        """
+        Commits the pending tickets now, unless ticket is given and already
+        committed. A shared flush leaves the commit to another process that
+        committed in time, or waits for the interval of the last one to end.
+        """
+        self._condition.acquire()
+        try:
+            # One commit at a time, a commit in flight may cover ticket.
+            while self._sending:
+                self._condition.wait()
+            pending = self._requested
+            if pending <= self._committed or \
+                    (ticket is not None and ticket <= self._committed):
+                return
+            if self._timer is not None and not shared:
+                self._timer.cancel()
+            self._timer = None
+            latest = self._latest
+            self._sending = True
+        finally:
+            self._condition.release()
+
+        result = None
+        done = False
+        try:
+            if shared:
+                delay = self._claim(latest)
+                if delay is None:
+                    self.skipped += 1
+                    self._done(pending, True)
+                    done = True
+                    return
+                if delay > 0:
+                    self._condition.acquire()
+                    try:
+                        self._sending = False
+                        if self._timer is None:
+                            self._start_timer(delay)
+                        self._condition.notifyAll()
+                    finally:
+                        self._condition.release()
+                    done = True
+                    return
+            result = self._commit()
+        finally:
+            if not done:
+                self._done(pending, result is not None and result.success)
+
+        if not result.success:
+            logger.error("Scheduled commit to %s failed: %s" %
+                         (self.connection.update_url, result.error))
+        return result
+
+    def _claim(self, latest):
+        """
+        Takes the commit of the current interval in the shared cache. Returns
+        0 if this process commits, None if a commit that started after the
+        last pending ticket, taken at latest, covers the writes, or else the
+        seconds until the interval ends.
+        """
+        cache = self._cache()
+        now = time.time()
+        if cache.add("%s:lock" % self._prefix, now + self.interval,
+                     self.interval):
+            return 0
+        started = cache.get("%s:started" % self._prefix)
+        if started is not None and started >= latest:
+            return None
+        end = cache.get("%s:lock" % self._prefix)
+        if end is None:
+            return 0
+        return max(end - now, 0.01)
+
+    def _commit(self):
+        started = time.time()
+        hard = not self.soft or started - self._last_hard >= self.hard_interval
+        if hard:
+            body = self.connection.format.commit
+        else:
+            body = self.connection.format.soft_commit
+        result = self.connection._update_request("commit", body,
+                                                 conf.SEARCH_UPDATE_TIMEOUT)
+        if result.success:
+            self.commits += 1
+            if hard:
+                self._last_hard = started
+            else:
+                self.soft_commits += 1
+            self._cache().set("%s:started" % self._prefix, started,
+                              max(self.interval * 2, 60))
+        return result
+
+    def _done(self, ticket, success):
+        self._condition.acquire()
+        try:
+            self._sending = False
+            if success:
+                self._committed = max(self._committed, ticket)
+            else:
+                self.failures += 1
+                self._failed = max(self._failed, ticket)
+                # The writes are tried again with the next interval.
+                self._since = time.time()
+                if self.policy == "coalesce" and self._timer is None:
+                    self._start_timer(self.interval)
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def ticket(self):
+        """
+        The last ticket taken, a commit that starts now covers it.
+        """
+        return self._requested
+
+    def committed(self, ticket):
+        """
+        Called after a commit that started after ticket was taken succeeded.
+        """
+        self._condition.acquire()
+        try:
+            if ticket > self._committed and self._pid == os.getpid():
+                self._committed = ticket
+                self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def wait(self, ticket, timeout=None):
+        """
+        Blocks until ticket is committed, at most timeout seconds. Under
+        "within" the commit is sent right away, Solr doesn't tell when it
+        committed by itself.
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        if self.policy == "within":
+            self.flush(ticket)
+
+        self._condition.acquire()
+        try:
+            while ticket > self._committed:
+                if ticket <= self._failed:
+                    return False
+                if end is None:
+                    self._condition.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            return True
+        finally:
+            self._condition.release()
+
+    def stats(self):
+        return {"policy": self.policy,
+                "pending": self._requested - self._committed,
+                "commits": self.commits,
+                "soft_commits": self.soft_commits,
+                "coalesced": self.coalesced,
+                "skipped": self.skipped,
+                "failures": self.failures}
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(connection):
+    """
+    Returns the CommitScheduler shared by every connection to the update url
+    of connection.
+    """
+    _schedulers_lock.acquire()
+    try:
+        scheduler = _schedulers.get(connection.update_url)
+        if scheduler is None:
+            scheduler = CommitScheduler(connection)
+            _schedulers[connection.update_url] = scheduler
+        return scheduler
+    finally:
+        _schedulers_lock.release()
+
+def flush_all():
+    """
+    Sends the pending commits of every scheduler, at exit the timers are
+    gone with their daemon threads.
+    """
+    for scheduler in _schedulers.values():
+        if scheduler.policy == "coalesce":
+            try:
+                scheduler.flush()
+            except Exception, e:
+                logger.exception("Commit at exit failed: %s" % e)
+
+atexit.register(flush_all)
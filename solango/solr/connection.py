@@ -2,60 +2,160 @@
 # Copyright 2008 Optaros, Inc.
 #
 
-from datetime import datetime, timedelta
-import urllib2
+import httplib
+import socket
+import time
+import urllib
+import urlparse
 
 from solango import conf
 from solango.log import logger
-from solango.solr import results
+from solango.solr import results, pool, formats, futures
+from solango.solr.breaker import get_breaker, CIRCUIT_OPEN
+from solango.solr.cache import get_cache
+from solango.solr.commits import CommitScheduler, get_scheduler
 from solango.solr.query import Query
+from solango.solr.health import get_checker
+from solango.solr.router import get_router
 from solango.exceptions import SolrUnavailable, SolrException
 
 (DELETE, ADD) = (0,1)
 
+# Seconds past commitWithin until the commit of Solr is taken as visible.
+WITHIN_MARGIN = 1
+
+def _http_error(response):
+    return "HTTP Error %s: %s" % (response.status, response.reason)
+
+def _socket_error(e):
+    if isinstance(e, socket.timeout):
+        return "Timed out: %s" % (e or "no answer in time")
+    return str(e)
+
+def _with_params(url, params):
+    if not params:
+        return url
+    if "?" in url:
+        return "%s&%s" % (url, urllib.urlencode(params))
+    return "%s?%s" % (url, urllib.urlencode(params))
+
+def _host(url):
+    return urlparse.urlsplit(url)[:2]
+
+def _deadline(deadline, default):
+    """
+    The time by which a call of deadline seconds, or else default seconds,
+    has to be done. None if it may take for ever.
+    """
+    timeout = deadline or default
+    if timeout:
+        return time.time() + timeout
+    return None
+
+def _remaining(end):
+    """
+    The socket timeout left until end.
+    """
+    if end is None:
+        return None
+    return max(end - time.time(), 0.001)
+
 class SearchWrapper(object):
     """
     This class is the entry point for all search-bound actions, including
     adding (indexing), deleting, and selecting (searching).
-    """
     
-    available = False
-    heartbeat = None
+    Requests are issued on keep-alive connections from the pool of the Solr
+    host, see solango.solr.pool. Update bodies are built and parsed by the 
+    update format, see solango.solr.formats. Select results are cached in
+    the query cache of the index, see solango.solr.cache.
+    
+    Requests time out after SEARCH_SELECT_TIMEOUT or SEARCH_UPDATE_TIMEOUT
+    seconds, or the deadline of the call. Selects and updates each have a
+    circuit breaker that stops calling Solr once it keeps failing, see
+    solango.solr.breaker.
     
-    def __init__(self, update_url, select_url, ping_urls):
+    The commit after a write is sent, scheduled or left to Solr's
+    commitWithin by SEARCH_COMMIT_POLICY, see solango.solr.commits.
+    """
+    
+    def __init__(self, update_url, select_urls, ping_urls, update_format=None):
         """
         Resolves configuration and instantiates a Log for this object.
+        
+        select_urls is the select url, or a list of them for read replicas.
         """
+        if isinstance(select_urls, basestring):
+            select_urls = [select_urls]
         self.update_url = update_url
-        self.select_url = select_url
+        self.select_urls = list(select_urls)
+        self.select_url = self.select_urls[0]
+        self.router = get_router(self.select_urls)
         self.ping_urls = ping_urls
-        self.heartbeat = datetime(1970, 01, 01)
+        self.format = formats.get_format(update_format or 
+                                         conf.SEARCH_UPDATE_FORMAT)
+        self.cache = get_cache(update_url)
+        self.breaker = get_breaker(update_url)
+        self.select_breaker = get_breaker(tuple(self.select_urls))
+        self.scheduler = get_scheduler(self)
+        
+        # The replicas on the host of every ping url.
+        self._replicas = {}
+        checker = get_checker()
+        for url in self.ping_urls:
+            self._replicas[url] = [r for r in self.router.replicas 
+                                   if _host(r.url) == _host(url)]
+            checker.watch(url, self._health_checked)
     
     def is_available(self):
         """
         Returns True if the search system appears to be available and in good
-        health, False otherwise.  A ping is periodically sent to the search
-        server to query its availability.
+        health, False otherwise. The ping urls are checked by a background
+        thread, see solango.solr.health, this only reads their last state.
         """
-        (now, delta) = (datetime.now(), timedelta(0, 300))
-        
-        if now - self.heartbeat > delta:
-            try:
-                for url in self.ping_urls:
-                    res = urllib2.urlopen(url).read()
-            except StandardError:
-                self.available = False
-            else:
-                self.available = True
-                self.heartbeat = now
-            
-        return self.available
+        checker = get_checker()
+        for url in self.ping_urls:
+            if not checker.is_up(url) and not self._replicas[url]:
+                return False
+        return self.router.is_available()
     
+    def ping(self):
+        """
+        Pings every ping url now and returns True if they all answered.
+        """
+        checker = get_checker()
+        available = True
+        for url in self.ping_urls:
+            endpoint = checker.watch(url, self._health_checked)
+            checker.check_endpoint(endpoint)
+            if endpoint.error is not None:
+                available = False
+        return available
     
+    def _health_checked(self, endpoint):
+        """
+        Takes the replicas on the host of a ping url that is down out of the
+        select rotation, and puts them back once it is up again. A good ping
+        doesn't clear the failures of a replica whose selects fail.
+        """
+        for replica in self._replicas.get(endpoint.url, ()):
+            if not endpoint.up:
+                self.router.mark_down(replica)
+            elif endpoint.changed:
+                self.router.mark_up(replica)
     
-    def _update_request(self, method, xml):
+    def health_stats(self):
         """
-        Issues update requests
+        Returns the state of the ping urls.
+        """
+        checker = get_checker()
+        return dict([(url, checker.watch(url).stats()) 
+                     for url in self.ping_urls])
+    
+    def _update_request(self, method, xml, timeout=None, params=None):
+        """
+        Issues update requests, that give up after timeout seconds. params
+        are added to the update url.
         """
         
         if not xml:
@@ -63,54 +163,197 @@ class SearchWrapper(object):
         
         xml = xml.encode("utf-8", "replace")
         
-        request = urllib2.Request(self.update_url, xml)
-        request.add_header("Content-type", "text/xml; charset=utf-8")
+        headers = {"Content-type": self.format.content_type}
+        url = _with_params(self.format.url(self.update_url), params)
+        
+        if not self.breaker.allow():
+            return results.ErrorResults(method, url, xml, CIRCUIT_OPEN)
         
         response = None
         try:
-            response = urllib2.urlopen(request)
-        except urllib2.HTTPError, e:
-            return results.ErrorResults(method, self.update_url, xml, str(e), e.code)
-        except urllib2.URLError, e: 
-            return results.ErrorResults(method, self.update_url, xml, str(e))
+            response = pool.urlopen(url, xml, headers, timeout)
+        except (httplib.HTTPException, socket.error), e:
+            self.breaker.failure()
+            return results.ErrorResults(method, url, xml, _socket_error(e))
+        finally:
+            self._invalidate()
+        
+        if response.status >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        
+        if response.status >= 400:
+            return results.ErrorResults(method, url, xml,
+                                        _http_error(response), response.status)
         
-        return results.UpdateResults(response.read())
+        return self.format.results(response.read())
     
-    def _select_request(self, url):
+    def _invalidate(self):
         """
-        Issues update requests
+        Even a failed update may have changed the index, so every update
+        starts a new cache generation.
         """
+        if self.cache is not None:
+            self.cache.invalidate()
+    
+    def _select_request(self, path, cache_ttl=None, generation=None,
+                        end=None):
+        """
+        Issues select requests to the replicas picked by the router, the next
+        one if a replica can't be reached or fails with a server error, until
+        the time end. If a cache generation is given, the response is cached
+        for cache_ttl seconds.
+        """
+        
+        headers = {"Content-type": "application/json; charset=utf-8"}
+        
+        if not self.select_breaker.allow():
+            return results.SelectErrorResults(self.select_url + path,
+                                              CIRCUIT_OPEN)
+        
+        error = None
+        for replica in self.router.order():
+            if error is not None and end is not None and time.time() >= end:
+                break
+            url = replica.url + path
+            started = self.router.start(replica)
+            try:
+                response = pool.urlopen(url, headers=headers,
+                                        timeout=_remaining(end))
+            except (httplib.HTTPException, socket.error), e:
+                self.router.finish(replica, started, False)
+                logger.warning("Select from %s failed: %s" % (replica.url, e))
+                error = results.SelectErrorResults(url, _socket_error(e))
+                continue
+            
+            if response.status >= 500:
+                self.router.finish(replica, started, False)
+                logger.warning("Select from %s failed: %s" % 
+                               (replica.url, _http_error(response)))
+                error = results.SelectErrorResults(url, _http_error(response),
+                                                   response.status)
+                continue
+            
+            self.router.finish(replica, started)
+            self.select_breaker.success()
+            if response.status >= 400:
+                return results.SelectErrorResults(url, _http_error(response),
+                                                  response.status)
+            
+            body = response.read()
+            select_results = results.SelectResults(url, body)
+            if generation is not None:
+                self.cache.set(self.select_url + path, generation, body,
+                               cache_ttl)
+            return select_results
         
-        request = urllib2.Request(url)
-        request.add_header("Content-type", "application/json; charset=utf-8")
+        self.select_breaker.failure()
+        return error
 
+    def _stream_request(self, method, chunks, timeout=None, params=None):
+        """
+        Issues an update request whose body is streamed from chunks.
+        """
+        headers = {"Content-type": self.format.content_type}
+        url = _with_params(self.format.url(self.update_url), params)
+        
+        if not self.breaker.allow():
+            return results.ErrorResults(method, url, None, CIRCUIT_OPEN)
+        
         response = None
         try:
-            response = urllib2.urlopen(request)
-        except urllib2.HTTPError, e:
-            return results.SelectErrorResults(url, str(e), e.code)
-        except  urllib2.URLError, e:
-            return results.SelectErrorResults(url, str(e))
+            response = pool.urlopen_chunked(url, chunks, headers, timeout)
+        except (httplib.HTTPException, socket.error), e:
+            self.breaker.failure()
+            return results.ErrorResults(method, url, None, _socket_error(e))
+        finally:
+            self._invalidate()
         
-        return results.SelectResults(url, response.read())
-
+        if response.status >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        
+        if response.status >= 400:
+            return results.ErrorResults(method, url, None,
+                                        _http_error(response), response.status)
+        
+        return self.format.results(response.read())
+    
+    def _write_params(self, commit):
+        """
+        The update url parameters of a write, commitWithin under the "within"
+        commit policy.
+        """
+        if commit and self.scheduler.policy == "within":
+            return {"commitWithin": int(self.scheduler.interval * 1000)}
+        return None
+    
+    def _commit_after(self, end):
+        """
+        The commit that follows a write with commit=True: sent under the
+        "immediate" commit policy, a ScheduledCommit otherwise.
+        """
+        if self.scheduler.policy == "immediate":
+            return self.commit(_remaining(end))
+        if self.scheduler.policy == "within" and self.cache is not None:
+            # Selects until Solr commits would cache the results from
+            # before the write, past the commit.
+            self.cache.invalidate_later(self.scheduler.interval +
+                                        WITHIN_MARGIN)
+        return self.scheduler.schedule()
        
-    def add(self, xml, commit=True):
+    def add(self, xml, commit=True, deadline=None):
         """
         Adds the specified list of objects to the search index.  Returns a
         two-element List of UpdateResults; the first element corresponds to
         the add operation, the second to the subsequent commit operation.
+        Unless SEARCH_COMMIT_POLICY is "immediate" the second is a
+        ScheduledCommit, whose wait() returns once the add is visible.
+        
+        The add and the commit have to be done within deadline seconds,
+        SEARCH_UPDATE_TIMEOUT by default.
         """
         
         if xml:
-            xml = "\n<add>\n" + xml + "</add>\n"
+            xml = self.format.add(xml)
         
+        end = _deadline(deadline, conf.SEARCH_UPDATE_TIMEOUT)
         results=[]
         
-        results.append(self._update_request("add", xml))
+        results.append(self._update_request("add", xml, _remaining(end),
+                                            self._write_params(commit)))
         
         if commit:
-            results.append(self.commit())
+            results.append(self._commit_after(end))
+        
+        return results
+    
+    def stream_add(self, docs, commit=True, deadline=None):
+        """
+        Adds the documents produced by the docs iterable, a sequence of
+        document fragments, in one chunked request. The body is written as 
+        the documents are generated so it never has to be built in memory.
+        Returns a List of UpdateResults like add.
+        """
+        format = self.format
+        def chunks():
+            yield format.add_prefix.encode("utf-8")
+            separator = ""
+            for doc in docs:
+                yield separator + doc.encode("utf-8", "replace")
+                separator = format.separator.encode("utf-8")
+            yield format.add_suffix.encode("utf-8")
+        
+        end = _deadline(deadline, conf.SEARCH_UPDATE_TIMEOUT)
+        results=[]
+        
+        results.append(self._stream_request("add", chunks(), _remaining(end),
+                                            self._write_params(commit)))
+        
+        if commit:
+            results.append(self._commit_after(end))
         
         return results
     
@@ -121,15 +364,16 @@ class SearchWrapper(object):
 
         results=[]
         
-        results.append(self.update(
-            unicode("\n<delete><query>%s</query></delete>\n" % q, "utf-8")
-        ))
+        results.append(self._update_request("update",
+                                            self.format.delete_by_query(q),
+                                            conf.SEARCH_UPDATE_TIMEOUT,
+                                            self._write_params(commit)))
         if commit:
-            results.append(self.commit())
+            results.append(self._commit_after(None))
 
         return results
 
-    def delete(self, xml, commit=True):
+    def delete(self, xml, commit=True, deadline=None):
         """
         Deletes the specified list of objects from the search index.  Returns
         a two-element List of UpdateResults; the first element corresponds to
@@ -137,47 +381,151 @@ class SearchWrapper(object):
         """
         
         if xml:
-            xml = "\n<delete>\n" + xml + "</delete>\n"
-                
+            xml = self.format.delete(xml)
+        
+        end = _deadline(deadline, conf.SEARCH_UPDATE_TIMEOUT)
         results=[]
         
-        results.append(self._update_request("delete", xml))
+        results.append(self._update_request("delete", xml, _remaining(end),
+                                            self._write_params(commit)))
         
         if commit:
-            results.append(self.commit())
+            results.append(self._commit_after(end))
         
         return results
     
-    def commit(self):
+    def commit(self, deadline=None):
         """
         Commits any pending changes to the search index.  Returns an
-        UpdateResults instance.
+        UpdateResults instance. The commit is sent right away whatever the
+        SEARCH_COMMIT_POLICY, and covers the writes that were scheduled.
+        """
+        ticket = self.scheduler.ticket()
+        result = self._update_request("commit", self.format.commit,
+                                      deadline or conf.SEARCH_UPDATE_TIMEOUT)
+        if result.success:
+            self.scheduler.committed(ticket)
+        return result
+    
+    def request_commit(self, deadline=None):
+        """
+        Commits by SEARCH_COMMIT_POLICY: a ScheduledCommit under "coalesce",
+        a commit sent right away otherwise.
         """
-        return self._update_request("commit", 
-                                    unicode("\n<commit/>\n", "utf-8"))
+        if self.scheduler.policy == "coalesce":
+            return self.scheduler.schedule()
+        return self.commit(deadline)
     
-    def optimize(self):
+    def optimize(self, deadline=None):
         """
         Optimizes the search index.  Returns an UpdateResults instance.
+        An optimize can take long, it waits for ever unless a deadline is
+        given.
         """
-        return self._update_request("optimize", 
-                                    unicode("\n<optimize/>\n", "utf-8"))
+        return self._update_request("optimize", self.format.optimize,
+                                    deadline)
     
-    def update(self, xml):
+    def update(self, xml, deadline=None):
         """
         Submits the specified Unicode content to Solr's update interface (POST).
         """
-        return self._update_request("update", xml)
+        return self._update_request("update", xml,
+                                    deadline or conf.SEARCH_UPDATE_TIMEOUT)
     
-    def select(self, initial=None, **kwargs):
+    def select(self, initial=None, cache=True, cache_ttl=None, deadline=None,
+               **kwargs):
         """
         Submits the specified query to Solr's select interface (GET).
+        
+        Results are read from and stored in the query cache unless cache is
+        False. cache_ttl overrides the SEARCH_CACHE_TTL of this query.
+        
+        The select gives up after deadline seconds, SEARCH_SELECT_TIMEOUT by
+        default. A deadline is also sent to Solr as timeAllowed, unless the
+        query has one, so Solr returns the partial results it found by then.
         """
         
         if initial and isinstance(initial, Query):
             query= initial
         else:
             query = Query(initial, **kwargs)
+        
+        if deadline and query.data["timeAllowed"].data is None:
+            query = query.clone()
+            query.timeAllowed = int(deadline * 1000)
+        end = _deadline(deadline, conf.SEARCH_SELECT_TIMEOUT)
 
-        request_url = self.select_url + query.url()
-        return self._select_request(request_url)
+        # Cached under the first url, whichever replica answers.
+        path = query.url()
+        if not cache or self.cache is None:
+            return self._select_request(path, end=end)
+        
+        request_url = self.select_url + path
+        generation = self.cache.generation()
+        body = self.cache.get(request_url, generation)
+        if body is not None:
+            return results.SelectResults(request_url, body)
+        return self._select_request(path, cache_ttl, generation, end)
+    
+    def select_async(self, initial=None, cache=True, cache_ttl=None,
+                     deadline=None, **kwargs):
+        """
+        Sends select on a worker thread and returns a Future of its results,
+        see solango.solr.futures.
+        """
+        return futures.submit(self.select, initial, cache, cache_ttl, 
+                              deadline, **kwargs)
+    
+    def add_async(self, xml, commit=True, deadline=None):
+        return futures.submit(self.add, xml, commit, deadline)
+    
+    def delete_async(self, xml, commit=True, deadline=None):
+        return futures.submit(self.delete, xml, commit, deadline)
+    
+    def commit_async(self):
+        return futures.submit(self.commit)
+    
+    def gather_select(self, queries, timeout=None):
+        """
+        Sends a select for every query at the same time and returns the
+        results in the same order. A query is a Query instance or the
+        initial argument of select.
+        """
+        return futures.gather([self.select_async(query) for query in queries],
+                              timeout)
+    
+    def pool_stats(self):
+        """
+        Returns the connection pool stats for the update and select hosts.
+        """
+        stats = {}
+        for url in [self.update_url] + self.select_urls:
+            stats[url] = pool.get_pool(url).stats()
+        return stats
+    
+    def breaker_stats(self):
+        """
+        Returns the state of the update and select circuit breakers.
+        """
+        return {"update": self.breaker.stats(),
+                "select": self.select_breaker.stats()}
+    
+    def commit_stats(self):
+        """
+        Returns the counters of the commit scheduler.
+        """
+        return self.scheduler.stats()
+    
+    def replica_stats(self):
+        """
+        Returns the load and health of every select replica.
+        """
+        return self.router.stats()
+    
+    def cache_stats(self):
+        """
+        Returns the query cache counters, or None if caching is turned off.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.stats()
@@ -52,13 +52,14 @@ from django.forms.models import model_to_dict
 from django.forms.forms import BaseForm
 from django.template.loader import render_to_string
 from django.utils.functional import curry
+from django.utils import simplejson
 
 from solango.solr import fields as search_fields
 from solango.solr import get_instance_key
 from solango.solr.utils import idict
 from solango import conf
 
-from copy import deepcopy
+from copy import copy, deepcopy
 
 __all__ = ('SearchDocumentBase', 'SearchDocument')
 
@@ -118,6 +119,187 @@ class DeclarativeFieldsMetaclass(type):
                      cls).__new__(cls, name, bases, attrs)
         return new_class
 
+def _add_json(fields, boost):
+    """
+    fields are `"name": value` members, empty ones are left out.
+    """
+    if boost:
+        boost_attr = ', "boost": %s' % simplejson.dumps(float(boost))
+    else:
+        boost_attr = ''
+    
+    return u'"add": {"doc": {%s}%s}' % (u", ".join(filter(None, fields)),
+                                         boost_attr)
+
+def _delete_json(pk):
+    return u'"delete": {"id": %s}' % simplejson.dumps(pk)
+
+def _defined_in(cls, name):
+    """
+    Returns the class of cls's MRO that defines the attribute name.
+    """
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass
+    return None
+
+class DocumentSerializer(object):
+    """
+    DocumentSerializer
+    ------------------
+    Serializes model instances for one document class without building a
+    document with its own copy of the fields.
+    
+    The plan is compiled once per class from ``base_fields``: for each field a
+    function returning its value for an instance, either the document's
+    ``transform_<name>`` hook or ``Field.get_value``, and a function rendering
+    that value. Fields that override ``transform`` without ``get_value``, or 
+    that render themselves, are copied and transformed per document as before.
+    
+    Hooks, ``is_indexable`` and ``get_boost`` are called on a bare document.
+    Its ``pk_field`` is its own, with the value set, and so is its ``fields``
+    dictionary. The other fields in it are the unpopulated class fields,
+    shared by every document: hooks may replace them but not change them.
+    """
+    
+    def __init__(self, document):
+        self.document = document
+        self.fields = []
+        self.pk_field = None
+        self._pk_name = None
+        self._pk_value = None
+        
+        for name, field in document.base_fields.items():
+            value, render, render_json = self._compile(name, field)
+            self.fields.append((value, render, render_json))
+            
+            if self.pk_field is None and \
+                    isinstance(field, search_fields.PrimaryKeyField):
+                self.pk_field = field
+                self._pk_name = name
+                self._pk_value = value
+        
+        if self.pk_field is None:
+            raise NoPrimaryKeyFieldException('Search Document needs a Primary Key Field')
+    
+    def _compile(self, name, field):
+        cls = field.__class__
+        hook = getattr(self.document, 'transform_%s' % name, None)
+        
+        if not issubclass(_defined_in(cls, 'get_value'), 
+                          _defined_in(cls, 'transform')) \
+                or _defined_in(cls, '__unicode__') is not search_fields.Field \
+                or _defined_in(cls, '_create_field_xml') is not search_fields.Field:
+            def value(doc, instance):
+                f = deepcopy(field)
+                if hook is None:
+                    f.transform(instance)
+                    return f
+                try:
+                    f.value = hook(doc, instance)
+                except AttributeError:
+                    f.transform(instance)
+                return f
+            return value, unicode, lambda f: f._create_field_json()
+        
+        get_value = field.get_value
+        if hook is None:
+            value = lambda doc, instance: get_value(instance)
+        else:
+            def value(doc, instance):
+                try:
+                    return hook(doc, instance)
+                except AttributeError:
+                    return get_value(instance)
+        
+        return value, self._compile_render(field), field._create_field_json
+    
+    def _compile_render(self, field):
+        from_python = field.from_python
+        
+        boost_attr = ''
+        if field.boost:
+            boost_attr = ' boost="%s"' % field.boost
+        
+        pattern = u'<field name="%s"%s>%%s</field>\n' % (field.get_name(), 
+                                                          boost_attr)
+        
+        def render_value(value):
+            if value is None or value == '':
+                return ''
+            return pattern % from_python(value)
+        
+        if not field.multi_valued:
+            return render_value
+        
+        def render(values):
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            return '\n'.join([render_value(value) for value in values])
+        return render
+    
+    def bare(self, instance):
+        """
+        Returns a document for instance that shares the class fields but
+        the primary key field.
+        """
+        doc = self.document.__new__(self.document)
+        doc.fields = self.document.base_fields.copy()
+        doc.pk_field = self.pk_field
+        doc._instance = instance
+        doc.orginal_dict = {}
+        doc.data_dict = {}
+        doc.highlight = ""
+        doc.boost = ""
+        doc._transformed = True
+        
+        value = self._pk_value(doc, instance)
+        if isinstance(value, search_fields.Field):
+            pk_field = value
+        else:
+            pk_field = copy(self.pk_field)
+            pk_field.value = value
+        doc.pk_field = pk_field
+        doc.fields[self._pk_name] = pk_field
+        return doc
+    
+    def pk(self, doc):
+        return doc.pk_field.value
+    
+    def write_add_xml(self, doc, write):
+        """
+        Writes the add XML of a bare document piece by piece.
+        """
+        instance = doc._instance
+        
+        boost = doc.get_boost(instance)
+        if boost:
+            write(u'<doc boost="%s">\n' % boost)
+        else:
+            write(u'<doc>\n')
+        
+        for value, render, render_json in self.fields:
+            write(render(value(doc, instance)))
+        
+        write(u'</doc>\n')
+    
+    def to_add_xml(self, doc):
+        parts = []
+        self.write_add_xml(doc, parts.append)
+        return u"".join(parts)
+    
+    def to_delete_xml(self, doc):
+        return u"<id>%s</id>" % self.pk(doc)
+    
+    def to_add_json(self, doc):
+        instance = doc._instance
+        return _add_json([render_json(value(doc, instance)) for 
+                          value, render, render_json in self.fields],
+                         doc.get_boost(instance))
+    
+    def to_delete_json(self, doc):
+        return _delete_json(self.pk(doc))
+
 class BaseSearchDocument(object):
     """
     BaseSearchDocument
@@ -294,6 +476,19 @@ class BaseSearchDocument(object):
     def to_delete_xml(self):
         return u"<id>%s</id>" % self.pk_field.value
     
+    def to_add_json(self):
+        """
+        Returns the `"add"` command of this document for a JSON update.
+        """
+        self.transform()
+        
+        doc = [field._create_field_json() for field in self.fields.values()]
+        
+        return _add_json(doc, self.boost)
+    
+    def to_delete_json(self):
+        return _delete_json(self.pk_field.value)
+    
     def is_indexable(self, instance):
         """
         If true then the instance is indexed
@@ -312,6 +507,18 @@ class BaseSearchDocument(object):
     @classmethod
     def set_index(cls, index):
         cls.index = index
+    
+    @classmethod
+    def get_serializer(cls):
+        """
+        Returns the DocumentSerializer of this class, compiled on first use.
+        """
+        # Looked up on the class itself, subclasses compile their own.
+        serializer = cls.__dict__.get('_serializer')
+        if serializer is None:
+            serializer = DocumentSerializer(cls)
+            cls._serializer = serializer
+        return serializer
 
 class SearchDocument(BaseSearchDocument):
     id      = search_fields.PrimaryKeyField()
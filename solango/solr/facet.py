@@ -67,11 +67,13 @@ class Facet(object):
     
     name = None
     values = None
+    _index = None
     
     def get_parent(self, value):
         """
         Returns the best-fit immediate parent for the specified value, or
-        None if value does not appear to have a parent.
+        None if value does not appear to have a parent. Missing parents are
+        created with a count of 0.
         """
     
         n = value.value.rfind(conf.SEARCH_SEPARATOR)
@@ -81,40 +83,32 @@ class Facet(object):
         
         p = value.value[:n]
         
-        for v in self.values:
-            if v.value == p:
-                return v
-        
-        f = self.create_value(p, 0)
-        self.values.append(f)
+        f = self._index.get(p)
+        if f is None:
+            f = self._index[p] = self.create_value(p, 0)
+            self.values.append(f)
         
         return f
     
     def add_to_parent(self, parent, child):
         """
-        Appends child to parent, recursing up the tree to increment the counts
-        for any ancestors.
+        Appends child to parent. Counts are rolled up to the ancestors by
+        recurse_children once the tree is complete.
         """
         child.parent = parent
         parent.children.append(child)
-        
-        p = parent
-        
-        while(p):
-            p.count += child.count
-            p = p.parent
     
     def recurse_children(self, value):
         """
-        Appends value and all of its child values to this facet's values list
-        using depth-first recursion.  Value levels are also calculated for
-        display purposes.
+        Appends value to this facet's values list if it is a root, and walks
+        its children depth-first. Value levels are calculated for display
+        purposes on the way down, the counts of the children are added to
+        value on the way up.
         """
         
         if value.parent is None:
             self.values.append(value)
-        
-        if value.parent:
+        else:
             value.level = value.parent.level + 1
         
         if value.children:
@@ -122,16 +116,24 @@ class Facet(object):
         
         for c in value.children:
             self.recurse_children(c)
+            value.count += c.count
     
     def merge_values(self):
         """
         Merges facet values which appear to be related to each other by
         parent/child relationships, based on the sharing of name prefixes.
-        After merging the facets, depth-first recursion of the resulting
-        tree is used to produce a linear, sorted list of values.
+        
+        Values are indexed by their path so every parent is found in one
+        lookup, the tree is then walked once to roll up the counts. After
+        merging, this facet's values list holds the roots of the tree.
         """
+        self._index = {}
+        for v in self.values:
+            self._index.setdefault(v.value, v)
+        
         values = []
         
+        # Parents created by get_parent are appended, and visited, as well.
         for v in self.values:
             parent = self.get_parent(v)
                     
@@ -163,7 +165,8 @@ class Facet(object):
         self.name = name
         self.values = []
         
-        values.reverse()
+        # Reversed copy, the parsed response is left as it is.
+        values = values[::-1]
         while(values):
             value = values.pop()
             count = values.pop()
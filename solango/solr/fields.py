@@ -6,6 +6,7 @@ import re
 from  datetime import datetime, date
 from time import strptime
 from django.utils.encoding import smart_unicode
+from django.utils import simplejson
 
 from django.conf import settings as django_settings
 from solango import conf
@@ -130,6 +131,31 @@ class Field(object):
                                                    boost_attr, value)
         return xml
 
+    def _create_field_json(self, value=None):
+        """
+        Returns the `"name": value` member of this field for a JSON update
+        document, or an empty string if there is no value.
+        """
+        if value is None:
+            value = self.value
+        
+        if self.multi_valued:
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            values = [v for v in value if v is not None and v != '']
+            if not values:
+                return ''
+            json = u"[%s]" % u", ".join([self.to_json(v) for v in values])
+        elif value is None or value == '':
+            return ''
+        else:
+            json = self.to_json(value)
+        
+        if self.boost:
+            json = u'{"value": %s, "boost": %s}' % (json, self.boost)
+        
+        return u"%s: %s" % (simplejson.dumps(self.get_name()), json)
+    
     def dynamic_name(self):
         return "%s_%s" % (self.name, self.dynamic_suffix)
     
@@ -139,12 +165,19 @@ class Field(object):
         else:
             return self.name
     
-    def transform(self, model):
+    def get_value(self, model):
+        """
+        Returns the value of this field for model without changing the field.
+        Subclasses that override transform should override this instead.
+        """
         try:
-            self.value = getattr(model, self.name)
+            return getattr(model, self.name)
         except AttributeError, e:
             #not all fields like 'text' will have a transform.
-            pass
+            return self.value
+    
+    def transform(self, model):
+        self.value = self.get_value(model)
     
     def _config(self):
         """
@@ -179,6 +212,12 @@ class Field(object):
     def from_python(self, value):
         return unicode(value)
     
+    def to_json(self, value):
+        """
+        Returns value encoded for a JSON update.
+        """
+        return simplejson.dumps(self.from_python(value))
+    
 class DateField(Field):
     dynamic_suffix = "dt"
     type = "date"
@@ -225,6 +264,9 @@ class CharField(Field):
     def from_python(self, value):
         return u'<![CDATA[%s]]>' % value
     
+    def to_json(self, value):
+        return simplejson.dumps(unicode(value))
+    
 class TextField(Field):
     dynamic_suffix = "t"
     type="text"
@@ -232,12 +274,15 @@ class TextField(Field):
     def from_python(self, value):
         return u'<![CDATA[%s]]>' % value
     
+    def to_json(self, value):
+        return simplejson.dumps(unicode(value))
+    
 class SolrTextField(Field):
     dynamic_suffix = "t"
     type="text"
         
-    def transform(self, model):
-        pass
+    def get_value(self, model):
+        return self.value
 
 class IntegerField(Field):
     dynamic_suffix = "i"
@@ -273,14 +318,17 @@ class UrlField(CharField):
     def __init__(self, *args, **kwargs):
         super(UrlField, self).__init__(name='url', *args, **kwargs)
     
-    def transform(self, model):
+    def get_value(self, model):
         """
         If the model has a `get_absolute_url` method use it.
         """
         try:
-            self.value = model.get_absolute_url()
+            return model.get_absolute_url()
         except Exception:
-            self.value = ""
+            return ""
+    
+    def transform(self, model):
+        self.value = self.get_value(model)
         return unicode(self)
 
 class PrimaryKeyField(CharField):
@@ -294,14 +342,16 @@ class PrimaryKeyField(CharField):
     def make_key(self, model_key, pk):
         return "%s%s%s" % (model_key, conf.SEARCH_SEPARATOR, pk)
         
-    def transform(self, instance):
+    def get_value(self, instance):
         """
         Returns a unique identifier string for the specified object.
         
         This avoids duplicate documents
         """
-        self.value = self.make_key(get_instance_key(instance), instance.pk)
-        
+        return self.make_key(get_instance_key(instance), instance.pk)
+    
+    def transform(self, instance):
+        self.value = self.get_value(instance)
         return unicode(self)
     
     def clean(self):
@@ -317,8 +367,11 @@ class SiteField(IntegerField):
         kwargs.update({'required' : True})
         super(SiteField, self).__init__( *args, **kwargs)
 
+    def get_value(self, value_or_model):
+        return django_settings.SITE_ID
+    
     def transform(self, value_or_model):
-        self.value = django_settings.SITE_ID
+        self.value = self.get_value(value_or_model)
         return unicode(self)
 
 class ModelField(CharField):
@@ -329,8 +382,11 @@ class ModelField(CharField):
         kwargs.update({'required' : True})
         super(ModelField, self).__init__(name='id', *args, **kwargs)
 
+    def get_value(self, instance):
+        return get_instance_key(instance)
+    
     def transform(self, instance):
-        self.value = get_instance_key(instance)
+        self.value = self.get_value(instance)
         return unicode(self)
     
     def clean(self):
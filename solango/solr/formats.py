@@ -0,0 +1,123 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Update Formats
+==============
+
+The wire format of update requests. ``SearchWrapper`` builds every update
+body and parses every update response through its format, picked with
+SEARCH_UPDATE_FORMAT or the ``update_format`` of an ``Index``:
+
+* "xml"  - ``<add>``/``<delete>`` XML, understood by every Solr version.
+* "json" - JSON update commands (Solr 3.1 and later), cheaper to build and
+  to parse, and without CDATA escaping.
+
+Documents are rendered to fragments, one per document, that are joined with
+the format's ``separator`` and wrapped with ``add``/``delete``::
+
+    format = get_format("json")
+    body = format.add(format.separator.join([format.add_fragment(doc)
+                                             for doc in docs]))
+"""
+
+from xml.sax.saxutils import escape
+
+from django.utils import simplejson
+
+from solango.solr import results
+
+class XMLFormat(object):
+    name = "xml"
+    content_type = "text/xml; charset=utf-8"
+    separator = u""
+
+    add_prefix = u"\n<add>\n"
+    add_suffix = u"</add>\n"
+
+    commit = u"\n<commit/>\n"
+    soft_commit = u'\n<commit softCommit="true"/>\n'
+    optimize = u"\n<optimize/>\n"
+
+    def url(self, update_url):
+        return update_url
+
+    def add(self, fragments):
+        return self.add_prefix + fragments + self.add_suffix
+
+    def delete(self, fragments):
+        return u"\n<delete>\n" + fragments + u"</delete>\n"
+
+    def delete_by_query(self, query):
+        return u"\n<delete><query>%s</query></delete>\n" % query
+
+    def add_fragment(self, doc, serializer=None):
+        if serializer is not None:
+            return serializer.to_add_xml(doc)
+        return doc.to_add_xml()
+
+    def delete_fragment(self, doc, serializer=None):
+        if serializer is not None:
+            return serializer.to_delete_xml(doc)
+        return doc.to_delete_xml()
+
+    def delete_id(self, pk):
+        """
+        The delete fragment of the document whose id is pk.
+        """
+        return u"<id>%s</id>" % escape(pk)
+
+    def results(self, body):
+        return results.UpdateResults(body)
+
+class JSONFormat(XMLFormat):
+    name = "json"
+    content_type = "application/json; charset=utf-8"
+    separator = u","
+
+    add_prefix = u"{"
+    add_suffix = u"}"
+
+    commit = u'{"commit": {}}'
+    soft_commit = u'{"commit": {"softCommit": true}}'
+    optimize = u'{"optimize": {}}'
+
+    def url(self, update_url):
+        if "?" in update_url:
+            return update_url + "&wt=json"
+        return update_url + "?wt=json"
+
+    def delete(self, fragments):
+        return u"{" + fragments + u"}"
+
+    def delete_by_query(self, query):
+        return u'{"delete": {"query": %s}}' % simplejson.dumps(query)
+
+    def add_fragment(self, doc, serializer=None):
+        if serializer is not None:
+            return serializer.to_add_json(doc)
+        return doc.to_add_json()
+
+    def delete_fragment(self, doc, serializer=None):
+        if serializer is not None:
+            return serializer.to_delete_json(doc)
+        return doc.to_delete_json()
+
+    def delete_id(self, pk):
+        return u'"delete": {"id": %s}' % simplejson.dumps(pk)
+
+    def results(self, body):
+        return results.JSONUpdateResults(body)
+
+FORMATS = {"xml": XMLFormat,
+           "json": JSONFormat}
+
+def get_format(name):
+    """
+    Returns the update format called name.
+    """
+    if name not in FORMATS:
+        raise AttributeError("SEARCH_UPDATE_FORMAT must be one of the "
+                             "following: %s" % ", ".join(FORMATS.keys()))
+    return FORMATS[name]()
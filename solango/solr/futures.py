@@ -0,0 +1,155 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Concurrent Requests
+===================
+
+Runs Solr requests on a shared pool of worker threads so a page can send
+several selects at the same time instead of one after another::
+
+    results, suggestions, sidebar = index.gather_select([
+        Query("django"),
+        Query("djnago", rows=0),
+        {"q": "*:*", "rows": 0, "facet.field": "tag"},
+    ])
+
+    future = index.select_async("django")
+    ...
+    results = future.result()
+
+Requests go over the keep-alive connection pools of solango.solr.pool, so
+concurrent requests to one host reuse at most SEARCH_POOL_SIZE connections.
+The number of threads is SEARCH_ASYNC_WORKERS. Requests submitted from a
+worker thread, like the shard selects of an async select on a sharded
+index, run right away on that thread: waiting for a free worker could
+wait for ever once every worker waits.
+"""
+
+import os
+import sys
+import threading
+import time
+import Queue
+
+from solango import conf
+from solango.log import logger
+
+class Future(object):
+    """
+    The pending outcome of a request. result() waits for it and returns the
+    value, or raises the exception of the request.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def done(self):
+        return self._done.isSet()
+
+    def set_result(self, value):
+        self._value = value
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def result(self, timeout=None):
+        """
+        Waits up to timeout seconds, forever if None. Raises
+        FutureTimeout if the request is still running then.
+        """
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise FutureTimeout("Request still running after %s seconds" %
+                                timeout)
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._value
+
+class FutureTimeout(Exception):
+    pass
+
+class Executor(object):
+    """
+    A fixed number of daemon threads working off a queue.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or conf.SEARCH_ASYNC_WORKERS
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _start(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        self._local.worker = True
+        while True:
+            future, function, args, kwargs = self._queue.get()
+            self._run(future, function, args, kwargs)
+
+    def _run(self, future, function, args, kwargs):
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception:
+            future.set_error(sys.exc_info())
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Schedules function(*args, **kwargs) and returns its Future. On a
+        worker thread it runs before submit returns.
+        """
+        future = Future()
+        if getattr(self._local, "worker", False):
+            self._run(future, function, args, kwargs)
+            return future
+        if len(self._threads) < self.workers:
+            self._start()
+        self._queue.put((future, function, args, kwargs))
+        return future
+
+_executor = None
+_executor_pid = None
+
+def get_executor():
+    """
+    Returns the shared Executor, a new one in a forked child process since
+    threads don't survive a fork.
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = Executor()
+        _executor_pid = os.getpid()
+        logger.debug("Started request executor with %d workers" %
+                     _executor.workers)
+    return _executor
+
+def submit(function, *args, **kwargs):
+    return get_executor().submit(function, *args, **kwargs)
+
+def gather(futures, timeout=None):
+    """
+    Waits for every future and returns their results in order. timeout is
+    the time allowed for all of them together.
+    """
+    if timeout is None:
+        return [future.result() for future in futures]
+
+    deadline = time.time() + timeout
+    return [future.result(max(0, deadline - time.time()))
+            for future in futures]
@@ -0,0 +1,232 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Health Checks
+=============
+
+A background thread pings every ping url of every connection each
+SEARCH_HEALTH_INTERVAL seconds, so no request ever waits for a ping::
+
+    checker = get_checker()
+    checker.watch("http://localhost:8983/solr/admin/ping")
+    checker.is_up("http://localhost:8983/solr/admin/ping")
+
+A ping gives up after SEARCH_HEALTH_TIMEOUT seconds. An endpoint is marked
+down after SEARCH_HEALTH_MAX_FAILURES failed pings in a row and up again
+after the first good one. Reading the state takes no lock, it is a few
+attribute lookups.
+
+Callbacks passed to watch() are called with the endpoint after every ping,
+SearchWrapper uses them to take replicas out of the select rotation.
+"""
+
+import atexit
+import httplib
+import os
+import socket
+import threading
+import time
+import urlparse
+
+from solango import conf
+from solango.log import logger
+
+class Endpoint(object):
+    """
+    ..attribute: up
+
+        False once the endpoint failed max_failures pings in a row. Endpoints
+        are up until they are checked.
+
+    ..attribute: failures
+
+        Failed pings since the last good one.
+
+    ..attribute: changed
+
+        True if the last ping changed up.
+
+    ..attribute: checked, latency, error
+
+        Time, duration and error of the last ping.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.up = True
+        self.failures = 0
+        self.changed = False
+        self.checked = None
+        self.latency = None
+        self.error = None
+        self.callbacks = []
+
+    def stats(self):
+        return {"up": self.up,
+                "failures": self.failures,
+                "checked": self.checked,
+                "latency": self.latency,
+                "error": self.error}
+
+def ping(url, timeout):
+    """
+    GETs url on a connection of its own that gives up after timeout seconds.
+    Returns None if the ping succeeded, the error otherwise.
+    """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+    if query:
+        path = "%s?%s" % (path, query)
+    if scheme == "https":
+        conn = httplib.HTTPSConnection(netloc, timeout=timeout)
+    else:
+        conn = httplib.HTTPConnection(netloc, timeout=timeout)
+    try:
+        try:
+            conn.request("GET", path or "/")
+            response = conn.getresponse()
+            response.read()
+        except (httplib.HTTPException, socket.error), e:
+            return str(e) or e.__class__.__name__
+    finally:
+        conn.close()
+
+    if response.status >= 400:
+        return "HTTP Error %s: %s" % (response.status, response.reason)
+    return None
+
+class HealthChecker(object):
+
+    def __init__(self, interval=None, timeout=None, max_failures=None):
+        self.interval = interval or conf.SEARCH_HEALTH_INTERVAL
+        self.timeout = timeout or conf.SEARCH_HEALTH_TIMEOUT
+        self.max_failures = max_failures or conf.SEARCH_HEALTH_MAX_FAILURES
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, url, callback=None):
+        """
+        Adds url to the checked endpoints and returns its Endpoint.
+        """
+        self._lock.acquire()
+        try:
+            endpoint = self.endpoints.get(url)
+            if endpoint is None:
+                endpoint = Endpoint(url)
+                self.endpoints[url] = endpoint
+            if callback is not None and callback not in endpoint.callbacks:
+                endpoint.callbacks.append(callback)
+            return endpoint
+        finally:
+            self._lock.release()
+
+    def is_up(self, url):
+        endpoint = self.endpoints.get(url)
+        return endpoint is None or endpoint.up
+
+    def start(self):
+        if self._thread is not None and self._thread.isAlive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        logger.debug("Started health checks every %s seconds" % self.interval)
+
+    def stop(self, timeout=None):
+        """
+        Stops the thread, waiting up to timeout seconds for a ping in flight.
+        """
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.isAlive() and \
+                thread is not threading.currentThread():
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.isSet():
+            try:
+                self.check()
+            except Exception, e:
+                logger.exception("Health check failed: %s" % e)
+            self._stop.wait(self.interval)
+
+    def check(self):
+        """
+        Pings every endpoint once.
+        """
+        self._lock.acquire()
+        try:
+            endpoints = self.endpoints.values()
+        finally:
+            self._lock.release()
+
+        for endpoint in endpoints:
+            self.check_endpoint(endpoint)
+
+    def check_endpoint(self, endpoint):
+        """
+        Pings endpoint and updates its state.
+        """
+        started = time.time()
+        error = ping(endpoint.url, self.timeout)
+        endpoint.checked = time.time()
+        endpoint.latency = endpoint.checked - started
+        endpoint.error = error
+
+        endpoint.changed = False
+        if error is None:
+            endpoint.failures = 0
+            if not endpoint.up:
+                logger.info("%s is up again" % endpoint.url)
+                endpoint.changed = True
+            endpoint.up = True
+        else:
+            endpoint.failures += 1
+            if endpoint.up and endpoint.failures >= self.max_failures:
+                logger.warning("%s is down: %s" % (endpoint.url, error))
+                endpoint.up = False
+                endpoint.changed = True
+
+        for callback in list(endpoint.callbacks):
+            try:
+                callback(endpoint)
+            except Exception, e:
+                logger.exception("Health callback failed: %s" % e)
+
+    def stats(self):
+        return dict([(url, endpoint.stats())
+                     for url, endpoint in self.endpoints.items()])
+
+_checker = None
+_checker_pid = None
+
+def get_checker():
+    """
+    Returns the shared HealthChecker, running. A forked child process gets
+    its own, with the endpoints of the parent, since threads don't survive
+    a fork.
+    """
+    global _checker, _checker_pid
+    if _checker is None or _checker_pid != os.getpid():
+        checker = HealthChecker()
+        if _checker is not None:
+            for url, endpoint in _checker.endpoints.items():
+                for callback in endpoint.callbacks:
+                    checker.watch(url, callback)
+                checker.watch(url).up = endpoint.up
+        _checker = checker
+        _checker_pid = os.getpid()
+        _checker.start()
+    return _checker
+
+def _exit():
+    # A daemon thread still waiting when the interpreter tears down its
+    # modules fails with "'NoneType' object is not callable".
+    if _checker is not None and _checker_pid == os.getpid():
+        _checker.stop(_checker.timeout + 1)
+
+atexit.register(_exit)
@@ -0,0 +1,360 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Bulk Indexer
+============
+
+Streams the documents of a queryset into an index::
+
+    from solango.solr.indexer import BulkIndexer
+
+    indexer = BulkIndexer(index, EntryDocument, batch_size=500)
+    indexer.index_queryset(Entry.objects.all())
+    indexer.count, indexer.rate
+
+Documents are rendered with the compiled serializer of the document class,
+see DocumentSerializer. Rows are fetched by primary key ranges
+(``pk > last_pk``) instead of OFFSET, so every batch costs the same no matter
+how deep into the table it is. Each batch is sent as one chunked ``<add>``
+request that is written while the documents are generated. A commit is
+issued at the end of the run, or every ``commit_every`` documents or
+``commit_interval`` seconds if set.
+"""
+
+import sys
+import threading
+import time
+import Queue
+
+from solango import conf
+from solango.log import logger
+
+class BulkIndexer(object):
+    """
+    ..attribute: count
+
+        Number of documents added so far.
+
+    ..attribute: deleted
+
+        Number of instances that were not indexable and got deleted.
+
+    ..attribute: failed
+
+        Number of documents that could not be sent to Solr and were deferred.
+
+    ..attribute: checkpoint
+
+        Optional solango.checkpoint backend. The position and counts of the
+        run are saved under ``key`` after every batch.
+    """
+
+    def __init__(self, index, document, batch_size=None, commit_every=None,
+                 commit_interval=None, report=None, defer=None,
+                 checkpoint=None, key=None):
+        self.index = index
+        self.document = document
+        self.batch_size = batch_size or conf.SOLR_BATCH_INDEX_SIZE
+
+        if commit_every is None:
+            commit_every = conf.SOLR_BATCH_COMMIT_SIZE
+        if commit_interval is None:
+            commit_interval = conf.SOLR_BATCH_COMMIT_INTERVAL
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+
+        self.report = report or logger.info
+        self.defer = defer or index.defer
+
+        # Checkpoint backend and key, plus the primary key range of the run
+        # which is saved with it.
+        self.checkpoint = checkpoint
+        self.key = key
+        self.after = None
+        self.upto = None
+
+        self.count = 0
+        self.deleted = 0
+        self.failed = 0
+        self.last_pk = None
+        self.done = False
+        self.started = None
+
+        self._uncommitted = 0
+        self._committed_at = None
+
+    @property
+    def rate(self):
+        """
+        Documents per second since the run started.
+        """
+        if not self.started:
+            return 0.0
+        elapsed = time.time() - self.started
+        if elapsed <= 0:
+            return 0.0
+        return self.count / elapsed
+
+    def batches(self, queryset):
+        """
+        Yields lists of at most batch_size instances in primary key order.
+
+        Sliced querysets can't be filtered any further, those are read with a
+        single iterator instead.
+        """
+        if not queryset.query.can_filter():
+            batch = []
+            for instance in queryset.iterator():
+                batch.append(instance)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+
+        queryset = queryset.order_by("pk")
+        while True:
+            qs = queryset
+            if self.last_pk is not None:
+                qs = qs.filter(pk__gt=self.last_pk)
+
+            batch = list(qs[:self.batch_size])
+            if not batch:
+                break
+
+            yield batch
+
+            if len(batch) < self.batch_size:
+                break
+
+    def index_queryset(self, queryset, commit=True, resume=False):
+        """
+        Indexes every instance of queryset. With resume, indexing continues
+        after the last batch of the saved checkpoint. Returns self.
+        """
+        self.started = self._committed_at = time.time()
+
+        if not queryset.query.can_filter():
+            self.checkpoint = None
+        if resume and self.checkpoint is not None:
+            state = self.checkpoint.load(self.key)
+            if state:
+                self.restore(state, queryset.model)
+
+        if not self.done:
+            for batch in self.batches(queryset):
+                self.index_batch(batch)
+                self.last_pk = batch[-1].pk
+
+                if self._should_commit():
+                    self.commit()
+
+                self.report("%s: %d documents, %.1f docs/sec" %
+                            (self.document.__name__, self.count, self.rate))
+
+        self.finish(commit)
+        return self
+
+    def finish(self, commit):
+        """
+        Commits the run, or marks its checkpoint as done if the caller
+        commits.
+        """
+        self.done = True
+        if commit:
+            if self._uncommitted:
+                self.commit()
+            if self.checkpoint is not None:
+                self.checkpoint.remove(self.key)
+        elif self.checkpoint is not None:
+            self.save_checkpoint(self.last_pk)
+
+    def restore(self, state, model):
+        """
+        Picks up the position and counts of a checkpoint.
+        """
+        if state["last_pk"] is not None:
+            self.last_pk = model._meta.pk.to_python(state["last_pk"])
+        self.count = state["count"] or 0
+        self.deleted = state["deleted"] or 0
+        self.failed = state["failed"] or 0
+        # A serial run resuming the first part of a parallel run goes on
+        # past the end of that part.
+        self.done = bool(state["done"]) and \
+                        (state["upto"] is None or self.upto is not None)
+
+    def save_checkpoint(self, last_pk):
+        self.checkpoint.save(self.key, {"last_pk": last_pk,
+                                        "after": self.after,
+                                        "upto": self.upto,
+                                        "count": self.count,
+                                        "deleted": self.deleted,
+                                        "failed": self.failed,
+                                        "done": self.done})
+
+    def index_batch(self, instances):
+        """
+        Streams the indexable instances to Solr in one add request and
+        deletes the others.
+        """
+        deletes = []
+        self.send_batch(instances, self._add_fragments(instances, deletes),
+                        deletes)
+
+    def send_batch(self, instances, fragments, deletes):
+        """
+        Sends the add fragments of a batch, then deletes. deletes may be
+        filled in while fragments is consumed.
+        """
+        try:
+            first = fragments.next()
+        except StopIteration:
+            first = None
+
+        if first is not None:
+            results = self.index.connection.stream_add(
+                        self._chain(first, fragments), commit=False)
+
+            if results[0].success:
+                self._uncommitted += len(instances) - len(deletes)
+                self.count += len(instances) - len(deletes)
+            else:
+                self._defer_batch(instances, results[0].error, deletes)
+
+        if deletes:
+            serializer = self.document.get_serializer()
+            format = self.index.connection.format
+            fragments = [(serializer.pk(doc),
+                          format.delete_fragment(doc, serializer))
+                         for doc in deletes]
+            result = self.index.connection.delete(format.separator.join(
+                                    [xml for pk, xml in fragments]),
+                                    commit=False)[0]
+            if not result.success:
+                for pk, xml in fragments:
+                    self.defer("delete", xml, pk, result.error)
+            self.deleted += len(deletes)
+            self._uncommitted += len(deletes)
+
+        if self.checkpoint is not None:
+            self.save_checkpoint(instances[-1].pk)
+
+    def _add_fragments(self, instances, deletes):
+        serializer = self.document.get_serializer()
+        format = self.index.connection.format
+        for instance in instances:
+            doc = serializer.bare(instance)
+            if doc.is_indexable(instance):
+                yield format.add_fragment(doc, serializer)
+            else:
+                deletes.append(doc)
+
+    def _chain(self, first, rest):
+        yield first
+        for fragment in rest:
+            yield fragment
+
+    def _defer_batch(self, instances, error, deletes):
+        """
+        The streamed body is gone once it is sent, so the documents of a
+        failed batch are built again for the deferred backend. A request
+        that failed early didn't read the whole stream, the deletes of the
+        instances past that point are deferred here too.
+        """
+        serializer = self.document.get_serializer()
+        format = self.index.connection.format
+        found = set([serializer.pk(doc) for doc in deletes])
+        for instance in instances:
+            doc = serializer.bare(instance)
+            if doc.is_indexable(instance):
+                self.defer("add", format.add_fragment(doc, serializer),
+                           serializer.pk(doc), error)
+                self.failed += 1
+            elif serializer.pk(doc) not in found:
+                self.defer("delete", format.delete_fragment(doc, serializer),
+                           serializer.pk(doc), error)
+                self.failed += 1
+
+    def _should_commit(self):
+        if not self._uncommitted:
+            return False
+        if self.commit_every and self._uncommitted >= self.commit_every:
+            return True
+        if self.commit_interval and \
+                time.time() - self._committed_at >= self.commit_interval:
+            return True
+        return False
+
+    def commit(self):
+        result = self.index.commit()
+        if not result.success:
+            self.defer("commit", result.xml, error=result.error)
+        self._uncommitted = 0
+        self._committed_at = time.time()
+        return result
+
+class PipelinedBulkIndexer(BulkIndexer):
+    """
+    A BulkIndexer that builds the next batch while the previous one is being
+    sent. Batches are rendered into lists and handed to a sender thread, so at
+    most ``depth`` rendered batches are held in memory at a time.
+    """
+
+    depth = 2
+    _sender = None
+
+    def index_queryset(self, queryset, commit=True, resume=False):
+        self._queue = Queue.Queue(self.depth)
+        self._error = None
+
+        self._sender = threading.Thread(target=self._send_batches)
+        self._sender.setDaemon(True)
+        self._sender.start()
+        try:
+            return super(PipelinedBulkIndexer, self).index_queryset(queryset,
+                                                           commit, resume)
+        finally:
+            self._stop()
+
+    def finish(self, commit):
+        self._stop()
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        super(PipelinedBulkIndexer, self).finish(commit)
+
+    def _stop(self):
+        if self._sender is not None:
+            self._queue.put(None)
+            self._sender.join()
+            self._sender = None
+
+    def index_batch(self, instances):
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+
+        deletes = []
+        fragments = list(self._add_fragments(instances, deletes))
+        self._queue.put((instances, fragments, deletes))
+
+    def _should_commit(self):
+        # The sender thread commits, once the batches before it are sent.
+        return False
+
+    def _send_batches(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error:
+                continue
+
+            instances, fragments, deletes = item
+            try:
+                self.send_batch(instances, iter(fragments), deletes)
+                if BulkIndexer._should_commit(self):
+                    self.commit()
+            except Exception:
+                self._error = sys.exc_info()
@@ -1,7 +1,15 @@
 
+from solango.checkpoint import get_checkpoint, make_key
 from solango.deferred import defer
+from solango.queued import get_queue
+from solango.solr import get_instance_key
+from solango.solr import futures
+from solango.solr.breaker import CIRCUIT_OPEN
+from solango.solr.buffer import WriteBuffer
 from solango.solr.connection import SearchWrapper
+from solango.solr.indexer import BulkIndexer, PipelinedBulkIndexer
 from solango.solr.query import Query
+from solango.exceptions import SolrException
 
 from solango import conf
 
@@ -13,11 +21,14 @@ class Index(object):
     update_url = conf.SEARCH_UPDATE_URL
     select_urls = conf.SEARCH_SELECT_URLS
     ping_urls = conf.SEARCH_PING_URLS
+    update_format = conf.SEARCH_UPDATE_FORMAT
     
     _connection = None
+    _default_query = None
+    _buffer = None
     
     def __init__(self, name=None, update_url=None, 
-                 select_urls=(), ping_urls=()):
+                 select_urls=(), ping_urls=(), update_format=None):
         
         if name is not None:
             self.name = name
@@ -27,36 +38,94 @@ class Index(object):
             self.select_urls = select_urls
         if ping_urls:
             self.ping_urls = ping_urls
+        if update_format:
+            self.update_format = update_format
     
     def get_document(self, instance):
         from solango import documents
         return documents.get_document(instance)
     
+    def index_for(self, doc_pk):
+        """
+        The index that stores the document of doc_pk, see ShardedIndex.
+        """
+        return self
+    
+    def bulk_indexer(self, document, batch_size=None, pipelined=False,
+                     **kwargs):
+        """
+        Returns the BulkIndexer for reindexing document into this index,
+        a PipelinedBulkIndexer if pipelined.
+        """
+        if pipelined:
+            return PipelinedBulkIndexer(self, document, batch_size, **kwargs)
+        return BulkIndexer(self, document, batch_size, **kwargs)
+    
     @property
     def connection(self):
         """Lazy Init a Collection """
         if self._connection is None:
             self._connection = SearchWrapper(self.update_url, 
                                              self.select_urls,
-                                             self.ping_urls)
+                                             self.ping_urls,
+                                             self.update_format)
         return self._connection
     
+    @property
+    def buffer(self):
+        """The WriteBuffer of the post_save and post_delete signals"""
+        if self._buffer is None:
+            self._buffer = WriteBuffer(self)
+        return self._buffer
+    
+    def flush(self, wait=False):
+        """
+        Sends the buffered writes of this thread, see solango.solr.buffer.
+        """
+        if self._buffer is None:
+            return None
+        return self._buffer.flush(wait)
+    
+    def default_query(self):
+        """
+        The query every query of this index starts from, built once from the
+        facet, highlighting and sort settings. Don't change it, derive from it.
+        """
+        if self._default_query is None:
+            self._default_query = Query(list(conf.SEARCH_FACET_PARAMS) + 
+                                        list(conf.SEARCH_HL_PARAMS),
+                                        sort=conf.SEARCH_SORT_PARAMS.keys())
+        return self._default_query
+    
     def query(self, initial=None, **kwargs):
         """
         Creates a default query.
         """
-        default_initial = conf.SEARCH_FACET_PARAMS
-        default_initial.extend(conf.SEARCH_HL_PARAMS)
-        default = Query(default_initial , sort=conf.SEARCH_SORT_PARAMS.keys())
-        
-        query = Query(initial, **kwargs)
-        
-        default.merge(query)
-        
-        return default
+        return self.default_query().derive(initial, **kwargs)
             
     def ping(self):
+        return self.connection.ping()
+    
+    def is_available(self):
         return self.connection.is_available()
+    
+    def health_stats(self):
+        return self.connection.health_stats()
+    
+    def pool_stats(self):
+        return self.connection.pool_stats()
+    
+    def cache_stats(self):
+        return self.connection.cache_stats()
+    
+    def replica_stats(self):
+        return self.connection.replica_stats()
+    
+    def breaker_stats(self):
+        return self.connection.breaker_stats()
+    
+    def commit_stats(self):
+        return self.connection.commit_stats()
 
     def optimize(self):
         return self.connection.optimize()
@@ -64,11 +133,23 @@ class Index(object):
     def commit(self):
         return self.connection.commit()
     
-    def add(self, doc, commit=True):
-        return self.connection.add(doc.to_add_xml(), commit)
+    def add(self, doc, commit=True, deadline=None):
+        """
+        Adds doc, within deadline seconds if given. While the circuit breaker
+        is open the add goes to the deferred backend.
+        """
+        xml = self.connection.format.add_fragment(doc)
+        results = self.connection.add(xml, commit, deadline)
+        if results[0].error == CIRCUIT_OPEN:
+            self.defer("add", xml, doc.pk_field.value, CIRCUIT_OPEN)
+        return results
     
-    def delete(self, doc, commit=True):
-        return self.connection.delete(doc.to_delete_xml(), commit)
+    def delete(self, doc, commit=True, deadline=None):
+        xml = self.connection.format.delete_fragment(doc)
+        results = self.connection.delete(xml, commit, deadline)
+        if results[0].error == CIRCUIT_OPEN:
+            self.defer("delete", xml, doc.pk_field.value, CIRCUIT_OPEN)
+        return results
     
     def delete_all(self, commit=True):
         return self.connection.delete_all(commit)
@@ -76,83 +157,134 @@ class Index(object):
     def delete_by_query(self, query, commit=True):
         return self.connection.delete_by_query(query, commit)
 
-    def select(self, initial=None, **kwargs):
+    def select(self, initial=None, cache=True, cache_ttl=None, deadline=None,
+               **kwargs):
         if isinstance(initial, Query):
             query= initial
         else:
             query = self.query(initial, **kwargs)
-        return self.connection.select(query)
+        return self.connection.select(query, cache, cache_ttl, deadline)
     
+    def select_async(self, initial=None, cache=True, cache_ttl=None,
+                     deadline=None, **kwargs):
+        """
+        Like select, but sent on a worker thread. Returns a Future whose
+        result() are the SelectResults, see solango.solr.futures.
+        """
+        return futures.submit(self.select, initial, cache, cache_ttl,
+                              deadline, **kwargs)
     
-    def reindex(self, model, doc, batch_size=50):
-        start = 0
-        stop = batch_size
-        xml = ""
-        count = model._default_manager.count()
-        while(1):
-            if stop >= count:
-                break
-            print model, start, stop
-            qs = model._default_manager.all()[start:stop]
-            for i in qs:
-                d = doc(i)
-                if d.is_indexable(i):
-                    xml += d.to_add_xml()
-                else:
-                    #Add will commit.
-                    self.delete(d, False)
-
-            if xml:
-                results = self.connection.add(xml)
-
-                for result in results:
-                    if not result.success:
-                        self.defer("add", result.xml, error=result.error)
-
-            xml = ""
-
-            start = stop + 1
-            stop = start + batch_size
-
-    def reindex_qs(self, queryset, batch_size=50, commit=True):
-        start = 0
-        stop = batch_size
-        xml = ""
-        count = queryset.count()
-        doc = self.get_document(queryset[0]).__class__
-        while(1):
-            if stop>= count:
-                break
+    def gather_select(self, queries, timeout=None):
+        """
+        Sends a select for every query at the same time and returns the
+        results in the same order. A query is a Query instance, a
+        dictionary or a list of parameters, or a q string.
+        """
+        return futures.gather([self.select_async(query) for query in queries],
+                              timeout)
+    
+    def add_async(self, doc, commit=True, deadline=None):
+        return futures.submit(self.add, doc, commit, deadline)
+    
+    def delete_async(self, doc, commit=True, deadline=None):
+        return futures.submit(self.delete, doc, commit, deadline)
+    
+    def commit_async(self):
+        return futures.submit(self.commit)
+    
+    def iter_select(self, initial=None, batch_size=None, key="id", **kwargs):
+        """
+        Yields the raw document dictionary of every match of the query, in
+        order of the unique key field `key`.
+        
+        Instead of paging with a growing `start`, which costs Solr more the
+        deeper it goes, every batch asks for the first batch_size documents
+        whose key is greater than the last key of the previous batch. Only one
+        batch is held in memory at a time. The query is not merged with the
+        default query of the index, and is not cached.
+        """
+        if isinstance(initial, Query):
+            base = initial.clone()
+        else:
+            base = Query(initial, **kwargs)
+        batch_size = batch_size or conf.SOLR_BATCH_INDEX_SIZE
+        base.sort = ["%s asc" % key]
+        base.rows = batch_size
+        base.start = None
+        
+        last = None
+        while True:
+            page = base
+            if last is not None:
+                page = base.clone()
+                page.fq.add(u'%s:{"%s" TO *}' % 
+                            (key, last.replace("\\", "\\\\").replace('"', '\\"')))
             
-            qs = queryset[start:stop]
-            for i in qs:
-                d = doc(i)
-                if d.is_indexable(i):
-                    xml += d.to_add_xml()
-                else:
-                    #Add will commit.
-                    self.delete(d, False)
+            results = self.connection.select(page, cache=False)
+            if not results.success:
+                raise SolrException(results.error)
             
-            if xml:
-                results = self.connection.add(xml, commit)
-                
-                for result in results:
-                    if not result.success:
-                        self.defer("add", result.xml, error=result.error)
-
-            xml = ""
+            docs = results.documents.raw
+            for doc in docs:
+                yield doc
             
-            start = stop + 1
-            stop = start + batch_size
-        
+            if len(docs) < batch_size:
+                break
+            last = docs[-1][key]
+    
+    
+    def reindex(self, model, doc, batch_size=50, report=None, resume=False):
+        """
+        Streams every instance of model into the index, see BulkIndexer.
+        With resume the run continues from the last saved checkpoint.
+        """
+        document_key = get_instance_key(model)
+        checkpoint = get_checkpoint()
         
+        indexer = self.bulk_indexer(doc, batch_size, report=report,
+                                    checkpoint=checkpoint,
+                                    key=make_key(document_key, 0))
+        indexer.index_queryset(model._default_manager.all(), resume=resume)
         
+        if checkpoint is not None:
+            # Drops what is left of an earlier parallel run.
+            checkpoint.clear(make_key(document_key))
+        return indexer
+
+    def reindex_qs(self, queryset, batch_size=50, commit=True, report=None):
+        from solango import documents
+        doc = documents[get_instance_key(queryset.model)]
+        indexer = self.bulk_indexer(doc, batch_size, report=report)
+        return indexer.index_queryset(queryset, commit)
+
+    def enqueue(self, method, instance):
+        """
+        Queues the add or delete of instance for the worker, see
+        solango.queued.
+        """
+        from solango import documents
+        key = get_instance_key(instance)
+        serializer = documents[key].get_serializer()
+        get_queue().put(method, key, instance.pk,
+                        serializer.pk(serializer.bare(instance)))
 
     def post_save(self, sender, instance, **kwargs):
+        if conf.SEARCH_QUEUE_BACKEND:
+            self.enqueue("add", instance)
+            return
+        if conf.SEARCH_BUFFER_WRITES:
+            self.buffer.add(instance)
+            return
         doc = self.get_document(instance)
         self.add(doc)
     
     def post_delete(self, sender, instance, **kwargs):
+        if conf.SEARCH_QUEUE_BACKEND:
+            self.enqueue("delete", instance)
+            return
+        if conf.SEARCH_BUFFER_WRITES:
+            self.buffer.delete(instance)
+            return
         doc = self.get_document(instance)
         self.delete(doc)
 
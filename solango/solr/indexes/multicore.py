@@ -1,6 +1,183 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
 
+"""
+Multicore Index
+===============
 
-from solr.indexes.base import Index
+Keeps every document type in a Solr core of its own, so a large, busy type
+doesn't share caches and commits with the others::
 
-def MultiCoreIndex(Index):
-    pass
\ No newline at end of file
+    from solango.solr.indexes.multicore import MulticoreIndex
+
+    index = MulticoreIndex()
+    solango.register(Entry, EntryDocument, index)
+    solango.register(Comment, CommentDocument, index)
+
+The core of a document key is given by SEARCH_CORES, a dictionary of
+document keys to core names or to dictionaries of Index arguments::
+
+    SEARCH_CORES = {"blog__comment": "comments",
+                    "blog__entry": {"update_url": "http://solr2:8983/solr/entries/update",
+                                    "select_urls": ["http://solr2:8983/solr/entries/select"]}}
+
+Other document keys get a core named like the key. The urls of a core name
+are SEARCH_CORE_URL with the name filled in, followed by /update, /select and
+/admin/ping.
+
+Every core has its own query cache, so writes to one core don't invalidate
+the cached selects of the others, and is committed on its own. A core only
+needs the fields of its documents, see schema_xml().
+
+Selects go to the core of the documents given with ``document_key`` or
+``document_keys``. Without them the query is sent to every core and the
+results are merged, see ShardedIndex.gather. Scores are not comparable
+across cores, so cross core searches should sort by a field.
+"""
+
+import threading
+
+from solango import conf
+from solango.solr.indexes.base import Index
+from solango.solr.indexes.sharded import ShardedIndex
+from solango.solr.query import Query
+
+class MulticoreIndex(ShardedIndex):
+    """
+    ..attribute: cores
+
+        The core of every document key, see SEARCH_CORES.
+    """
+    name = "multicore_index"
+    cores = None
+    core_url = conf.SEARCH_CORE_URL
+
+    def __init__(self, name=None, cores=None, core_url=None):
+        if name is not None:
+            self.name = name
+        if core_url:
+            self.core_url = core_url
+        if cores is None:
+            cores = self.cores
+        if cores is None:
+            cores = conf.SEARCH_CORES
+        self.cores = dict(cores)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _core_index(self, name, core):
+        if isinstance(core, Index):
+            return core
+        if isinstance(core, dict):
+            kwargs = dict([(str(key), value) for key, value in core.items()])
+            kwargs.setdefault("name", "%s_%s" % (self.name, name))
+            return Index(**kwargs)
+
+        url = self.core_url.rstrip("/") % core
+        return Index("%s_%s" % (self.name, core), update_url=url + "/update",
+                     select_urls=[url + "/select"],
+                     ping_urls=[url + "/admin/ping"])
+
+    def core(self, document_key):
+        """
+        Returns the Index of the core of document_key.
+        """
+        name = self.core_name(document_key)
+        index = self._indexes.get(name)
+        if index is None:
+            self._lock.acquire()
+            try:
+                index = self._indexes.get(name)
+                if index is None:
+                    index = self._core_index(name,
+                                    self.cores.get(document_key, document_key))
+                    self._indexes[name] = index
+            finally:
+                self._lock.release()
+        return index
+
+    def document_keys(self):
+        """
+        The keys of SEARCH_CORES and of the documents registered with this
+        index.
+        """
+        from solango import documents
+        keys = set(self.cores.keys())
+        for key, document in documents.items():
+            if document.index is self:
+                keys.add(key)
+        return sorted(keys)
+
+    @property
+    def shards(self):
+        indexes = []
+        for key in self.document_keys():
+            index = self.core(key)
+            if index not in indexes:
+                indexes.append(index)
+        return indexes
+
+    def index_for(self, doc_pk):
+        return self.core(doc_pk.rsplit(conf.SEARCH_SEPARATOR, 1)[0])
+
+    def shard_for(self, instance):
+        from solango.solr import get_instance_key
+        return self.core(get_instance_key(instance))
+
+    def commit(self, document_key=None):
+        """
+        Commits the core of document_key, or every core.
+        """
+        if document_key is not None:
+            return self.core(document_key).commit()
+        return super(MulticoreIndex, self).commit()
+
+    def core_name(self, document_key):
+        """
+        The name of the core of document_key, the document key itself for
+        cores given by their arguments.
+        """
+        core = self.cores.get(document_key, document_key)
+        if isinstance(core, basestring):
+            return core
+        return document_key
+
+    def schema_xml(self, document_key):
+        """
+        The schema.xml of the core of document_key, holding the fields of
+        the documents stored in it.
+        """
+        from solango.utils import create_schema_xml
+        name = self.core_name(document_key)
+        return create_schema_xml(document_keys=[key for key in
+                                                self.document_keys()
+                                                if self.core_name(key) == name])
+
+    def schemas(self):
+        """
+        Returns the schema.xml of every core by core name.
+        """
+        return dict([(self.core_name(key), self.schema_xml(key))
+                     for key in self.document_keys()])
+
+    def select(self, initial=None, cache=True, cache_ttl=None, deadline=None,
+               document_key=None, document_keys=None, **kwargs):
+        if isinstance(initial, Query):
+            query = initial
+        else:
+            query = self.query(initial, **kwargs)
+
+        if document_key is not None:
+            document_keys = [document_key]
+        if document_keys is None:
+            return self.gather(query, cache, cache_ttl, deadline)
+
+        cores = []
+        for key in document_keys:
+            if self.core(key) not in cores:
+                cores.append(self.core(key))
+        if len(cores) == 1:
+            return cores[0].connection.select(query, cache, cache_ttl,
+                                              deadline)
+        return self.gather(query, cache, cache_ttl, deadline, cores)
@@ -0,0 +1,480 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Sharded Index
+=============
+
+Spreads the documents of an index over several Solr cores or instances,
+the shards::
+
+    from solango.solr.indexes.sharded import ShardedIndex
+
+    index = ShardedIndex("entries", shards=[
+        {"update_url": "http://solr1:8983/solr/update",
+         "select_urls": ["http://solr1:8983/solr/select"],
+         "ping_urls": ["http://solr1:8983/solr/admin/ping"]},
+        {"update_url": "http://solr2:8983/solr/update",
+         "select_urls": ["http://solr2:8983/solr/select"],
+         "ping_urls": ["http://solr2:8983/solr/admin/ping"]},
+    ])
+    solango.register(Entry, EntryDocument, index)
+
+A shard is an Index or a dictionary of Index arguments, SEARCH_SHARDS by
+default. Every shard has to use the same schema and update format.
+
+Every document is stored on one shard, picked by consistent hashing of its
+PrimaryKeyField value: a shard owns SEARCH_SHARD_VNODES points on a ring of
+md5 hashes, and a document goes to the shard of the first point after the
+hash of its key. Adding a shard only moves the documents it takes over.
+
+Selects are sent in one of two ways, SEARCH_SHARD_QUERY:
+
+* "shards" - to the first shard with Solr's ``shards`` parameter listing
+  every shard, Solr runs the distributed search.
+* "gather" - to every shard at the same time. The documents are merged by
+  the sort of the query, the score by default, and the counts and facet
+  counts are added up. Facet counts of values a shard cut off by its
+  facet.limit are missing from the sum.
+
+Reindexing renders every batch once and sends the documents of each shard
+in a request of its own, all at the same time.
+"""
+
+import bisect
+import time
+
+from django.utils.hashcompat import md5_constructor
+
+from solango import conf
+from solango.solr import futures, get_instance_key
+from solango.solr.indexer import PipelinedBulkIndexer
+from solango.solr.indexes.base import Index
+from solango.solr.query import Query
+from solango.solr.results import SelectResults
+
+QUERY_MODES = ("shards", "gather")
+
+def _hash(key):
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    return long(md5_constructor(key).hexdigest()[:16], 16)
+
+class HashRing(object):
+    """
+    Consistent hashing of keys onto nodes, with vnodes points per node.
+    """
+
+    def __init__(self, nodes, vnodes=None):
+        self.vnodes = vnodes or conf.SEARCH_SHARD_VNODES
+        points = []
+        for node in nodes:
+            for i in range(self.vnodes):
+                points.append((_hash("%s-%d" % (node, i)), node))
+        points.sort()
+        self._hashes = [h for h, node in points]
+        self._nodes = [node for h, node in points]
+
+    def get(self, key):
+        i = bisect.bisect(self._hashes, _hash(key))
+        if i == len(self._hashes):
+            i = 0
+        return self._nodes[i]
+
+def _worst(results):
+    """
+    The first failed of results, the first one if all succeeded.
+    """
+    for result in results:
+        if not result.success:
+            return result
+    return results[0]
+
+def _sort_key(field):
+    return lambda doc: doc.get(field)
+
+def merge_results(url, results, start, rows, sort):
+    """
+    Merges the SelectResults of every shard into one. The documents are
+    sorted by sort, a list of (field, descending) pairs, and cut to the
+    rows from start. Counts and facet counts are added up.
+    """
+    jsons = [r._json for r in results]
+
+    docs = []
+    for json in jsons:
+        docs.extend(json["response"]["docs"])
+    # Stable sorts, least significant field first.
+    for field, descending in reversed(sort):
+        docs.sort(key=_sort_key(field), reverse=descending)
+
+    header = dict(jsons[0]["responseHeader"])
+    params = dict(header.get("params") or {})
+    params["start"] = str(start)
+    params["rows"] = str(rows)
+    header["params"] = params
+    header["QTime"] = max([json["responseHeader"].get("QTime") or 0
+                           for json in jsons])
+    if [json for json in jsons
+            if json["responseHeader"].get("partialResults")]:
+        header["partialResults"] = True
+
+    merged = {"responseHeader": header,
+              "response": {"numFound": sum([json["response"]["numFound"]
+                                            for json in jsons]),
+                           "start": start,
+                           "docs": docs[start:start + rows]}}
+
+    facets = [json["facet_counts"] for json in jsons
+              if json.get("facet_counts")]
+    if facets:
+        merged["facet_counts"] = _merge_facets(facets,
+                                    params.get("facet.sort") in
+                                    ("index", "lex", "false"))
+
+    highlighting = {}
+    for json in jsons:
+        highlighting.update(json.get("highlighting") or {})
+    if highlighting:
+        merged["highlighting"] = highlighting
+
+    return SelectResults(url, merged)
+
+def _merge_facets(facets, by_value):
+    merged = {}
+
+    fields = {}
+    for facet in facets:
+        for name, values in (facet.get("facet_fields") or {}).items():
+            counts = fields.setdefault(name, {})
+            for i in range(0, len(values), 2):
+                counts[values[i]] = counts.get(values[i], 0) + values[i + 1]
+    if fields:
+        merged["facet_fields"] = {}
+        for name, counts in fields.items():
+            if by_value:
+                items = sorted(counts.items())
+            else:
+                items = sorted(counts.items(), key=lambda i: (-i[1], i[0]))
+            merged["facet_fields"][name] = [x for item in items for x in item]
+
+    queries = {}
+    for facet in facets:
+        for key, count in (facet.get("facet_queries") or {}).items():
+            queries[key] = queries.get(key, 0) + count
+    if queries:
+        merged["facet_queries"] = queries
+
+    for kind in ("facet_dates", "facet_ranges"):
+        ranges = {}
+        for facet in facets:
+            for name, counts in (facet.get(kind) or {}).items():
+                total = ranges.setdefault(name, {})
+                for key, value in counts.items():
+                    if isinstance(value, (int, long)) and \
+                            not isinstance(value, bool):
+                        total[key] = total.get(key, 0) + value
+                    else:
+                        total.setdefault(key, value)
+        if ranges:
+            merged[kind] = ranges
+
+    return merged
+
+class ShardedIndex(Index):
+    """
+    An index whose documents are spread over shards, see above.
+
+    ..attribute: shards
+
+        The Index of every shard.
+
+    ..attribute: query_mode
+
+        "shards" or "gather".
+    """
+    name = "sharded_index"
+    shards = ()
+    query_mode = conf.SEARCH_SHARD_QUERY
+
+    def __init__(self, name=None, shards=None, query_mode=None, vnodes=None):
+        if name is not None:
+            self.name = name
+        shards = shards or self.shards or conf.SEARCH_SHARDS
+        if not shards:
+            raise AttributeError("A ShardedIndex needs shards, see "
+                                 "SEARCH_SHARDS")
+        self.shards = [self._shard(i, shard) for i, shard in enumerate(shards)]
+        if query_mode is not None:
+            self.query_mode = query_mode
+        if self.query_mode not in QUERY_MODES:
+            raise AttributeError("SEARCH_SHARD_QUERY must be one of the "
+                                 "following: %s" % ", ".join(QUERY_MODES))
+
+        self._by_name = dict([(shard.name, shard) for shard in self.shards])
+        if len(self._by_name) != len(self.shards):
+            raise AttributeError("Every shard needs a name of its own")
+        self.ring = HashRing([shard.name for shard in self.shards], vnodes)
+
+    def _shard(self, i, shard):
+        if isinstance(shard, Index):
+            return shard
+        kwargs = dict([(str(key), value) for key, value in shard.items()])
+        kwargs.setdefault("name", "%s_%d" % (self.name, i))
+        return Index(**kwargs)
+
+    @property
+    def update_url(self):
+        return tuple([shard.update_url for shard in self.shards])
+
+    @property
+    def connection(self):
+        """
+        The connection of the first shard, which answers the selects of the
+        "shards" query mode.
+        """
+        return self.shards[0].connection
+
+    def index_for(self, doc_pk):
+        return self._by_name[self.ring.get(doc_pk)]
+
+    def shard_for(self, instance):
+        from solango import documents
+        serializer = documents[get_instance_key(instance)].get_serializer()
+        return self.index_for(serializer.pk(serializer.bare(instance)))
+
+    def shards_param(self):
+        """
+        The value of Solr's shards parameter, the select url of every shard
+        without the scheme and the handler.
+        """
+        shards = []
+        for shard in self.shards:
+            url = shard.connection.select_url.split("://", 1)[-1]
+            shards.append(url.rsplit("/", 1)[0])
+        return ",".join(shards)
+
+    def _gather(self, method, *args):
+        """
+        Calls method on every shard at the same time and returns the
+        results in the order of the shards.
+        """
+        return futures.gather([futures.submit(getattr(shard, method), *args)
+                               for shard in self.shards])
+
+    #### Writes go to the shard of the document
+
+    def add(self, doc, commit=True, deadline=None):
+        return self.index_for(doc.pk_field.value).add(doc, commit, deadline)
+
+    def delete(self, doc, commit=True, deadline=None):
+        return self.index_for(doc.pk_field.value).delete(doc, commit,
+                                                         deadline)
+
+    def post_save(self, sender, instance, **kwargs):
+        self.shard_for(instance).post_save(sender, instance, **kwargs)
+
+    def post_delete(self, sender, instance, **kwargs):
+        self.shard_for(instance).post_delete(sender, instance, **kwargs)
+
+    def flush(self, wait=False):
+        return [shard.flush(wait) for shard in self.shards]
+
+    def commit(self):
+        return _worst(self._gather("commit"))
+
+    def optimize(self):
+        return _worst(self._gather("optimize"))
+
+    def delete_all(self, commit=True):
+        return [result for results in self._gather("delete_all", commit)
+                for result in results]
+
+    def delete_by_query(self, query, commit=True):
+        return [result for results in
+                self._gather("delete_by_query", query, commit)
+                for result in results]
+
+    def bulk_indexer(self, document, batch_size=None, pipelined=False,
+                     **kwargs):
+        return ShardedBulkIndexer(self, document, batch_size, **kwargs)
+
+    #### Selects
+
+    def select(self, initial=None, cache=True, cache_ttl=None, deadline=None,
+               **kwargs):
+        if isinstance(initial, Query):
+            query = initial
+        else:
+            query = self.query(initial, **kwargs)
+
+        if self.query_mode == "shards":
+            query = query.clone()
+            query.shards = self.shards_param()
+            return self.connection.select(query, cache, cache_ttl, deadline)
+        return self.gather(query, cache, cache_ttl, deadline)
+
+    def gather(self, query, cache=True, cache_ttl=None, deadline=None,
+               shards=None):
+        """
+        Sends query to every shard, or to the given shards, and merges the
+        results.
+        """
+        shards = shards or self.shards
+        start = int(query.data["start"].data or 0)
+        rows = query.data["rows"].data
+        if rows is None:
+            rows = 10
+        rows = int(rows)
+
+        sort = []
+        for spec in sorted(query.data["sort"].data):
+            for clause in spec.split(","):
+                parts = clause.split()
+                if parts:
+                    sort.append((parts[0], parts[-1].lower() == "desc"))
+        if not sort:
+            sort = [("score", True)]
+
+        # Every shard returns its first start + rows documents.
+        shard_query = query.clone()
+        shard_query.start = 0
+        shard_query.rows = start + rows
+        if "score" in [field for field, descending in sort]:
+            if not shard_query.data["fl"].data:
+                shard_query.fl.add("*")
+            shard_query.fl.add("score")
+
+        results = futures.gather([shard.connection.select_async(
+                                      shard_query, cache, cache_ttl, deadline)
+                                  for shard in shards])
+        for result in results:
+            if not result.success:
+                return result
+        return merge_results(results[0].url, results, start, rows, sort)
+
+    def iter_select(self, initial=None, batch_size=None, key="id", **kwargs):
+        """
+        Yields the documents of every shard in turn, each in key order.
+        """
+        for shard in self.shards:
+            for doc in shard.iter_select(initial, batch_size, key, **kwargs):
+                yield doc
+
+    #### Health and stats, by shard
+
+    def ping(self):
+        return not [ok for ok in self._gather("ping") if not ok]
+
+    def is_available(self):
+        for shard in self.shards:
+            if not shard.is_available():
+                return False
+        return True
+
+    def _stats(self, method):
+        return dict([(shard.name, getattr(shard, method)())
+                     for shard in self.shards])
+
+    def health_stats(self):
+        return self._stats("health_stats")
+
+    def pool_stats(self):
+        return self._stats("pool_stats")
+
+    def cache_stats(self):
+        return self._stats("cache_stats")
+
+    def replica_stats(self):
+        return self._stats("replica_stats")
+
+    def breaker_stats(self):
+        return self._stats("breaker_stats")
+
+    def commit_stats(self):
+        return self._stats("commit_stats")
+
+class ShardedBulkIndexer(PipelinedBulkIndexer):
+    """
+    Renders every batch once, then sends the documents of each shard to it,
+    all shards at the same time. Only the shards that got documents are
+    committed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ShardedBulkIndexer, self).__init__(*args, **kwargs)
+        self._written = set()
+
+    def _add_fragments(self, instances, deletes):
+        serializer = self.document.get_serializer()
+        format = self.index.connection.format
+        for instance in instances:
+            doc = serializer.bare(instance)
+            if doc.is_indexable(instance):
+                pk = serializer.pk(doc)
+                yield pk, format.add_fragment(doc, serializer)
+            else:
+                deletes.append(doc)
+
+    def send_batch(self, instances, fragments, deletes):
+        serializer = self.document.get_serializer()
+        format = self.index.connection.format
+
+        batches = {}
+        for pk, xml in fragments:
+            shard = self.index.index_for(pk)
+            batches.setdefault(shard, ([], []))[0].append((pk, xml))
+        for doc in deletes:
+            pk = serializer.pk(doc)
+            batches.setdefault(self.index.index_for(pk), ([], []))[1].append(
+                                (pk, format.delete_fragment(doc, serializer)))
+
+        self._written.update(batches.keys())
+        sent = futures.gather([futures.submit(self._send_shard, shard,
+                                              adds, shard_deletes)
+                               for shard, (adds, shard_deletes) in
+                               batches.items()])
+
+        for (adds, shard_deletes), (added, deleted) in zip(batches.values(),
+                                                           sent):
+            if added is not None:
+                if added.success:
+                    self.count += len(adds)
+                    self._uncommitted += len(adds)
+                else:
+                    for pk, xml in adds:
+                        self.defer("add", xml, pk, added.error)
+                    self.failed += len(adds)
+            if deleted is not None:
+                if not deleted.success:
+                    for pk, xml in shard_deletes:
+                        self.defer("delete", xml, pk, deleted.error)
+                self.deleted += len(shard_deletes)
+                self._uncommitted += len(shard_deletes)
+
+        if self.checkpoint is not None:
+            self.save_checkpoint(instances[-1].pk)
+
+    def _send_shard(self, shard, adds, deletes):
+        connection = shard.connection
+        added = deleted = None
+        if adds:
+            added = connection.stream_add(iter([xml for pk, xml in adds]),
+                                          commit=False)[0]
+        if deletes:
+            deleted = connection.delete(connection.format.separator.join(
+                                            [xml for pk, xml in deletes]),
+                                        commit=False)[0]
+        return added, deleted
+
+    def commit(self):
+        results = futures.gather([futures.submit(shard.commit)
+                                  for shard in self._written])
+        for result in results:
+            if not result.success:
+                self.defer("commit", result.xml, error=result.error)
+        self._written = set()
+        self._uncommitted = 0
+        self._committed_at = time.time()
+        return results and _worst(results) or None
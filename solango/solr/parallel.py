@@ -0,0 +1,285 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Parallel Reindex
+================
+
+Reindexes querysets with a pool of worker processes::
+
+    from solango.solr.parallel import ParallelReindexer
+
+    reindexer = ParallelReindexer(workers=4, batch_size=500)
+    reindexer.run([Entry.objects.all(), Comment.objects.all()])
+    reindexer.count, reindexer.errors
+
+Every queryset is split into primary key ranges of about the same size. Each
+worker process opens its own database connection, reindexes one range at a
+time with the pipelined bulk indexer of its index and never commits. The
+operations that have to be deferred are sent to the parent as soon as they
+fail, over a queue that a thread of the parent writes to the deferred
+backend, so a worker holds none of them. Counts and errors are sent back once
+a range is done, and the parent issues one commit per index once every range
+is.
+
+Every range saves its own checkpoint. ``run(querysets, resume=True)`` reuses
+the ranges of the interrupted run and continues each one from its checkpoint.
+"""
+
+import threading
+import time
+import traceback
+
+from solango import conf
+from solango.checkpoint import get_checkpoint, make_key
+from solango.log import logger
+from solango.solr import get_instance_key
+
+def partition(queryset, partitions):
+    """
+    Splits queryset into at most `partitions` primary key ranges holding about
+    the same number of rows. Returns a list of (after, upto) tuples meaning
+    ``after < pk <= upto``, where None is unbounded.
+    """
+    count = queryset.count()
+    partitions = max(1, min(partitions, count))
+
+    pks = queryset.order_by("pk").values_list("pk", flat=True)
+
+    bounds = [None]
+    for i in range(1, partitions):
+        bounds.append(pks[count * i / partitions - 1])
+    bounds.append(None)
+
+    return zip(bounds[:-1], bounds[1:])
+
+def filter_range(queryset, after, upto):
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    if upto is not None:
+        queryset = queryset.filter(pk__lte=upto)
+    return queryset
+
+def reindex_range(task):
+    """
+    Runs in a worker process. Reindexes one primary key range without
+    committing and returns the outcome as a dictionary.
+
+    The task holds the sql query of the queryset, not the queryset, which
+    would be evaluated to be pickled.
+    """
+    (document_key, query, after, upto, batch_size, key, resume) = task
+
+    import solango
+    from django.db.models.query import QuerySet
+
+    if not solango.documents:
+        solango.autodiscover()
+
+    document = solango.documents[document_key]
+    def defer(method, xml, doc_pk=None, error=None):
+        if _deferred is None:
+            document.index.defer(method, xml, doc_pk, error)
+        else:
+            _deferred.put((document_key, method, xml, doc_pk, error))
+
+    outcome = {"document_key": document_key, "after": after, "upto": upto,
+               "count": 0, "deleted": 0, "failed": 0, "error": None}
+
+    queryset = QuerySet(model=query.model, query=query)
+    indexer = document.index.bulk_indexer(document, batch_size,
+                                          pipelined=True, commit_every=0,
+                                          commit_interval=0,
+                                          report=logger.debug, defer=defer,
+                                          checkpoint=get_checkpoint(), key=key)
+    (indexer.after, indexer.upto) = (after, upto)
+
+    # Checkpoints may hold the range as strings.
+    to_python = queryset.model._meta.pk.to_python
+    if after is not None:
+        after = to_python(after)
+    if upto is not None:
+        upto = to_python(upto)
+    try:
+        indexer.index_queryset(filter_range(queryset, after, upto), False,
+                               resume)
+    except Exception:
+        outcome["error"] = traceback.format_exc()
+
+    outcome.update({"count": indexer.count, "deleted": indexer.deleted,
+                    "failed": indexer.failed})
+    return outcome
+
+# The queue a worker sends its deferred operations to the parent on.
+_deferred = None
+
+def _init_worker(deferred):
+    """
+    Forked workers must not share their parent's sockets.
+    """
+    global _deferred
+    from solango.solr import pool
+    pool.reset()
+    _deferred = deferred
+
+def _write_deferred(deferred):
+    """
+    Runs in a thread of the parent. Writes the operations the workers send
+    to the deferred backend of their index, until it gets None.
+    """
+    import solango
+    while True:
+        operation = deferred.get()
+        if operation is None:
+            return
+        document_key, method, xml, doc_pk, error = operation
+        try:
+            solango.documents[document_key].index.defer(method, xml, doc_pk,
+                                                        error)
+        except Exception, e:
+            logger.exception("Deferring the %s of %s failed: %s" %
+                             (method, doc_pk, e))
+
+class ParallelReindexer(object):
+    """
+    ..attribute: workers
+
+        Number of worker processes.
+
+    ..attribute: partitions
+
+        Number of primary key ranges per worker and queryset. More ranges
+        balance the load better when rows cost different amounts to index.
+
+    ..attribute: errors
+
+        Tracebacks of the ranges that failed.
+    """
+
+    partitions = 4
+
+    def __init__(self, workers=4, batch_size=None, report=None):
+        self.workers = workers
+        self.batch_size = batch_size or conf.SOLR_BATCH_INDEX_SIZE
+        self.report = report or logger.info
+
+        self.count = 0
+        self.deleted = 0
+        self.failed = 0
+        self.errors = []
+        self.started = None
+        self.checkpoint = get_checkpoint()
+
+    @property
+    def rate(self):
+        if not self.started:
+            return 0.0
+        elapsed = time.time() - self.started
+        if elapsed <= 0:
+            return 0.0
+        return self.count / elapsed
+
+    def tasks(self, querysets, resume=False):
+        """
+        Plans the ranges of every queryset. With resume, the ranges of the
+        checkpoints are used instead and the finished ones are skipped.
+        """
+        tasks = []
+        for queryset in querysets:
+            document_key = get_instance_key(queryset.model)
+            prefix = make_key(document_key)
+
+            checkpoints = {}
+            if self.checkpoint is not None:
+                if resume:
+                    checkpoints = self.checkpoint.list(prefix)
+                else:
+                    self.checkpoint.clear(prefix)
+
+            if checkpoints:
+                for key, state in sorted(checkpoints.items()):
+                    if state["done"]:
+                        self.count += state["count"] or 0
+                    else:
+                        tasks.append((document_key, queryset.query,
+                                      state["after"], state["upto"],
+                                      self.batch_size, key, True))
+                continue
+
+            for i, (after, upto) in enumerate(partition(queryset,
+                                        self.workers * self.partitions)):
+                key = make_key(document_key, i)
+                if self.checkpoint is not None:
+                    # Saved up front so a resume knows about ranges that
+                    # never got started.
+                    self.checkpoint.save(key, {"after": after, "upto": upto})
+                tasks.append((document_key, queryset.query, after, upto,
+                              self.batch_size, key, False))
+        return tasks
+
+    def run(self, querysets, resume=False):
+        """
+        Reindexes querysets and commits. With resume, an interrupted run is
+        continued. Returns self.
+        """
+        import solango
+        from multiprocessing import Pool, Queue
+        from django.db import connection
+
+        self.started = time.time()
+        tasks = self.tasks(querysets, resume)
+
+        # Workers open their own database connection instead of inheriting
+        # this one.
+        connection.close()
+
+        deferred = Queue()
+        writer = threading.Thread(target=_write_deferred, args=(deferred,))
+        writer.start()
+        pool = Pool(self.workers, _init_worker, (deferred,))
+        try:
+            for outcome in pool.imap_unordered(reindex_range, tasks):
+                self.collect(outcome)
+        finally:
+            pool.close()
+            pool.join()
+            deferred.put(None)
+            writer.join()
+
+        self.commit([solango.documents[get_instance_key(queryset.model)].index
+                     for queryset in querysets])
+
+        if self.checkpoint is not None and not self.errors:
+            for queryset in querysets:
+                self.checkpoint.clear(make_key(get_instance_key(queryset.model)))
+        return self
+
+    def collect(self, outcome):
+        # Counts include what a resumed range indexed before.
+        self.count += outcome["count"]
+        self.deleted += outcome["deleted"]
+        self.failed += outcome["failed"]
+
+        if outcome["error"]:
+            self.errors.append(outcome["error"])
+            self.report("%s (%s, %s] failed:\n%s" % (outcome["document_key"],
+                        outcome["after"], outcome["upto"], outcome["error"]))
+
+        self.report("%s (%s, %s]: %d documents, %.1f docs/sec in total" %
+                    (outcome["document_key"], outcome["after"],
+                     outcome["upto"], self.count, self.rate))
+
+    def commit(self, indexes):
+        """
+        One commit for every distinct update url.
+        """
+        committed = set()
+        for index in indexes:
+            if index.update_url in committed:
+                continue
+            committed.add(index.update_url)
+
+            result = index.commit()
+            if not result.success:
+                index.defer("commit", result.xml, error=result.error)
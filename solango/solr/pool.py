@@ -0,0 +1,335 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Keep-alive HTTP connection pooling for Solr requests.
+
+urllib2 opens and tears down a TCP connection for every request. Pools hold
+on to persistent ``httplib`` connections instead, one pool per Solr host,
+and are shared by every ``SearchWrapper`` (and therefore every ``Index``)
+that talks to that host::
+
+    from solango.solr import pool
+
+    response = pool.urlopen("http://localhost:8983/solr/select?q=django")
+    response.status, response.body
+
+    pool.pool_stats()
+    {'http://localhost:8983': {'size': 10, 'created': 1, 'idle': 1,
+                               'hits': 0, 'misses': 1, 'waits': 0}}
+"""
+
+import httplib
+import select
+import socket
+import threading
+import time
+import urlparse
+
+from solango import conf
+from solango.log import logger
+
+class Response(object):
+    """
+    The fully read response of a pooled request.
+    """
+    def __init__(self, status, reason, body):
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+    def read(self):
+        return self.body
+
+class ConnectionPool(object):
+    """
+    A thread safe pool of keep-alive connections to a single host.
+
+    ..attribute: size
+
+        Maximum number of open connections. Threads asking for a connection
+        when all of them are in use wait for one to be returned, at most the
+        timeout of their request.
+
+    ..attribute: idle_timeout
+
+        Seconds an idle connection is kept before it is closed and replaced.
+
+    ..attribute: hits, misses, waits
+
+        Counters for reused connections, newly opened connections and the
+        number of times a thread had to wait for a free connection.
+    """
+
+    def __init__(self, scheme, netloc, size=None, idle_timeout=None):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.size = size or conf.SEARCH_POOL_SIZE
+        self.idle_timeout = idle_timeout or conf.SEARCH_POOL_IDLE_TIMEOUT
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def _new_connection(self):
+        if self.scheme == "https":
+            return httplib.HTTPSConnection(self.netloc)
+        return httplib.HTTPConnection(self.netloc)
+
+    def get(self, timeout=None):
+        """
+        Returns an idle connection, opening a new one if the pool is not full
+        and blocking until one is returned otherwise. Raises socket.timeout
+        if none is free within timeout seconds, None waits for ever.
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        self._condition.acquire()
+        try:
+            while True:
+                now = time.time()
+                while self._idle:
+                    conn, last_used = self._idle.pop()
+                    if now - last_used < self.idle_timeout \
+                                        and not _is_dropped(conn):
+                        self.hits += 1
+                        return conn
+                    self._close(conn)
+
+                if self._created < self.size:
+                    self._created += 1
+                    self.misses += 1
+                    return self._new_connection()
+
+                self.waits += 1
+                if end is None:
+                    self._condition.wait()
+                    continue
+                remaining = end - now
+                if remaining <= 0:
+                    raise socket.timeout("No free connection to %s within "
+                                         "%s seconds" % (self.netloc, timeout))
+                self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+
+    def put(self, conn):
+        """
+        Returns a connection to the pool.
+        """
+        self._condition.acquire()
+        try:
+            self._idle.append((conn, time.time()))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def discard(self, conn):
+        """
+        Closes a connection that can no longer be used.
+        """
+        self._condition.acquire()
+        try:
+            self._close(conn)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        self._condition.acquire()
+        try:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def _close(self, conn):
+        self._created -= 1
+        try:
+            conn.close()
+        except StandardError:
+            pass
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Issues a request on a pooled connection and returns a Response.
+        A socket operation that takes longer than timeout seconds raises
+        socket.timeout, None waits for ever.
+
+        Solr may have closed a connection while it sat idle. If a reused
+        connection fails, the idle connections are dropped and the request is
+        retried once on a fresh one. A request that timed out is not retried.
+        """
+        headers = headers or {}
+
+        conn = self.get(timeout)
+        reused = conn.sock is not None
+        try:
+            return self._request(conn, method, path, body, headers, timeout)
+        except socket.timeout:
+            raise
+        except (httplib.HTTPException, socket.error), e:
+            if not reused:
+                raise
+            logger.debug("Retrying stale connection to %s: %s" %
+                         (self.netloc, e))
+            self.clear()
+            return self._request(self.get(timeout), method, path, body,
+                                 headers, timeout)
+
+    def stream(self, method, path, chunks, headers=None, timeout=None):
+        """
+        Issues a request whose body is sent with chunked transfer encoding as
+        chunks are produced by the chunks iterable. Returns a Response.
+
+        Since the body can't be replayed, a failed stream is not retried.
+        """
+        headers = dict(headers or {})
+        headers["Transfer-Encoding"] = "chunked"
+
+        conn = self.get(timeout)
+        try:
+            _set_timeout(conn, timeout)
+            conn.putrequest(method, path, skip_accept_encoding=True)
+            for name, value in headers.items():
+                conn.putheader(name, value)
+            conn.endheaders()
+
+            for chunk in chunks:
+                if chunk:
+                    conn.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+            conn.send("0\r\n\r\n")
+        except:
+            self.discard(conn)
+            raise
+
+        return self._response(conn)
+
+    def _request(self, conn, method, path, body, headers, timeout=None):
+        try:
+            _set_timeout(conn, timeout)
+            conn.request(method, path, body, headers)
+        except:
+            self.discard(conn)
+            raise
+
+        return self._response(conn)
+
+    def _response(self, conn):
+        try:
+            response = conn.getresponse()
+            data = response.read()
+        except:
+            self.discard(conn)
+            raise
+
+        if response.will_close:
+            self.discard(conn)
+        else:
+            self.put(conn)
+
+        return Response(response.status, response.reason, data)
+
+    def stats(self):
+        """
+        Returns the pool counters as a dictionary.
+        """
+        self._condition.acquire()
+        try:
+            return {"size": self.size,
+                    "created": self._created,
+                    "idle": len(self._idle),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "waits": self.waits}
+        finally:
+            self._condition.release()
+
+def _set_timeout(conn, timeout):
+    """
+    Pooled connections are reused by requests with other timeouts, so it is
+    set on every request, on the socket if it is open already.
+    """
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+def _is_dropped(conn):
+    """
+    An idle keep-alive socket is only readable if the server closed it.
+    """
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0.0)[0])
+    except (select.error, socket.error):
+        return True
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(url):
+    """
+    Returns the shared ConnectionPool for the host of url.
+    """
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    key = "%s://%s" % (scheme, netloc)
+
+    pool = _pools.get(key)
+    if pool is None:
+        _pools_lock.acquire()
+        try:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(scheme, netloc)
+        finally:
+            _pools_lock.release()
+    return pool
+
+def reset():
+    """
+    Forgets every pool without closing its connections. Call this in a forked
+    child process so it doesn't share sockets with its parent.
+    """
+    _pools_lock.acquire()
+    try:
+        _pools.clear()
+    finally:
+        _pools_lock.release()
+
+def pool_stats():
+    """
+    Returns the stats of every pool keyed by host.
+    """
+    return dict([(key, pool.stats()) for key, pool in _pools.items()])
+
+def urlopen(url, data=None, headers=None, timeout=None):
+    """
+    Issues a GET, or a POST if data is given, for url on its host's pool.
+    """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+    if query:
+        path = "%s?%s" % (path, query)
+
+    method = data is None and "GET" or "POST"
+    return get_pool(url).request(method, path or "/", data, headers, timeout)
+
+def urlopen_chunked(url, chunks, headers=None, timeout=None):
+    """
+    POSTs the byte strings produced by chunks to url as a chunked body.
+    """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+    if query:
+        path = "%s?%s" % (path, query)
+
+    return get_pool(url).stream("POST", path or "/", chunks, headers, timeout)
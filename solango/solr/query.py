@@ -18,10 +18,24 @@ We need to handle 3 use cases:
 """
 
 import urllib
-from copy import deepcopy
+from copy import copy
+from operator import itemgetter
 
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
 
 class Value(object):
+    """
+    A query parameter. Values change through add, set and merge, which drop
+    the cached parameters of the value and of the queries holding it.
+    
+    Queries share values until they change them, see QueryBase.
+    """
+    
+    _params = None
+    _owner = None
 
     def __init__(self, data=None, prefix=None, default=None, help_text=None):
         self.data = data
@@ -32,9 +46,31 @@ class Value(object):
         
     def add(self, value):
         self.data = value
+        self._changed()
 
     def set(self, value):
         self.data = value
+        self._changed()
+
+    def merge(self, value):
+        """
+        Merges the data of another value of the same parameter.
+        """
+        self.set(value.data)
+
+    def _changed(self):
+        self._params = None
+        if self._owner is not None:
+            self._owner._changed()
+
+    def copy(self):
+        """
+        Returns an unowned copy with its own data container.
+        """
+        other = copy(self)
+        other.data = copy(self.data)
+        other._owner = None
+        return other
 
     def __unicode__(self):
         return unicode(self.data)
@@ -47,15 +83,29 @@ class Value(object):
             return True
         return False
     
-    def url(self):
-        if not self.data:
-            return ""
-        
+    def param_name(self):
         name = self.name.replace("_", ".")
         if self.prefix:
             name = self.prefix + name
+        return name
+    
+    def params(self):
+        """
+        Returns the (name, value) pairs of this parameter as utf-8 encoded
+        strings, in canonical order.
+        """
+        if self._params is None:
+            if self.data:
+                self._params = self._build_params()
+            else:
+                self._params = []
+        return self._params
+    
+    def _build_params(self):
+        return [(self.param_name(), _encode(self.data))]
     
-        return "%s=%s" % (name, self.data)
+    def url(self):
+        return urllib.urlencode(self.params())
 
 class IntegerValue(Value):pass
 class BooleanValue(Value):pass
@@ -75,6 +125,11 @@ class MultiValue(Value):
 
     def add(self, value):
         self.data.append(value)
+        self._changed()
+
+    def merge(self, value):
+        self.data.extend(value.data)
+        self._changed()
 
     def set(self, value):
         
@@ -82,16 +137,12 @@ class MultiValue(Value):
             self.data = [value]
         else:
             self.data = value
+        self._changed()
 
-    def url(self):
-        if not self.data:
-            return ""
-    
-        name = self.name.replace("_", ".")
-        if self.prefix:
-            name = self.prefix + name
-    
-        return urllib.urlencode(["%s=%s" % (name, value) for value in self.data])
+    def _build_params(self):
+        # Order matters in a list, it is kept.
+        name = self.param_name()
+        return [(name, _encode(value)) for value in self.data]
     
 
 class UniqueMultiValue(Value):
@@ -111,6 +162,11 @@ class UniqueMultiValue(Value):
             self.data.update([value])
         else:
             self.data.update(value)
+        self._changed()
+
+    def merge(self, value):
+        self.data.update(value.data)
+        self._changed()
 
     def set(self, value):
         
@@ -118,25 +174,23 @@ class UniqueMultiValue(Value):
             self.data = set([value])
         else:
             self.data = set(value)
+        self._changed()
 
-    def url(self):
-        if not self.data:
-            return ""
-        
-        name = self.name.replace("_", ".")
-        if self.prefix:
-            name = self.prefix + name
+    def _build_params(self):
+        name = self.param_name()
         
         values = []
         for value in self.data:
             if self.per_field and isinstance(value, (tuple,list)):
                 field = value[0]
                 field_value = value[1]
-                values.append(("f.%s.%s" % (field, name), field_value))
+                values.append(("f.%s.%s" % (field, name), _encode(field_value)))
             else:
-                values.append((name, value))
+                values.append((name, _encode(value)))
         
-        return urllib.urlencode(values)
+        # Sets have no order, sorting makes equal queries give equal urls.
+        values.sort()
+        return values
     
 
     def __unicode__(self):
@@ -145,15 +199,9 @@ class UniqueMultiValue(Value):
 
 class DelimitedMultiValue(UniqueMultiValue):
     
-    def url(self):
-        if not self.data:
-            return ""
-    
-        name = self.name.replace("_", ".")
-        if self.prefix:
-            name = self.prefix + name
-    
-        return urllib.urlencode([(name, ",".join(self.data))])
+    def _build_params(self):
+        return [(self.param_name(), 
+                 ",".join(sorted([_encode(value) for value in self.data])))]
 
 class UniqueSingleValue(UniqueMultiValue):pass
 
@@ -169,18 +217,12 @@ class QValue(MultiValue):
             self.data.extend(key)
         else:
             self.data.append(key)
+        self._changed()
 
-    def url(self):
-        if not self.data:
-            return ""
-        
-        name = self.name.replace("_", ".")
-        if self.prefix:
-            name = self.prefix + name
-
+    def _build_params(self):
         operator = " %s " % self.operator
-        return urllib.urlencode([(name, operator.join(["%s" % value
-                          for value in self.data]))])
+        return [(self.param_name(), operator.join([_encode(value)
+                                                   for value in self.data]))]
 
 
 
@@ -205,12 +247,29 @@ class QueryMetaClass(type):
                      cls).__new__(cls, name, bases, attrs)
 
 class QueryBase(object):
+    """
+    Queries are copy-on-write. A new query shares the values declared on its
+    class, and a clone shares the values of the query it was cloned from. A
+    value is copied the first time the query changes it, so creating and
+    cloning queries costs the same however many parameters there are.
+    
+    The parameters and the url are built once and cached until one of the
+    values changes.
+    """
     
     __metaclass__ = QueryMetaClass
+    
+    _params = None
+    _url = None
+    _owner = None
+    
+    # True while self.data may be shared with the class or other queries.
+    _shared = True
+    _owned = frozenset()
 
     def __init__(self, initial=[], **kwargs):
         
-        self.data = deepcopy(self.base_data)
+        self.data = self.base_data
         
         params = []
         
@@ -223,9 +282,83 @@ class QueryBase(object):
         
         for key, value in params:
             self.add(key, value)
-            
+    
+    def _writable(self, name):
+        """
+        Returns the value called name, copied first unless this query owns it
+        already.
+        """
+        if self._shared:
+            self.data = dict(self.data)
+            self._shared = False
+            self._owned = set()
+        
+        value = self.data[name]
+        if name not in self._owned:
+            value = value.copy()
+            value._owner = self
+            self.data[name] = value
+            self._owned.add(name)
+        return value
+    
+    def clone(self):
+        """
+        Returns a copy of this query that shares every value with it until
+        one of them changes them.
+        """
+        other = object.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other._owner = None
+        # From now on both have to copy before writing.
+        self._shared = other._shared = True
+        self._owned = other._owned = frozenset()
+        return other
+    
+    copy = clone
+    
+    def merge(self, query):
+        """
+        Merges the values query changed into this query. Values query shares
+        with its class or with this query are skipped. Returns self.
+        """
+        assert isinstance(query, self.__class__), \
+                    "Merge only accepts %s elements" % self.__class__.__name__
+        
+        if query.data is self.base_data:
+            return self
+        
+        for name, value in query.data.items():
+            if value is self.base_data[name] or value is self.data[name]:
+                continue
+            self._writable(name).merge(value)
+        return self
+    
+    def _changed(self):
+        self._params = None
+        self._url = None
+        if self._owner is not None:
+            self._owner._changed()
+    
+    def params(self):
+        """
+        Returns the (name, value) pairs of every value, sorted by name.
+        """
+        if self._params is None:
+            self._params = self._build_params()
+        return self._params
+    
+    def _build_params(self):
+        params = []
+        for value in self.data.values():
+            params.extend(value.params())
+        # Stable, so the order within a list value is kept.
+        params.sort(key=itemgetter(0))
+        return params
+    
     def url(self):
-        return "&".join([value.url() for value in self.data.values() if value])
+        if self._url is None:
+            self._url = urllib.urlencode(self.params())
+        return self._url
     
     def __nonzero__(self):
         if self.url():
@@ -235,13 +368,14 @@ class QueryBase(object):
     def __setattr__(self, name, value):
         if  not name.startswith("_") and name != "data" \
                                      and self.data.has_key(name):
-            self.data[name].set(value)
+            self._writable(name).set(value)
         else:
             super(QueryBase, self).__setattr__(name, value)
     
     def __getattr__(self, name):
+        # The value may be changed by the caller, so it is made writable.
         if name != "data" and self.data.has_key(name):
-            return self.data[name]
+            return self._writable(name)
 
         return super(QueryBase, self).__getattr__(name)
     
@@ -378,13 +512,13 @@ class Facet(QueryBase):
             name = name[6:]
         if  not name.startswith("_") and name != "data" \
                                      and self.data.has_key(name):
-            self.data[name].set(value)
+            self._writable(name).set(value)
         else:
             super(Facet, self).__setattr__(name, value)
     
     def __getattr__(self, name):
         if name != "data" and self.data.has_key(name):
-            return self.data[name]
+            return self._writable(name)
 
         return super(Facet, self).__getattr__(name)
     
@@ -396,15 +530,24 @@ class Facet(QueryBase):
         
         if name == "facet":
             self._facet = value
+            self._changed()
         
         else:
-            self.data[name].add(value)
+            self._writable(name).add(value)
     
-    def url(self):
-        part = "&".join([value.url() for value in self.data.values() if value])
-        if part or self._facet is True:
-            part = "facet=true&" + part
-        return part
+    def merge(self, query):
+        super(Facet, self).merge(query)
+        if query._facet is not False:
+            self._facet = query._facet
+            self._changed()
+        return self
+    
+    def _build_params(self):
+        params = super(Facet, self)._build_params()
+        if params or self._facet is True:
+            params.append(("facet", "true"))
+            params.sort(key=itemgetter(0))
+        return params
 
 class Highlight(QueryBase):
     
@@ -486,7 +629,7 @@ class Highlight(QueryBase):
             name = name[3:]
         if  not name.startswith("_") and name != "data" \
                                      and self.data.has_key(name):
-            self.data[name].set(value)
+            self._writable(name).set(value)
         else:
             super(Highlight, self).__setattr__(name, value)
     
@@ -497,17 +640,24 @@ class Highlight(QueryBase):
         
         if name == "hl":
             self._hl = value
+            self._changed()
         
         else:
-            self.data[name].add(value)
+            self._writable(name).add(value)
     
-    def url(self):
-        part = "&".join([value.url() for value in self.data.values() if value])
-        if part:
-            part = "hl=true&" + part
-        elif self._hl is True:
-            part = "hl=true"
-        return part
+    def merge(self, query):
+        super(Highlight, self).merge(query)
+        if query._hl is not False:
+            self._hl = query._hl
+            self._changed()
+        return self
+    
+    def _build_params(self):
+        params = super(Highlight, self)._build_params()
+        if params or self._hl is True:
+            params.append(("hl", "true"))
+            params.sort(key=itemgetter(0))
+        return params
 
 class Query(QueryBase):
     """
@@ -564,6 +714,9 @@ class Query(QueryBase):
     timeAllowed = Value()
     omitHeader = Value()
     wt = Value(data="json")
+    
+    #http://wiki.apache.org/solr/DistributedSearch
+    shards = Value()
         
     #http://wiki.apache.org/solr/DisMaxRequestHandler
     q_alt = QValue()
@@ -581,8 +734,13 @@ class Query(QueryBase):
     hl = Highlight()
 
     def __init__(self, initial=[], **kwargs):
-        self.data = deepcopy(self.base_data)
-        
+        self.data = self.base_data
+        self.update(initial, **kwargs)
+    
+    def update(self, initial=None, **kwargs):
+        """
+        Adds parameters given like to the constructor. Returns self.
+        """
         params = []
         
         if isinstance(initial, basestring):
@@ -602,46 +760,54 @@ class Query(QueryBase):
                 key = ".".join(parts[2:])
                 value = (name, value)
             
-            if key.startswith("facet"):
-                self.facet.add(key, value)
-            elif key.startswith("hl"):
-                self.hl.add(key, value)
-            else:
-                self.add(key, value)
+            self.add(key, value)
+        return self
+    
+    def derive(self, initial=None, **kwargs):
+        """
+        Returns a clone of this query with the parameters added, leaving this
+        query as it is::
+        
+            base = Query(fq="public:true", rows=10)
+            page = base.derive("django", start=20)
+        """
+        return self.clone().update(initial, **kwargs)
                 
 
     def __setattr__(self, name, value):
         if not name.startswith("_") and name != "data" \
                                     and self.data.has_key(name):
-            self.data[name].set(value)
+            self._writable(name).set(value)
         else:
             super(Query, self).__setattr__(name, value)
     
     def __getattr__(self, name):
         if not name.startswith("_") and name != "data" \
                                     and self.data.has_key(name):
-            return self.data[name]
+            return self._writable(name)
 
         return super(Query, self).__getattr__(name)
     
     def add(self, key, value):
         if key.startswith("facet"):
-            self.facet.add(key, value)
+            self._writable("facet").add(key, value)
         elif key.startswith("hl"):
-            self.hl.add(key, value)
+            self._writable("hl").add(key, value)
         else:
             if self.data.has_key(key):
-                self.data[key].add(value)
+                self._writable(key).add(value)
             else:
-                self.data["q"].add(key, value)
+                self._writable("q").add(key, value)
     
     def url(self):
-        return "?%s" % "&".join([value.url() for value in self.data.values() if value])
+        """
+        Returns the query string, parameters sorted by name and utf-8 encoded
+        so equal queries give identical urls. It is built once and kept until
+        a value changes.
+        """
+        if self._url is None:
+            self._url = "?%s" % urllib.urlencode(self.params())
+        return self._url
     
-    def merge(self, query):
-        #will merge a another query in with this one.
-        assert isinstance(query, Query), "Merge only accepts Query element"
-        
-        for value in query.data.values():
-            self.add(value.name, value.data)
+
         
\ No newline at end of file
@@ -4,7 +4,7 @@
 
 import urllib
 
-from xml.dom import minidom
+from cStringIO import StringIO
 
 from django.utils import simplejson
 
@@ -39,9 +39,12 @@ class Results(object):
     def __init__(self, url, json):
         """
         Parses the provided XML body and initialize the header dictionary.
+        json may also be the parsed body.
         """
         self.url = url
-        self._json = simplejson.loads(json)
+        if isinstance(json, basestring):
+            json = simplejson.loads(json)
+        self._json = json
         self.header = self._json["responseHeader"]
     
     @property
@@ -100,7 +103,9 @@ class SelectErrorResults(ErrorResults):
     def __init__(self, url, error, code=None):
         self.method = "select"
         self.url = url
-        self.documents = []
+        self.documents = LazyDocuments([])
+        self.error = error
+        self.error_code = code
         self.facets = []
         self.facet_dates = []
         self.highlighting ={}
@@ -121,14 +126,115 @@ class UpdateResults(Results):
         if not xml:
             raise ValueError, "Invalid or missing XML"
         
-        doc = minidom.parseString(xml)
+        if isinstance(xml, unicode):
+            xml = xml.encode("utf-8")
+        
+        # The header comes first, the rest of the response is not parsed.
+        for name, value in xmlutils.iter_values(StringIO(xml)):
+            if name == "responseHeader":
+                self.header = value
+                break
+        
+        if self.header is None:
+            raise ValueError, "Invalid or missing XML"
+    
+class JSONUpdateResults(Results):
+    """
+    Results for Solr update requests in the JSON update format.
+    """
+    
+    def __init__(self, json):
+        if not json:
+            raise ValueError, "Invalid or missing JSON"
         
-        header = xmlutils.get_child_node(doc.firstChild, "lst", "responseHeader")
+        Results.__init__(self, None, json)
+    
+class LazyDocuments(object):
+    """
+    The documents of a SelectResults, a read only sequence. Solr's raw
+    document dictionaries are kept and a document is only turned into a
+    SearchDocument, and highlighted, the first time it is accessed.
+    
+    ``ids`` and ``values`` read the raw dictionaries and never build a
+    SearchDocument::
+    
+        results.documents.ids()
+        [u'12', u'7', u'31']
+        results.documents.values("title")
+        [u'Django', u'Solr', u'Solango']
+    """
+    
+    def __init__(self, docs, highlighting=None):
+        self.raw = docs
+        self.highlighting = highlighting or {}
+        self._documents = [None] * len(docs)
+    
+    def __len__(self):
+        return len(self.raw)
+    
+    def __nonzero__(self):
+        return bool(self.raw)
+    
+    def __iter__(self):
+        for i in xrange(len(self.raw)):
+            yield self[i]
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self.raw)))]
         
-        self.header = xmlutils.get_dictionary(header)
+        document = self._documents[i]
+        if document is None:
+            document = self._documents[i] = self._hydrate(self.raw[i])
+        return document
+    
+    def __repr__(self):
+        return "<LazyDocuments: %d documents>" % len(self.raw)
+    
+    def _hydrate(self, d):
+        document = documents[d['model']](d)
         
-        doc.unlink()
+        highlights = self.highlighting.get(document.pk_field._id)
+        if highlights:
+            for key, value in highlights.items():
+                document.highlight += ' %s' % ' '.join(value)
+                document.fields[key].highlight = ' '.join(value)
+        return document
+    
+    def ids(self):
+        """
+        Returns the primary keys of the model instances, like
+        ``document.pk_field.value``.
+        """
+        ids = []
+        for d in self.raw:
+            name = _pk_name(documents[d['model']])
+            ids.append(d[name].split(conf.SEARCH_SEPARATOR)[-1])
+        return ids
     
+    def values(self, name):
+        """
+        Returns the raw Solr value of the field called name of every
+        document, None where it is missing. Values are not cleaned, dates
+        are strings for instance.
+        """
+        return [d.get(name) for d in self.raw]
+
+_pk_names = {}
+
+def _pk_name(document):
+    """
+    The Solr name of the primary key field of a document class.
+    """
+    name = _pk_names.get(document)
+    if name is None:
+        from solango.solr.fields import PrimaryKeyField
+        for field in document.base_fields.values():
+            if isinstance(field, PrimaryKeyField):
+                name = _pk_names[document] = field.get_name()
+                break
+    return name
+
 class SelectResults(Results):
     """
     Results for Solr select requests.
@@ -179,9 +285,7 @@ class SelectResults(Results):
         
         self.count = result["numFound"]
         
-        for d in result["docs"]:
-            document = documents[d['model']](d)
-            self.documents.append(document)
+        self.documents = LazyDocuments(result["docs"])
         
     def _parse_facets(self):
         """
@@ -229,15 +333,11 @@ class SelectResults(Results):
     def _parse_highlighting(self):
         """
         Parses the highlighting list into this Result's highlighting dictionary.
-        Also iterate over this Result's documents, inserting highlighting
-        elements to their owning documents.
+        The documents insert their highlighting elements when they are built.
         """
         self.highlighting = self._json.get("highlighting", None)
 
         if not self.highlighting:
             return None
 
-        for d in self.documents:
-            for key, value in self.highlighting[d.pk_field._id].items():
-                d.highlight += ' %s' % ' '.join(value)
-                d.fields[key].highlight = ' '.join(value)
+        self.documents.highlighting = self.highlighting
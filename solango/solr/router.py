@@ -0,0 +1,225 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Replica Routing
+===============
+
+Spreads the selects of an index over its Solr read replicas, the
+``select_urls`` of the index. Updates always go to the ``update_url``::
+
+    SEARCH_SELECT_URLS = ["http://slave1:8983/solr/select",
+                          "http://slave2:8983/solr/select"]
+
+Every select asks the router of its urls for the replicas to try, in order.
+The first is picked by SEARCH_SELECT_STRATEGY:
+
+* "least_outstanding" - the replica with the fewest requests in flight,
+  the fastest on a tie.
+* "latency"           - weighted round robin, a replica's share of the
+  requests is inversely proportional to its average response time.
+
+The others follow as fail over, fastest first. A replica whose request fails
+with a connection or server error is tried again after the next one, and is
+skipped for SEARCH_REPLICA_RETRY seconds once it failed
+SEARCH_REPLICA_MAX_FAILURES times in a row, or a ping found it down.
+Replicas that are down are still tried, last, when no other is left.
+"""
+
+import threading
+import time
+
+from solango import conf
+
+# Weight of a new response time in the moving average.
+LATENCY_SMOOTHING = 0.2
+
+class Replica(object):
+    """
+    ..attribute: outstanding
+
+        Number of requests in flight.
+
+    ..attribute: latency
+
+        Moving average of the response time in seconds, None before the
+        first response.
+
+    ..attribute: failures
+
+        Number of failed requests since the last good one.
+
+    ..attribute: down_until
+
+        Time until which the replica is skipped.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.down_until = 0
+        self.requests = 0
+        self.errors = 0
+        self._current = 0.0
+
+    def is_up(self, now=None):
+        return self.down_until <= (now or time.time())
+
+    def weight(self):
+        # Replicas without a response yet get an average chance.
+        return 1.0 / max(self.latency or 0.05, 0.001)
+
+    def stats(self):
+        return {"outstanding": self.outstanding,
+                "latency": self.latency,
+                "failures": self.failures,
+                "up": self.is_up(),
+                "requests": self.requests,
+                "errors": self.errors}
+
+class ReplicaRouter(object):
+
+    strategies = ("least_outstanding", "latency")
+
+    def __init__(self, urls, strategy=None, retry_after=None,
+                 max_failures=None):
+        if isinstance(urls, basestring):
+            urls = [urls]
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy or conf.SEARCH_SELECT_STRATEGY
+        if self.strategy not in self.strategies:
+            raise AttributeError("SEARCH_SELECT_STRATEGY must be one of the "
+                                 "following: %s" % ", ".join(self.strategies))
+        if retry_after is None:
+            retry_after = conf.SEARCH_REPLICA_RETRY
+        self.retry_after = retry_after
+        self.max_failures = max_failures or conf.SEARCH_REPLICA_MAX_FAILURES
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        for replica in self.replicas:
+            if replica.url == url:
+                return replica
+        return None
+
+    def order(self):
+        """
+        Returns the replicas in the order they should be tried.
+        """
+        self._lock.acquire()
+        try:
+            now = time.time()
+            up = [r for r in self.replicas if r.is_up(now)]
+            down = [r for r in self.replicas if not r.is_up(now)]
+            if not up:
+                down.sort(key=lambda r: r.down_until)
+                return down
+
+            if self.strategy == "latency":
+                first = self._weighted(up)
+            else:
+                first = min(up, key=lambda r: (r.outstanding,
+                                               r.latency or 0))
+            rest = [r for r in up if r is not first]
+            rest.sort(key=lambda r: r.latency or 0)
+            return [first] + rest + down
+        finally:
+            self._lock.release()
+
+    def _weighted(self, replicas):
+        """
+        Smooth weighted round robin: every replica gains its weight, the
+        one ahead is picked and pays back the sum of the weights.
+        """
+        total = 0.0
+        best = None
+        for replica in replicas:
+            weight = replica.weight()
+            replica._current += weight
+            total += weight
+            if best is None or replica._current > best._current:
+                best = replica
+        best._current -= total
+        return best
+
+    def start(self, replica):
+        self._lock.acquire()
+        try:
+            replica.outstanding += 1
+            replica.requests += 1
+        finally:
+            self._lock.release()
+        return time.time()
+
+    def finish(self, replica, started, ok=True):
+        """
+        Records the end of a request to replica that started at started.
+        """
+        self._lock.acquire()
+        try:
+            replica.outstanding -= 1
+            if ok:
+                elapsed = time.time() - started
+                if replica.latency is None:
+                    replica.latency = elapsed
+                else:
+                    replica.latency += LATENCY_SMOOTHING * \
+                                        (elapsed - replica.latency)
+                replica.failures = 0
+                replica.down_until = 0
+            else:
+                replica.errors += 1
+                replica.failures += 1
+                if replica.failures >= self.max_failures:
+                    replica.down_until = time.time() + self.retry_after
+        finally:
+            self._lock.release()
+
+    def mark_up(self, replica):
+        self._lock.acquire()
+        try:
+            replica.failures = 0
+            replica.down_until = 0
+        finally:
+            self._lock.release()
+
+    def mark_down(self, replica):
+        self._lock.acquire()
+        try:
+            replica.down_until = time.time() + self.retry_after
+        finally:
+            self._lock.release()
+
+    def is_available(self):
+        now = time.time()
+        for replica in self.replicas:
+            if replica.is_up(now):
+                return True
+        return False
+
+    def stats(self):
+        return dict([(r.url, r.stats()) for r in self.replicas])
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+def get_router(urls):
+    """
+    Returns the ReplicaRouter shared by every connection to urls.
+    """
+    if isinstance(urls, basestring):
+        urls = [urls]
+    key = tuple(urls)
+
+    _routers_lock.acquire()
+    try:
+        router = _routers.get(key)
+        if router is None:
+            router = ReplicaRouter(urls)
+            _routers[key] = router
+        return router
+    finally:
+        _routers_lock.release()
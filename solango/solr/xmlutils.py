@@ -2,13 +2,153 @@
 # Copyright 2008 Optaros, Inc.
 #
 
-from xml.dom import Node
+"""
+Streaming parsing of Solr XML responses.
+
+Responses are read with ``iterparse`` and every element is converted to a
+Python value as soon as it ends, through the ``SCALARS`` and ``CONTAINERS``
+dispatch tables, then dropped. No DOM is built::
+
+    from solango.solr import xmlutils
+
+    for name, value in xmlutils.iter_values(StringIO(xml)):
+        if name == "responseHeader":
+            break
+
+``element_dictionary`` and ``element_list`` convert ``ElementTree`` elements
+that are already parsed and return the same values. ``get_dictionary``,
+``get_list`` and the other ``get_`` helpers work on minidom nodes, as they
+always did.
+"""
+
+from cStringIO import StringIO
 from datetime import datetime
 from time import strptime
+from xml.dom import Node
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+def _unicode(text):
+    return unicode(text)
+
+def _bool(text):
+    return text == "true"
+
+def _date(text):
+    return datetime(*strptime(text, DATE_FORMAT)[0:6])
+
+# Converters of the text of Solr's scalar elements.
+SCALARS = {"str": _unicode,
+           "int": int,
+           "long": long,
+           "float": float,
+           "double": float,
+           "bool": _bool,
+           "date": _date}
+
+# Constructors of Solr's container elements.
+CONTAINERS = {"arr": list,
+              "lst": dict,
+              "doc": dict}
+
+def iter_values(source):
+    """
+    Parses the Solr XML response in the file like object source and yields the
+    (name, value) pair of every child of the root element as soon as it is
+    parsed. Stop iterating to skip the rest of the response. Elements that are
+    neither in SCALARS nor in CONTAINERS are skipped along with their
+    children, like ``<result>``.
+    """
+    stack = []
+    depth = 0
+    skip = 0
+    root = None
+
+    for event, element in ElementTree.iterparse(source, ("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = element
+            elif not skip:
+                if element.tag in CONTAINERS:
+                    stack.append(CONTAINERS[element.tag]())
+                elif element.tag not in SCALARS:
+                    skip = depth
+            continue
+
+        depth -= 1
+        if skip:
+            if depth < skip:
+                skip = 0
+                element.clear()
+            continue
+        if depth == 0:
+            break
+
+        if element.tag in CONTAINERS:
+            value = stack.pop()
+        else:
+            value = SCALARS[element.tag](element.text or u"")
+        name = element.get("name")
+        element.clear()
+
+        if not stack:
+            root.clear()
+            yield name, value
+        elif type(stack[-1]) is list:
+            stack[-1].append(value)
+        else:
+            stack[-1][name] = value
+
+def parse(source):
+    """
+    Parses the Solr XML response in the file like object source into a
+    dictionary.
+    """
+    return dict(iter_values(source))
+
+def parse_string(xml):
+    """
+    Parses the Solr XML response string xml into a dictionary.
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode("utf-8")
+    return parse(StringIO(xml))
+
+def element_value(element):
+    """
+    Converts the specified ElementTree element into a Python value, or
+    returns None if it is not a Solr value element.
+    """
+    if element.tag in SCALARS:
+        return SCALARS[element.tag](element.text or u"")
+    if element.tag == "arr":
+        return element_list(element)
+    if element.tag in CONTAINERS:
+        return element_dictionary(element)
+    return None
+
+def element_list(element):
+    """
+    Parses the specified Solr XML arr element into a list.
+    """
+    return [element_value(c) for c in element
+            if c.tag in SCALARS or c.tag in CONTAINERS]
+
+def element_dictionary(element):
+    """
+    Parses the specified Solr XML lst element into a dictionary.
+    """
+    return dict([(c.get("name"), element_value(c)) for c in element
+                 if c.tag in SCALARS or c.tag in CONTAINERS])
 
 """
-An extension to core.xmlutils, providing Solr-specific parsing facilities.  By
-importing this module, core.xmlutils.* is available.
+minidom based parsing of Solr XML, kept for callers that build a DOM.
 """
 
 def get_list(node):
@@ -212,4 +352,4 @@ def get_sibling_node(sibling, tag, name=None):
         
         sib = sib.nextSibling
         
-    return None
\ No newline at end of file
+    return None
@@ -3,7 +3,6 @@
 #
 import urllib, datetime
 from solango import conf
-import threading
 
 def get_base_url(request, exclude=[]):
     """
@@ -70,14 +69,19 @@ def get_facets_links(request, results):
                 })
     return facets
 
-def create_schema_xml(raw=False):
+def create_schema_xml(raw=False, document_keys=None):
+    """
+    Renders the schema.xml of every registered document, or of the documents
+    of document_keys only, like the core of a MulticoreIndex.
+    """
     import solango
     from solango.conf import SOLR_DEFAULT_OPERATOR
     from django.template.loader import render_to_string
     fields = {}
     
-    for doc in solango.documents.values():
-        fields.update(doc.base_fields)
+    for key, doc in solango.documents.items():
+        if document_keys is None or key in document_keys:
+            fields.update(doc.base_fields)
     
     doc, copy_doc = "", ""
     copy_fields = []
@@ -99,54 +103,45 @@ def create_schema_xml(raw=False):
         return render_to_string('solango/schema.xml', {'fields': doc, "copy_fields"  : copy_doc, 'default_operator': SOLR_DEFAULT_OPERATOR})
 
 
-def reindex(batch_size=50, document_key=None):
+def reindex(batch_size=50, document_key=None, report=None, workers=1,
+            resume=False):
+    """
+    Reindexes every registered document, or only the one of document_key.
+    With more than one worker the reindex runs in a process pool, see
+    solango.solr.parallel. With resume, the last run continues from its
+    checkpoints.
+    """
     import solango
     
     if document_key:
-        document = solango.documents.get(document_key)
-        model = solango.solr.get_model_from_key(document_key)
-        document.index.reindex(model, document, batch_size=batch_size)
+        keys = [document_key]
     else:
-        for model_key, document in solango.documents.items():
-            model = solango.solr.get_model_from_key(model_key)
-            document.index.reindex(model, document, batch_size=batch_size)
-
-
-class ReIndexThread(threading.Thread):
+        keys = solango.documents.keys()
     
-    def __init__(self, qs, batch_size, index, commit=False):
-        self.qs = qs
-        self.batch_size = batch_size
-        self.index = index
-        self.commit = commit
-        threading.Thread.__init__(self)
-        
-    def run(self):
-        self.index().reindex_qs(self.qs,self.batch_size, self.commit)
-        print "DONE"
+    if workers > 1:
+        from solango.solr.parallel import ParallelReindexer
+        querysets = [solango.solr.get_model_from_key(key)._default_manager.all()
+                     for key in keys]
+        return ParallelReindexer(workers, batch_size, report).run(querysets,
+                                                                  resume)
+    
+    for key in keys:
+        document = solango.documents.get(key)
+        model = solango.solr.get_model_from_key(key)
+        document.index.reindex(model, document, batch_size=batch_size,
+                               report=report, resume=resume)
 
-   
-def quick_reindex(qs, batch_size=50, threads=4):
+def quick_reindex(qs, batch_size=50, workers=4, threads=None):
+    """
+    Reindexes a queryset with a pool of worker processes. threads is the old
+    name of workers.
+    """
+    if threads is not None:
+        workers = threads
     import solango
+    from solango.solr.parallel import ParallelReindexer
     solango.autodiscover()
-    count = qs.count()
-    
-    batch = count/threads
-    
-    for i in range(threads):
-        start = i*batch
-        stop = (i+1)*batch
-        
-        if i is (threads-1):
-            stop = count
-
-        #We only want one thread to do the committing.
-        commit = False
-        if i == 1:
-            commit = True
-
-        t = ReIndexThread(qs[start:stop], batch_size, solango.Index, commit)
-        t.start()
+    return ParallelReindexer(workers, batch_size).run([qs])
 
 def test_reindex():
     import solango
@@ -162,4 +157,12 @@ def test_reindex():
             doc.to_add_xml()
             
         elapsed = datetime.datetime.now() - now
-        print "Elapsed Seconds ", elapsed.seconds
\ No newline at end of file
+        print "Elapsed Seconds ", elapsed.seconds
+        
+        serializer = document.get_serializer()
+        now = datetime.datetime.now()
+        for instance in model._default_manager.iterator():
+            serializer.to_add_xml(serializer.bare(instance))
+        
+        elapsed = datetime.datetime.now() - now
+        print "Elapsed Seconds (compiled) ", elapsed.seconds
\ No newline at end of file